@@ -0,0 +1,357 @@
+"""Статический анализ машинного кода: граф потока управления, глубина стеков и оценка тактов без моделирования.
+
+Программа разбивается на подпрограммы: точку входа (адрес 0) и цели `call`. Для каждой подпрограммы строятся
+базовые блоки и вычисляются:
+
+- глубина стека данных относительно входа: наибольшая, наименьшая (отрицательная -- подпрограмма снимает
+  значения, положенные вызывающей) и глубина на `ret`;
+- глубина стека вызовов: наибольшее число вложенных `call`;
+- такты каждого базового блока по длинам микропрограмм `m_program` и границы тактов от входа до `ret` или
+  `hlt` с учётом вызовов. Нижняя граница есть всегда, верхняя -- только если в подпрограмме и во всех
+  вызываемых из неё нет циклов и строкового ввода-вывода (`outs`, `ins`: такты зависят от длины строки,
+  нижняя граница считает строку пустой); для кода без ветвлений границы совпадают с тактами `simulation()`.
+
+Изменение глубины стеков каждой инструкцией (и её временный подъём внутри микропрограммы, как у `ins`)
+берётся из сигналов её микропрограммы, такты -- из
+`ControlUnit.instruction_ticks`. Если в инструкцию приходят пути с разной глубиной стека, анализ сообщает
+о несбалансированном цикле или ветвлении; глубины такой подпрограммы считаются по первому найденному пути.
+Завершение по пустому буферу ввода границы тактов не учитывают.
+
+`python3 analyzer.py <code_file> [--symbols <symbols_file>] [--stack N] [--call-stack N]` -- отчёт;
+код возврата 1, если найдены ошибки или программа не помещается в стеки заданного размера.
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import sys
+
+from image import is_image, load_program
+from isa import Opcode, Program, SymbolTable, as_program, read_code, read_symbols
+from machine import ControlUnit
+
+branches = {Opcode.JZ, Opcode.JNZ, Opcode.JS, Opcode.JNS}
+# Инструкции, которые завершают базовый блок
+transfers = {Opcode.JMP, Opcode.CALL, Opcode.RET, Opcode.HLT, *branches}
+# Инструкции с циклом микропрограммы: число тактов зависит от длины строки
+streams = {Opcode.OUTS, Opcode.INS}
+
+
+class BasicBlock:
+    """Инструкции `[start, end)` без переходов внутрь и наружу, кроме последней."""
+
+    def __init__(self, start: int, end: int, ticks: int, successors: list[int]):
+        self.start = start
+        self.end = end
+        # Такты собственных инструкций блока, без вызываемых подпрограмм
+        self.ticks = ticks
+        self.successors = successors
+
+
+class Function:
+    """Подпрограмма с входом `entry` и результаты её анализа."""
+
+    def __init__(self, entry: int, name: str):
+        self.entry = entry
+        self.name = name
+        # Глубина стека данных перед каждой достижимой инструкцией, относительно входа
+        self.depths: dict[int, int] = {}
+        self.blocks: dict[int, BasicBlock] = {}
+        self.max_depth = 0
+        self.min_depth = 0
+        # Глубина стека после `ret`; None -- подпрограмма не возвращает управление
+        self.effect: int | None = None
+        # Наибольшее число вложенных вызовов; None -- рекурсия
+        self.call_depth: int | None = 0
+        self.calls: set[int] = set()
+        self.min_ticks: int | None = None
+        self.max_ticks: int | None = None
+        self.loop_heads: set[int] = set()
+        # Инструкции, в которые пришли пути с разной глубиной стека: адрес -> (первая глубина, другая глубина)
+        self.conflicts: dict[int, tuple[int, int]] = {}
+        # Глубины стека не зависят от пути -- ни в подпрограмме, ни в вызываемых из неё нет таких инструкций
+        self.balanced = True
+        self.issues: list[str] = []
+
+
+class Analyzer:
+    def __init__(self, program, labels: dict[str, int] | None = None):
+        self.program: Program = as_program(program)
+        self.symbols = SymbolTable(labels)
+        self.ticks = ControlUnit.instruction_ticks()
+        self.effects = ControlUnit.instruction_effects()
+        self.peaks = ControlUnit.instruction_peaks()
+        self.functions: dict[int, Function] = {}
+        # Подпрограммы, анализ которых ещё не закончен: вызов одной из них -- рекурсия
+        self.in_progress: set[int] = set()
+        self.main = self.function(0)
+
+    def function(self, entry: int) -> Function:
+        function = self.functions.get(entry)
+        if function is None:
+            function = self.functions[entry] = Function(entry, self.symbols.names.get(entry, str(entry)))
+            self.in_progress.add(entry)
+            self.analyze_stack(function)
+            self.build_blocks(function)
+            self.analyze_ticks(function)
+            self.in_progress.discard(entry)
+        return function
+
+    def targets(self, pc: int) -> list[int]:
+        """Адреса, на которые инструкция `pc` передаёт управление внутри подпрограммы."""
+        opcode, arg = self.program.opcodes[pc], self.program.args[pc]
+        if opcode == Opcode.JMP:
+            return [arg]
+        if opcode in branches:
+            return [arg, pc + 1]
+        if opcode in (Opcode.RET, Opcode.HLT):
+            return []
+        return [pc + 1]
+
+    def call(self, function: Function, entry: int) -> tuple[int, int, int | None]:
+        """Наименьшая, наибольшая и итоговая глубина стека вызова `entry` относительно вызывающей."""
+        function.calls.add(entry)
+        if entry in self.in_progress:
+            function.issues.append("recursive call of {}".format(self.symbols.location(entry)))
+            function.call_depth = None
+            return 0, 0, 0
+        callee = self.function(entry)
+        function.balanced = function.balanced and callee.balanced
+        if function.call_depth is not None:
+            function.call_depth = None if callee.call_depth is None else max(function.call_depth, callee.call_depth + 1)
+        return callee.min_depth, callee.max_depth, callee.effect
+
+    def step(self, function: Function, pc: int, depth: int) -> list[tuple[int, int]]:
+        """Глубина после инструкции `pc`; возвращает следующие инструкции с глубиной стека перед ними."""
+        opcode, arg = self.program.opcodes[pc], self.program.args[pc]
+        after = depth + self.effects[opcode][0]
+        # Внутри микропрограммы глубина может временно превышать итоговую (адрес строки в цикле ins)
+        low, high = after, max(after, depth + self.peaks[opcode])
+        if opcode == Opcode.CALL:
+            low, high, effect = self.call(function, arg)
+            low, high, after = depth + low, depth + high, None if effect is None else depth + effect
+        function.min_depth = min(function.min_depth, low)
+        function.max_depth = max(function.max_depth, high)
+        if opcode == Opcode.RET:
+            if function.entry == 0:
+                function.issues.append("ret outside of a subroutine at {}".format(self.symbols.location(pc)))
+            elif function.effect is None:
+                function.effect = after
+            elif function.effect != after:
+                function.issues.append(
+                    "returns with stack depths {} and {} at {}".format(
+                        function.effect, after, self.symbols.location(pc)
+                    )
+                )
+        if after is None:
+            return []
+        return [(target, after) for target in self.targets(pc)]
+
+    def analyze_stack(self, function: Function):
+        depths = function.depths
+        pending = [(function.entry, 0)]
+        while pending:
+            pc, depth = pending.pop()
+            if pc in depths:
+                if depths[pc] != depth:
+                    function.conflicts.setdefault(pc, (depths[pc], depth))
+                    function.balanced = False
+                continue
+            if not 0 <= pc < len(self.program):
+                function.issues.append("control leaves the program at {}".format(pc))
+                continue
+            depths[pc] = depth
+            pending.extend(self.step(function, pc, depth))
+
+    def leaders(self, function: Function) -> set[int]:
+        """Начала базовых блоков: вход, цели переходов и инструкции после передачи управления."""
+        leaders = {function.entry}
+        for pc in function.depths:
+            opcode = self.program.opcodes[pc]
+            if opcode in transfers:
+                leaders.update(self.targets(pc))
+                leaders.add(pc + 1)
+        return leaders & function.depths.keys()
+
+    def build_blocks(self, function: Function):
+        depths = function.depths
+        leaders = self.leaders(function)
+        for start in sorted(leaders):
+            end, ticks = start, 0
+            while True:
+                ticks += self.ticks[self.program.opcodes[end]]
+                end += 1
+                if end in leaders or end not in depths:
+                    break
+            successors = [target for target in self.targets(end - 1) if target in depths]
+            function.blocks[start] = BasicBlock(start, end, ticks, successors)
+
+        function.loop_heads = self.loop_heads(function)
+        for pc, (first, second) in sorted(function.conflicts.items()):
+            if pc in function.loop_heads:
+                template = "loop at {} changes stack depth: {} -> {}"
+            else:
+                template = "paths join at {} with stack depths {} and {}"
+            function.issues.append(template.format(self.symbols.location(pc), first, second))
+
+    def postorder(self, function: Function) -> list[int]:
+        """Блоки в обратном топологическом порядке обхода в глубину от входа."""
+        blocks = function.blocks
+        order, visited = [], {function.entry}
+        stack = [(function.entry, iter(blocks[function.entry].successors))]
+        while stack:
+            start, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(start)
+        return order
+
+    def loop_heads(self, function: Function) -> set[int]:
+        """Начала циклов: блоки, на которые ведёт обратная дуга обхода в глубину."""
+        position = {start: index for index, start in enumerate(self.postorder(function))}
+        return {
+            successor
+            for start, block in function.blocks.items()
+            for successor in block.successors
+            if position[successor] >= position[start]
+        }
+
+    def block_ticks(self, block: BasicBlock) -> tuple[int, int | None]:
+        """Наименьшие и наибольшие такты блока вместе с подпрограммой, которую вызывает его последняя инструкция."""
+        last = block.end - 1
+        opcodes = self.program.opcodes[block.start : block.end]
+        high = None if streams.intersection(opcodes) else block.ticks
+        if opcodes[-1] != Opcode.CALL:
+            return block.ticks, high
+        callee = self.functions[self.program.args[last]]
+        if callee.entry in self.in_progress:
+            # Рекурсивный вызов
+            return block.ticks, None
+        high = None if high is None or callee.max_ticks is None else high + callee.max_ticks
+        return block.ticks + (callee.min_ticks or 0), high
+
+    def analyze_ticks(self, function: Function):
+        costs = {start: self.block_ticks(block) for start, block in function.blocks.items()}
+        if not costs:
+            return
+        function.min_ticks = self.shortest_path(function, costs)
+        if not function.loop_heads and all(high is not None for _, high in costs.values()):
+            function.max_ticks = self.longest_path(function, costs)
+
+    def shortest_path(self, function: Function, costs: dict[int, tuple[int, int | None]]) -> int | None:
+        """Нижняя граница тактов: кратчайший путь от входа до блока без последователей (ret, hlt, вызов без возврата)."""
+        blocks = function.blocks
+        distances = {function.entry: costs[function.entry][0]}
+        queue = [(distances[function.entry], function.entry)]
+        while queue:
+            distance, start = heapq.heappop(queue)
+            if distance > distances[start]:
+                continue
+            if not blocks[start].successors:
+                return distance
+            for successor in blocks[start].successors:
+                candidate = distance + costs[successor][0]
+                if successor not in distances or candidate < distances[successor]:
+                    distances[successor] = candidate
+                    heapq.heappush(queue, (candidate, successor))
+        return None
+
+    def longest_path(self, function: Function, costs: dict[int, tuple[int, int | None]]) -> int:
+        """Верхняя граница тактов для ациклического графа: самый длинный путь от входа."""
+        longest: dict[int, int] = {}
+        for start in self.postorder(function):
+            successors = function.blocks[start].successors
+            longest[start] = costs[start][1] + max((longest[successor] for successor in successors), default=0)
+        return longest[function.entry]
+
+    def check(self, stack_capacity: int = 24, call_stack_capacity: int = 16) -> list[str]:
+        """Ошибки анализа всех подпрограмм и проверка, что программа помещается в стеки заданного размера."""
+        issues = [
+            "{}: {}".format(function.name, issue) for function in self.functions.values() for issue in function.issues
+        ]
+        main = self.main
+        # Без баланса глубины посчитаны по одному из путей и о переполнении ничего не говорят
+        if main.balanced and main.max_depth > stack_capacity:
+            issues.append("stack depth {} exceeds capacity {}".format(main.max_depth, stack_capacity))
+        if main.balanced and main.min_depth < 0:
+            issues.append("stack underflow: depth {}".format(main.min_depth))
+        if main.call_depth is None:
+            issues.append("call depth is unbounded")
+        elif main.call_depth > call_stack_capacity:
+            issues.append("call depth {} exceeds capacity {}".format(main.call_depth, call_stack_capacity))
+        return issues
+
+    def report(self, stack_capacity: int = 24, call_stack_capacity: int = 16) -> str:
+        def bound(value):
+            return "-" if value is None else str(value)
+
+        lines = [
+            "stack depth: {} call depth: {} ticks: {}..{}".format(
+                bound(self.main.max_depth if self.main.balanced else None),
+                bound(self.main.call_depth),
+                bound(self.main.min_ticks),
+                bound(self.main.max_ticks),
+            ),
+            "",
+            "functions:",
+            "{:>7} {:>5} {:>5} {:>5} {:>5} {:>10} {:>10}  {}".format(
+                "entry", "max", "min", "ret", "calls", "min ticks", "max ticks", "function"
+            ),
+        ]
+        for function in sorted(self.functions.values(), key=lambda function: function.entry):
+            lines.append(
+                "{:>7} {:>5} {:>5} {:>5} {:>5} {:>10} {:>10}  {}".format(
+                    function.entry,
+                    function.max_depth,
+                    function.min_depth,
+                    bound(function.effect),
+                    bound(function.call_depth),
+                    bound(function.min_ticks),
+                    bound(function.max_ticks),
+                    function.name,
+                )
+            )
+
+        lines += ["", "blocks:", "{:>7} {:>7} {:>7}  {}".format("start", "end", "ticks", "successors")]
+        for function in sorted(self.functions.values(), key=lambda function: function.entry):
+            for start, block in sorted(function.blocks.items()):
+                lines.append(
+                    "{:>7} {:>7} {:>7}  {}{} ({})".format(
+                        start,
+                        block.end,
+                        block.ticks,
+                        ", ".join(map(str, block.successors)) or "-",
+                        " loop" if start in function.loop_heads else "",
+                        self.symbols.location(start),
+                    )
+                )
+
+        issues = self.check(stack_capacity, call_stack_capacity)
+        lines += ["", "issues: {}".format(len(issues)), *issues]
+        return "\n".join(lines)
+
+
+def main(code_file, symbols_file=None, stack_capacity=24, call_stack_capacity=16) -> int:
+    if is_image(code_file):
+        code, _, labels = load_program(code_file, symbols_file=symbols_file)
+    else:
+        code, labels = read_code(code_file), read_symbols(symbols_file) if symbols_file is not None else None
+    analyzer = Analyzer(code, labels)
+    print(analyzer.report(stack_capacity, call_stack_capacity))
+    return 1 if analyzer.check(stack_capacity, call_stack_capacity) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Static stack depth, call depth and tick analysis")
+    parser.add_argument("code_file", help="machine code or program image")
+    parser.add_argument("--symbols", help="symbol table written by translator.py")
+    parser.add_argument("--stack", type=int, default=24, help="data stack capacity to check against")
+    parser.add_argument("--call-stack", type=int, default=16, help="call stack capacity to check against")
+    args = parser.parse_args()
+    sys.exit(main(args.code_file, args.symbols, args.stack, args.call_stack))
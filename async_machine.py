@@ -0,0 +1,207 @@
+"""Моделирование в цикле событий asyncio: ввод из пустого порта приостанавливает машину до прихода данных.
+
+`AsyncMachine` -- модель с точностью до инструкции (`machine.InstructionMachine`), которая выполняется
+квантами по `slice_ticks` тактов и между квантами отдаёт управление циклу событий. Так в одном потоке
+по очереди работают тысячи машин. Порт `AsyncInputPort` вместо `EOFError` на пустом буфере приостанавливает
+машину до `feed()`; `EOFError` (завершение моделирования, как в `simulation()`) -- только после `close()`.
+Порт `AsyncOutputPort` пишет вывод в `asyncio.StreamWriter` в конце каждого кванта.
+
+Время ожидания ввода не тактируется: вывод и число тактов совпадают с `machine.simulation()` для того же ввода.
+
+`python3 async_machine.py <data_file> <code_file> [--host H] [--port P] [--slice N]` -- TCP-сервер:
+каждое соединение получает свою машину, ввод порта 0 читается из сокета, вывод порта 1 пишется в сокет.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+from collections.abc import Iterable
+
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from isa import read_code, read_data
+from machine import InstructionMachine
+from memory import PagedMemory, as_memory
+from ports import BufferPort, Port, flush_ports
+
+
+class InputPendingError(Exception):
+    """Данных в порту пока нет; `input` или `ins` будет выполнен заново, когда они придут."""
+
+    def __init__(self, port: AsyncInputPort):
+        super().__init__()
+        self.port = port
+
+
+class AsyncInputPort(BufferPort):
+    """Порт ввода, который пополняется во время моделирования через `feed()` и закрывается `close()`."""
+
+    def __init__(self, tokens: Iterable[str] = ()):
+        super().__init__(tokens)
+        self.closed = False
+        # Событие создаётся в wait(), внутри цикла событий, который будет его ждать
+        self.ready: asyncio.Event | None = None
+
+    def read(self) -> str:
+        if self.buffer:
+            return self.buffer.popleft()
+        if self.closed:
+            raise EOFError()
+        raise InputPendingError(self)
+
+    def feed(self, tokens: Iterable[str]):
+        self.buffer.extend(tokens)
+        if self.ready is not None:
+            self.ready.set()
+
+    def close(self):
+        self.closed = True
+        if self.ready is not None:
+            self.ready.set()
+
+    async def wait(self):
+        """Ждёт, пока в порту появятся данные или он будет закрыт."""
+        self.ready = asyncio.Event()
+        if not self.buffer and not self.closed:
+            await self.ready.wait()
+
+    async def pump(self, reader: asyncio.StreamReader, chunk_size: int = 1 << 12):
+        """Передаёт в порт данные из `reader` до конца потока, после чего закрывает порт."""
+        try:
+            while True:
+                chunk = await reader.read(chunk_size)
+                if not chunk:
+                    return
+                self.feed(chunk.decode("utf-8", errors="replace"))
+        finally:
+            self.close()
+
+
+class AsyncOutputPort(BufferPort):
+    """Порт вывода в `asyncio.StreamWriter`; без `writer` вывод остаётся в буфере, как у `BufferPort`."""
+
+    def __init__(self, writer: asyncio.StreamWriter | None = None):
+        super().__init__()
+        self.writer = writer
+
+    def flush(self):
+        if self.writer is not None and self.buffer:
+            self.writer.write(self.text().encode("utf-8"))
+            self.buffer.clear()
+
+    async def drain(self):
+        self.flush()
+        if self.writer is not None:
+            await self.writer.drain()
+
+
+class AsyncMachine(InstructionMachine):
+    """`InstructionMachine`, которую можно приостановить на вводе и выполнять квантами в цикле событий."""
+
+    __slots__ = ("outputs",)
+
+    outputs: list[AsyncOutputPort]
+
+    def run_slice(self, decoded, tick_limit: int):
+        """Выполняет инструкции, пока счётчик тактов меньше `tick_limit`."""
+        pc = self.pc
+        try:
+            while self._tick < tick_limit:
+                execute, arg, ticks = decoded[pc]
+                pc = execute(pc, arg)
+                self._tick += ticks
+        finally:
+            # При InputPendingError `pc` остаётся на инструкции ввода: input не изменил состояние и выполнится
+            # заново, ins продолжит с непрочитанного символа (см. `InstructionMachine.op_ins`)
+            self.pc = pc
+
+    async def drain(self):
+        for port in self.outputs:
+            await port.drain()
+
+    async def run_async(self, slice_ticks: int = 10000) -> str:
+        """Моделирование до останова; возвращает причину: `halt` или `input_exhausted`."""
+        decoded = self.decode()
+        # Между квантами сбрасываются только асинхронные порты, остальные устройства -- в конце
+        self.outputs = [port for port in self.io_ports.values() if isinstance(port, AsyncOutputPort)]
+        try:
+            while True:
+                try:
+                    self.run_slice(decoded, self._tick + slice_ticks)
+                except InputPendingError as pending:
+                    await self.drain()
+                    await pending.port.wait()
+                else:
+                    await self.drain()
+                    # Квант исчерпан: очередь другим машинам цикла событий
+                    await asyncio.sleep(0)
+        except EOFError:
+            return "input_exhausted"
+        except StopIteration:
+            return "halt"
+        finally:
+            flush_ports(self.io_ports)
+            await self.drain()
+
+
+def make_machine(
+    code, data, input_port: Port, devices: dict[int, Port] | None = None, geometry: Geometry | None = None
+) -> AsyncMachine:
+    """Машина с отдельной копией памяти данных `data` и портом ввода `input_port`."""
+    geometry = geometry or Geometry()
+    return AsyncMachine(
+        code,
+        as_memory(data).copy(),
+        input_port,
+        geometry.stack_capacity,
+        geometry.call_stack_capacity,
+        devices,
+        geometry=geometry,
+    )
+
+
+async def run_machines(machines: list[AsyncMachine], slice_ticks: int = 10000) -> list[tuple[str, str, int]]:
+    """Запускает машины совместно в текущем цикле событий; для каждой -- (причина останова, вывод, такты)."""
+    reasons = await asyncio.gather(*(machine.run_async(slice_ticks) for machine in machines))
+    return [(reason, machine.io_ports[1].text(), machine.current_tick()) for reason, machine in zip(reasons, machines)]
+
+
+async def serve_connection(
+    code, data, slice_ticks, geometry, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    input_port = AsyncInputPort()
+    # Счётчики выгрузок у каждого соединения свои
+    geometry = Geometry(geometry.stack_capacity, geometry.call_stack_capacity, geometry.spill, geometry.spill_ticks)
+    machine = make_machine(code, data, input_port, {1: AsyncOutputPort(writer)}, geometry)
+    pump = asyncio.ensure_future(input_port.pump(reader))
+    try:
+        reason = await machine.run_async(slice_ticks)
+        logging.info("%s: %s, ticks: %d", writer.get_extra_info("peername"), reason, machine.current_tick())
+    finally:
+        pump.cancel()
+        writer.close()
+
+
+async def serve(code_file, data_file, host, port, slice_ticks, geometry: Geometry | None = None):
+    code = read_code(code_file)
+    data = PagedMemory(read_data(data_file))
+    geometry = geometry or Geometry()
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_connection(code, data, slice_ticks, geometry, reader, writer), host, port
+    )
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the program over TCP, one machine per connection")
+    parser.add_argument("data_file")
+    parser.add_argument("code_file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--slice", type=int, default=10000, help="ticks a machine runs before yielding")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    asyncio.run(serve(args.code_file, args.data_file, args.host, args.port, args.slice, geometry_from_arguments(args)))
@@ -0,0 +1,136 @@
+"""Пакетный запуск: много пар (программа, ввод) на пуле процессов.
+
+Манифест -- файл JSON Lines, одна задача на строку:
+`{"id": "...", "code": "target_code.o", "data": "target_data.o", "input": "input.txt", "engine": "instr"}`.
+`id` и `engine` необязательны (по умолчанию -- номер строки и `instr`), относительные пути
+отсчитываются от каталога манифеста. Результаты выводятся в stdout строками JSON:
+`{"id": ..., "output": ..., "ticks": ..., "termination": "halt" | "input_exhausted" | "error", "error": ...}`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from isa import Program, read_code, read_data
+from jit import BlockCompiler, BlockMachine
+from machine import ControlUnit, DataPath, InstructionMachine
+from memory import PagedMemory
+from ports import flush_ports
+
+# Образы программ, уже загруженные этим процессом: (код, данные) -> (программа, начальная память данных)
+images: dict[tuple[str, str], tuple[Program, PagedMemory]] = {}
+
+
+def load_image(code_file: str, data_file: str) -> tuple[Program, PagedMemory]:
+    key = (code_file, data_file)
+    if key not in images:
+        images[key] = (read_code(code_file), PagedMemory(read_data(data_file)))
+    return images[key]
+
+
+def run_control_unit(control_unit: ControlUnit):
+    while True:
+        control_unit.execute_microprogram()
+        control_unit.tick()
+
+
+def make_machine(engine: str, program: Program, data: PagedMemory, input_tokens: list[str], geometry: Geometry):
+    """Модель процессора и функция, выполняющая её до останова."""
+    stack, call_stack = geometry.stack_capacity, geometry.call_stack_capacity
+    if engine == "mc":
+        control_unit = ControlUnit(program, DataPath(data, stack, input_tokens, geometry=geometry), call_stack)
+        return control_unit, control_unit.data_path.io_ports, lambda: run_control_unit(control_unit)
+    if engine == "jit":
+        assert not geometry.spill, "jit engine does not model stack spilling"
+        compiler = BlockCompiler(
+            program,
+            ControlUnit.instruction_ticks(),
+            ControlUnit.input_eof_ticks(),
+            ControlUnit.loop_ticks(),
+            stack,
+            call_stack,
+        )
+        machine = BlockMachine(compiler, data, input_tokens)
+    else:
+        assert engine == "instr", "Unknown engine: {}".format(engine)
+        machine = InstructionMachine(program, data, input_tokens, stack, call_stack, geometry=geometry)
+    return machine, machine.io_ports, machine.run
+
+
+def run_job(job: dict, geometry: Geometry | None = None) -> dict:
+    """Выполняет одну задачу манифеста; каждой задаче достаётся своя копия памяти данных.
+
+    Любая ошибка задачи (в том числе при чтении её файлов) попадает в её результат и не прерывает
+    остальные задачи пакета.
+    """
+    result = {"id": job["id"], "termination": "halt", "output": "", "ticks": 0}
+    machine = io_ports = None
+    try:
+        program, data = load_image(job["code"], job["data"])
+        with open(job["input"], encoding="utf-8") as file:
+            input_tokens = list(file.read())
+        engine = job.get("engine", "instr")
+        machine, io_ports, run = make_machine(engine, program, data.copy(), input_tokens, geometry or Geometry())
+        run()
+    except EOFError:
+        result["termination"] = "input_exhausted"
+    except StopIteration:
+        pass
+    except Exception as e:
+        result["termination"] = "error"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+
+    if machine is not None:
+        flush_ports(io_ports)
+        result["output"] = io_ports[1].text()
+        result["ticks"] = machine.current_tick()
+    return result
+
+
+def read_manifest(manifest_file: str) -> list[dict]:
+    base = Path(manifest_file).parent
+    jobs = []
+    with open(manifest_file, encoding="utf-8") as file:
+        for number, line in enumerate(file):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", number)
+            for key in ("code", "data", "input"):
+                job[key] = str(base / job[key])
+            jobs.append(job)
+    return jobs
+
+
+def run_batch(
+    jobs: Iterable[dict], workers: int | None = None, ordered: bool = False, geometry: Geometry | None = None
+) -> Iterator[dict]:
+    """Результаты задач по мере готовности или, при `ordered`, в порядке задач.
+
+    `workers` по умолчанию -- число ядер процессора; `geometry` -- общая для всех задач геометрия стеков
+    (каждая задача получает свою копию со своими счётчиками).
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, geometry) for job in jobs]
+        for future in futures if ordered else as_completed(futures):
+            yield future.result()
+
+
+def main(manifest_file, workers=None, ordered=False, geometry=None):
+    for result in run_batch(read_manifest(manifest_file), workers, ordered, geometry):
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many processor model jobs in parallel")
+    parser.add_argument("manifest_file", help="JSON Lines file with code, data and input paths per job")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--ordered", action="store_true", help="print results in manifest order")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    main(args.manifest_file, args.workers, args.ordered, geometry_from_arguments(args))
@@ -0,0 +1,255 @@
+"""Набор замеров производительности транслятора и моделей процессора на машине, где они запускаются.
+
+`python3 bench.py [--scale S] [--engines mc,instr,jit] [--repeat N] [--output results.json]
+[--baseline baseline.json] [--threshold 0.1] [--no-memory]`
+
+Нагрузки -- примеры из `examples/` и синтетические программы, размер которых растёт с `--scale`:
+длинный цикл, цепочка вложенных вызовов, `load/store` в цикле, поток ввода через порт 0 и трансляция
+исходника с большой таблицей строк. Для моделирования печатаются такты и инструкции в секунду,
+для трансляции -- МБ/с, для обоих -- пиковая память (tracemalloc, отдельным прогоном).
+Результаты сохраняются в JSON; с `--baseline` они сравниваются с сохранёнными, и замедление больше
+`--threshold` считается регрессией (код возврата 1).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from itertools import chain
+from pathlib import Path
+
+import machine
+import translator
+from profiler import profile
+
+EXAMPLES_DIR = Path(__file__).parent / "examples"
+
+example_inputs = {"cat": "foo\nbar\n", "hello_alice": "Alice\n", "hello_world": "", "prob2": ""}
+
+
+def loop_source(iterations: int) -> str:
+    return """.text
+_main:
+    push {}
+loop:
+    dec
+    swap
+    pop
+    jnz loop
+    hlt
+""".format(iterations)
+
+
+def calls_source(iterations: int, depth: int = 15) -> str:
+    lines = [".text", "_main:", "    push {}".format(iterations), "outer:", "    call f1"]
+    lines += ["    dec", "    swap", "    pop", "    jnz outer", "    hlt"]
+    for level in range(1, depth):
+        lines += ["f{}:".format(level), "    call f{}".format(level + 1), "    ret"]
+    lines += ["f{}:".format(depth), "    ret"]
+    return "\n".join(lines) + "\n"
+
+
+def memory_source(words: int) -> str:
+    return """.data
+buffer: res {}
+.text
+_main:
+    push {}
+loop:
+    push 7
+    store
+    pop
+    load
+    pop
+    dec
+    swap
+    pop
+    jnz loop
+    hlt
+""".format(words + 1, words)
+
+
+def data_table_source(size: int, seed: int = 0) -> str:
+    """Исходник размером около `size` байт: строки с запятыми и `;` внутри кавычек, числа, `res`."""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz ,;:!?"
+    lines = [".data"]
+    length = 6
+    index = 0
+    while length < size:
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(1000, 4000)))
+        line = 'str_{}: "{}", {}, res {}, "{}", 0 ; comment {}'.format(
+            index, text, rng.randint(-(1 << 31), (1 << 31) - 1), rng.randint(1, 8), text[::-1], index
+        )
+        lines.append(line)
+        length += len(line) + 1
+        index += 1
+
+    lines += [".text", "_main:"]
+    for label in range(index):
+        lines += ["    push str_{}".format(label), "    call print", "    pop"]
+    lines += ["    hlt", "print:", "    load ; символ строки", "    output 1", "    ret"]
+    return "\n".join(lines) + "\n"
+
+
+def simulation_workloads(scale: float) -> dict[str, tuple[str, str]]:
+    """Имя нагрузки -> (исходник, ввод)."""
+    workloads = {}
+    for name, input_text in example_inputs.items():
+        workloads["example/" + name] = ((EXAMPLES_DIR / (name + ".asm")).read_text(encoding="utf-8"), input_text)
+    workloads["synthetic/loop"] = (loop_source(max(1, int(20000 * scale))), "")
+    workloads["synthetic/calls"] = (calls_source(max(1, int(1000 * scale))), "")
+    workloads["synthetic/memory"] = (memory_source(max(1, int(5000 * scale))), "")
+    stream = "".join(random.Random(0).choice("abcdefgh \n") for _ in range(max(1, int(20000 * scale))))
+    workloads["synthetic/input_stream"] = ((EXAMPLES_DIR / "cat.asm").read_text(encoding="utf-8"), stream)
+    return workloads
+
+
+def measure(function: Callable[[], object], repeat: int, memory: bool) -> tuple[float, object, int | None]:
+    """Лучшее время из `repeat` прогонов, результат и пиковая память отдельного прогона под tracemalloc."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, result, peak
+
+
+def bench_simulation(source: str, input_text: str, engine: str, repeat: int, memory: bool) -> dict[str, float]:
+    data, code = translator.translate(source)
+    memory_image = list(chain.from_iterable(data.values()))
+    _, _, counter = profile(code, list(memory_image), list(input_text))
+    instructions = sum(counter.executions)
+
+    seconds, (_, ticks), peak = measure(
+        lambda: machine.simulation(code, list(memory_image), list(input_text), engine), repeat, memory
+    )
+    result = {
+        "ticks": ticks,
+        "instructions": instructions,
+        "seconds": seconds,
+        "ticks_per_second": ticks / seconds,
+        "instructions_per_second": instructions / seconds,
+    }
+    if peak is not None:
+        result["peak_memory_bytes"] = peak
+    return result
+
+
+def bench_translation(source: str, repeat: int, memory: bool) -> dict[str, float]:
+    seconds, _, peak = measure(lambda: translator.translate(source), repeat, memory)
+    size = len(source.encode("utf-8"))
+    result = {"bytes": size, "seconds": seconds, "mb_per_second": size / (1 << 20) / seconds}
+    if peak is not None:
+        result["peak_memory_bytes"] = peak
+    return result
+
+
+def run_suite(scale: float = 1.0, engines=("mc", "instr", "jit"), repeat: int = 3, memory: bool = True) -> dict:
+    results: dict[str, dict[str, float]] = {}
+    for name, (source, input_text) in simulation_workloads(scale).items():
+        for engine in engines:
+            results["{}/{}".format(name, engine)] = bench_simulation(source, input_text, engine, repeat, memory)
+    results["translate/data_table"] = bench_translation(data_table_source(int(scale * (1 << 20))), repeat, memory)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "results": results,
+    }
+
+
+# Метрика, по которой сравниваются прогоны: больше -- лучше
+throughput_metrics = ("ticks_per_second", "mb_per_second")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[tuple[str, float, float]]:
+    """Регрессии: (нагрузка, значение в базовом прогоне, текущее значение) для замедлившихся больше `threshold`."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric in throughput_metrics:
+            if metric in result and metric in base and result[metric] < base[metric] * (1 - threshold):
+                regressions.append((name, base[metric], result[metric]))
+    return regressions
+
+
+def report(suite: dict) -> str:
+    lines = [
+        "{:<34} {:>10} {:>12} {:>12} {:>10} {:>10}".format("workload", "ticks", "ticks/s", "instr/s", "MB/s", "peak KB")
+    ]
+    for name, result in suite["results"].items():
+        peak = result.get("peak_memory_bytes")
+        lines.append(
+            "{:<34} {:>10} {:>12.0f} {:>12.0f} {:>10.2f} {:>10}".format(
+                name,
+                result.get("ticks", "-"),
+                result.get("ticks_per_second", 0),
+                result.get("instructions_per_second", 0),
+                result.get("mb_per_second", 0),
+                "-" if peak is None else peak // 1024,
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(scale, engines, repeat, memory, output_file=None, baseline_file=None, threshold=0.1) -> int:
+    # Предупреждения моделей о пустом буфере ввода -- штатное завершение нагрузок
+    logging.getLogger().setLevel(logging.ERROR)
+    suite = run_suite(scale, engines, repeat, memory)
+    print(report(suite))
+    if output_file is not None:
+        with open(output_file, "w", encoding="utf-8") as file:
+            json.dump(suite, file, indent=2)
+    if baseline_file is None:
+        return 0
+
+    with open(baseline_file, encoding="utf-8") as file:
+        baseline = json.load(file)
+    # Время компиляции блоков и прочие постоянные затраты не масштабируются, поэтому сравнимы только одинаковые размеры
+    assert baseline["scale"] == suite["scale"], "Baseline was recorded with --scale {}".format(baseline["scale"])
+    regressions = compare(baseline, suite, threshold)
+    for name, before, after in regressions:
+        print("regression: {} {:.0f} -> {:.0f} ({:+.1%})".format(name, before, after, after / before - 1))
+    print("regressions:", len(regressions), "threshold: {:.0%}".format(threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host performance benchmarks")
+    parser.add_argument("--scale", type=float, default=1.0, help="size of the synthetic workloads")
+    parser.add_argument("--engines", default="mc,instr,jit", help="comma-separated simulation engines")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per workload, the best time is reported")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory runs")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="compare against results saved earlier with --output")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown before a regression")
+    args = parser.parse_args()
+    sys.exit(
+        main(
+            args.scale,
+            args.engines.split(","),
+            args.repeat,
+            not args.no_memory,
+            args.output,
+            args.baseline,
+            args.threshold,
+        )
+    )
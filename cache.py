@@ -0,0 +1,120 @@
+"""Модель кэша памяти данных.
+
+Кэш моделирует только время доступа и статистику: значения всегда читаются и пишутся в память данных,
+поэтому результат программы с кэшем и без него одинаков, а к счётчику тактов добавляются задержки промахов.
+"""
+
+from __future__ import annotations
+
+import random
+
+replacement_policies = ("lru", "fifo", "random")
+write_policies = ("back", "through")
+
+
+class Cache:
+    """Множественно-ассоциативный кэш: `size` и `line_size` -- в машинных словах, `ways` -- ассоциативность.
+
+    - `policy` -- вытеснение: `lru`, `fifo` или `random`;
+    - `write_policy` -- `back` (запись с размещением, грязные строки пишутся в память при вытеснении)
+      или `through` (каждая запись идёт в память, промах записи строку не размещает);
+    - `miss_penalty` -- такты на загрузку строки из памяти, `write_penalty` -- такты на запись в память.
+    """
+
+    def __init__(
+        self,
+        size: int = 64,
+        line_size: int = 4,
+        ways: int = 2,
+        policy: str = "lru",
+        write_policy: str = "back",
+        miss_penalty: int = 10,
+        write_penalty: int | None = None,
+        seed: int = 0,
+    ):
+        assert size > 0, "Cache size must be positive"
+        assert line_size > 0, "Cache line size must be positive"
+        assert ways > 0, "Cache associativity must be positive"
+        assert size % (line_size * ways) == 0, "Cache size must be a multiple of line_size * ways"
+        assert policy in replacement_policies, "Unknown replacement policy: {}".format(policy)
+        assert write_policy in write_policies, "Unknown write policy: {}".format(write_policy)
+        self.size = size
+        self.line_size = line_size
+        self.ways = ways
+        self.policy = policy
+        self.write_policy = write_policy
+        self.miss_penalty = miss_penalty
+        self.write_penalty = miss_penalty if write_penalty is None else write_penalty
+        self.random = random.Random(seed)
+        self.sets_count = size // (line_size * ways)
+        # Для каждого набора: тег строки -> признак "грязная"; порядок ключей -- порядок вытеснения
+        self.sets: list[dict[int, bool]] = [{} for _ in range(self.sets_count)]
+        self.read_hits = 0
+        self.read_misses = 0
+        self.write_hits = 0
+        self.write_misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.stall_ticks = 0
+
+    def locate(self, address: int) -> tuple[dict[int, bool], int]:
+        line = address // self.line_size
+        return self.sets[line % self.sets_count], line // self.sets_count
+
+    def touch(self, lines: dict[int, bool], tag: int):
+        if self.policy == "lru":
+            lines[tag] = lines.pop(tag)
+
+    def allocate(self, lines: dict[int, bool], tag: int, dirty: bool) -> int:
+        """Размещает строку в наборе, возвращает задержку вытеснения."""
+        penalty = 0
+        if len(lines) == self.ways:
+            victim = self.random.choice(list(lines)) if self.policy == "random" else next(iter(lines))
+            self.evictions += 1
+            if lines.pop(victim):
+                self.writebacks += 1
+                penalty = self.write_penalty
+        lines[tag] = dirty
+        return penalty
+
+    def read(self, address: int) -> int:
+        """Чтение слова; возвращает число тактов простоя."""
+        lines, tag = self.locate(address)
+        if tag in lines:
+            self.read_hits += 1
+            self.touch(lines, tag)
+            return 0
+        self.read_misses += 1
+        penalty = self.allocate(lines, tag, False) + self.miss_penalty
+        self.stall_ticks += penalty
+        return penalty
+
+    def write(self, address: int) -> int:
+        """Запись слова; возвращает число тактов простоя."""
+        lines, tag = self.locate(address)
+        write_back = self.write_policy == "back"
+        penalty = 0 if write_back else self.write_penalty
+        if tag in lines:
+            self.write_hits += 1
+            self.touch(lines, tag)
+            lines[tag] = lines[tag] or write_back
+        else:
+            self.write_misses += 1
+            if write_back:
+                penalty += self.allocate(lines, tag, True) + self.miss_penalty
+        self.stall_ticks += penalty
+        return penalty
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "read_hits": self.read_hits,
+            "read_misses": self.read_misses,
+            "write_hits": self.write_hits,
+            "write_misses": self.write_misses,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+            "stall_ticks": self.stall_ticks,
+        }
+
+    def __str__(self) -> str:
+        return " ".join("{}: {}".format(name, value) for name, value in self.stats().items())
@@ -0,0 +1,249 @@
+"""Контрольные точки потактовой модели: сохранение и восстановление полного состояния процессора.
+
+Контрольная точка -- `CHECKPOINT_MAGIC`, версия и сжатое zlib тело из чисел varint (см. `tracer.py`):
+такт, число выполненных инструкций, регистры `ControlUnit` и `DataPath`, стек вызовов, регистры стека,
+размер образа `.data` и выделенные страницы памяти данных, образ программы и содержимое буферных портов. По контрольной точке модель продолжает
+работу без повторного моделирования с нулевого такта; ввод можно заменить, чтобы запустить из одной
+точки несколько продолжений (`fork`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import zlib
+from array import array
+from collections.abc import Iterable
+
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from isa import Opcode, Program, read_code, read_data
+from machine import ControlUnit, DataPath
+from memory import PagedMemory
+from ports import BufferPort, Port, flush_ports
+from tracer import read_varint, write_varint
+
+CHECKPOINT_MAGIC = b"MCKP"
+CHECKPOINT_VERSION = 2
+
+# Регистры в порядке записи: (объект -- "cu" или "dp", атрибут)
+checkpoint_registers = (
+    ("cu", "_tick"),
+    ("cu", "pc"),
+    ("cu", "mpc"),
+    ("cu", "scp"),
+    ("dp", "tos"),
+    ("dp", "stack_pointer"),
+    ("dp", "swap_register"),
+    ("dp", "result_alu"),
+    ("dp", "cu_arg"),
+)
+
+
+def write_values(buf: bytearray, values: Iterable[int]):
+    values = list(values)
+    write_varint(buf, len(values))
+    for value in values:
+        write_varint(buf, value)
+
+
+def read_values(body: bytes, pos: int) -> tuple[list[int], int]:
+    count, pos = read_varint(body, pos)
+    values = []
+    for _ in range(count):
+        value, pos = read_varint(body, pos)
+        values.append(value)
+    return values, pos
+
+
+def write_memory(buf: bytearray, memory: PagedMemory):
+    write_varint(buf, memory.size)
+    write_varint(buf, len(memory.pages))
+    for number, page in memory.pages.items():
+        write_varint(buf, number)
+        write_values(buf, page)
+
+
+def read_memory(body: bytes, pos: int) -> tuple[PagedMemory, int]:
+    memory = PagedMemory()
+    memory.size, pos = read_varint(body, pos)
+    count, pos = read_varint(body, pos)
+    for _ in range(count):
+        number, pos = read_varint(body, pos)
+        words, pos = read_values(body, pos)
+        memory.pages[number] = array("i", words)
+    return memory, pos
+
+
+def snapshot(control_unit: ControlUnit, instructions: int = 0) -> bytes:
+    """Состояние процессора; `instructions` -- число инструкций, выполненных до этого такта."""
+    data_path = control_unit.data_path
+    assert data_path.cache is None, "checkpoints do not capture the data cache model"
+    assert data_path.geometry is None or not data_path.geometry.spill, "checkpoints do not capture stack spilling"
+    units = {"cu": control_unit, "dp": data_path}
+    body = bytearray()
+    write_varint(body, instructions)
+    for unit, name in checkpoint_registers:
+        write_varint(body, getattr(units[unit], name))
+    write_values(body, control_unit.call_stack)
+    write_values(body, data_path.stack_registers)
+    write_memory(body, data_path.data_memory)
+    write_varint(body, len(control_unit.program))
+    body += control_unit.program.opcodes.tobytes()
+    write_values(body, control_unit.program.args)
+
+    flush_ports(data_path.io_ports)
+    write_varint(body, len(data_path.io_ports))
+    for number, port in data_path.io_ports.items():
+        assert isinstance(port, BufferPort), "only buffer ports can be checkpointed (port {})".format(number)
+        encoded = port.text().encode("utf-8")
+        write_varint(body, number)
+        write_varint(body, len(encoded))
+        body += encoded
+    return CHECKPOINT_MAGIC + bytes([CHECKPOINT_VERSION]) + zlib.compress(bytes(body))
+
+
+def restore(
+    checkpoint: bytes, input_tokens: Iterable[str] | Port | None = None, devices: dict[int, Port] | None = None
+) -> tuple[ControlUnit, int]:
+    """Процессор в состоянии контрольной точки и число выполненных инструкций.
+
+    `input_tokens` заменяет оставшийся ввод порта 0, `devices` -- устройства на остальных портах.
+    """
+    assert checkpoint[:4] == CHECKPOINT_MAGIC, "Not a checkpoint"
+    assert checkpoint[4] == CHECKPOINT_VERSION, "Unsupported checkpoint version: {}".format(checkpoint[4])
+    body = zlib.decompress(checkpoint[5:])
+    instructions, pos = read_varint(body, 0)
+    registers = []
+    for _ in checkpoint_registers:
+        value, pos = read_varint(body, pos)
+        registers.append(value)
+    call_stack, pos = read_values(body, pos)
+    stack_registers, pos = read_values(body, pos)
+    data_memory, pos = read_memory(body, pos)
+    size, pos = read_varint(body, pos)
+    opcodes = array("B", body[pos : pos + size])
+    args, pos = read_values(body, pos + size)
+
+    ports: dict[int, BufferPort] = {}
+    count, pos = read_varint(body, pos)
+    for _ in range(count):
+        number, pos = read_varint(body, pos)
+        length, pos = read_varint(body, pos)
+        ports[number] = BufferPort(body[pos : pos + length].decode("utf-8"))
+        pos += length
+    if input_tokens is not None:
+        ports[0] = input_tokens if isinstance(input_tokens, Port) else BufferPort(input_tokens)
+    ports.update(devices or {})
+
+    data_path = DataPath(data_memory, len(stack_registers), ports[0], ports)
+    data_path.stack_registers = stack_registers
+    control_unit = ControlUnit(Program(opcodes, array("i", args)), data_path, len(call_stack))
+    control_unit.call_stack = call_stack
+    units = {"cu": control_unit, "dp": data_path}
+    for (unit, name), value in zip(checkpoint_registers, registers):
+        setattr(units[unit], name, value)
+    return control_unit, instructions
+
+
+def run_until(
+    control_unit: ControlUnit, tick: int | None = None, instructions: int | None = None, executed: int = 0
+) -> tuple[str, int]:
+    """Потактовое моделирование до такта `tick`, до начала инструкции номер `instructions` или до останова.
+
+    Возвращает причину остановки (`tick`, `instructions`, `halt`, `input_exhausted`) и число выполненных инструкций.
+    """
+    try:
+        while True:
+            if control_unit.mpc == 0:
+                if instructions is not None and executed >= instructions:
+                    return "instructions", executed
+                executed += 1
+            if tick is not None and control_unit.current_tick() >= tick:
+                return "tick", executed
+            control_unit.execute_microprogram()
+            control_unit.tick()
+    except EOFError:
+        return "input_exhausted", executed
+    except StopIteration:
+        # hlt выбирается, но не выполняется
+        return "halt", executed - 1
+
+
+def resume(control_unit: ControlUnit, executed: int = 0) -> tuple[str, int]:
+    """Моделирование до останова; возвращает вывод и число тактов, как `machine.simulation`."""
+    run_until(control_unit, executed=executed)
+    flush_ports(control_unit.data_path.io_ports)
+    return control_unit.data_path.io_ports[1].text(), control_unit.current_tick()
+
+
+def fork(checkpoint: bytes, inputs: Iterable[Iterable[str]]) -> list[tuple[str, int]]:
+    """Несколько продолжений из одной контрольной точки, каждое со своим оставшимся вводом."""
+    results = []
+    for input_tokens in inputs:
+        control_unit, executed = restore(checkpoint, list(input_tokens))
+        results.append(resume(control_unit, executed))
+    return results
+
+
+def main_save(code_file, data_file, input_file, checkpoint_file, tick=None, instructions=None, geometry=None):
+    """Размеры стеков из `geometry` сохраняются в контрольной точке; выгрузка стеков не поддерживается."""
+    geometry = geometry or Geometry()
+    assert not geometry.spill, "checkpoints do not capture stack spilling"
+    with open(input_file, encoding="utf-8") as file:
+        data_path = DataPath(read_data(data_file), geometry.stack_capacity, list(file.read()))
+    control_unit = ControlUnit(read_code(code_file), data_path, geometry.call_stack_capacity)
+    reason, executed = run_until(control_unit, tick, instructions)
+    with open(checkpoint_file, "wb") as file:
+        file.write(snapshot(control_unit, executed))
+    print(
+        "stopped:",
+        reason,
+        "tick:",
+        control_unit.current_tick(),
+        "instructions:",
+        executed,
+        "next:",
+        Opcode(control_unit.program.opcodes[control_unit.pc]).name,
+    )
+
+
+def main_resume(checkpoint_file, input_file=None):
+    with open(checkpoint_file, "rb") as file:
+        checkpoint = file.read()
+    input_tokens = None
+    if input_file is not None:
+        with open(input_file, encoding="utf-8") as file:
+            input_tokens = list(file.read())
+    output, ticks = resume(*restore(checkpoint, input_tokens))
+    print(output)
+    print("ticks:", ticks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Processor model checkpoints")
+    commands = parser.add_subparsers(dest="command", required=True)
+    save_parser = commands.add_parser("save", help="simulate up to a tick or instruction count and save the state")
+    save_parser.add_argument("data_file")
+    save_parser.add_argument("code_file")
+    save_parser.add_argument("input_file")
+    save_parser.add_argument("checkpoint_file")
+    stop = save_parser.add_mutually_exclusive_group(required=True)
+    stop.add_argument("--tick", type=int)
+    stop.add_argument("--instructions", type=int)
+    add_geometry_arguments(save_parser, spill=False)
+    resume_parser = commands.add_parser("resume", help="continue from a checkpoint until the program stops")
+    resume_parser.add_argument("checkpoint_file")
+    resume_parser.add_argument("input_file", nargs="?", help="replace the remaining input of port 0")
+    args = parser.parse_args()
+
+    if args.command == "save":
+        main_save(
+            args.code_file,
+            args.data_file,
+            args.input_file,
+            args.checkpoint_file,
+            args.tick,
+            args.instructions,
+            geometry_from_arguments(args),
+        )
+    else:
+        main_resume(args.checkpoint_file, args.input_file)
@@ -0,0 +1,332 @@
+"""Отладчик потактовой модели: точки останова, наблюдение за памятью данных и портами, пошаговое выполнение.
+
+Хуки встраиваются в декодированный микрокод `ControlUnit` только там, где они нужны: проверка точек останова
+и счётчика инструкций -- в микрокоманду выборки, наблюдение за памятью -- в микрокоманды чтения и записи
+памяти данных, за портами -- в микрокоманды ввода и вывода (`input`, `output`, `ins`, `outs`). Остальные
+микрокоманды выполняются без изменений, а `simulation()` отладчик не затрагивает вовсе.
+
+Точка останова и счётчик инструкций останавливают модель перед выборкой инструкции, наблюдение -- перед
+выборкой следующей инструкции, когда инструкция с обращением выполнена целиком.
+
+`python3 debugger.py <data_file> <code_file> <input_file> [--symbols <symbols_file>]` -- интерактивный
+отладчик (`help` -- список команд).
+"""
+
+from __future__ import annotations
+
+import argparse
+import cmd
+from collections.abc import Callable
+from itertools import repeat
+
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from image import load_program, program_arguments
+from isa import Opcode, SymbolTable
+from machine import ControlUnit, DataPath
+from memory import ADDRESS_MASK
+from ports import flush_ports
+
+# Действия микрокода, за которыми можно наблюдать: имя действия -> вид обращения
+memory_actions = {
+    "latch_tos_data_mem": "read",
+    "latch_tos_data_mem_cached": "read",
+    "write_dm": "write",
+    "write_dm_cached": "write",
+}
+port_actions = {"latch_tos_input": "read", "write_io": "write"}
+access_kinds = {"read": {"read"}, "write": {"write"}, "access": {"read", "write"}}
+
+
+class StopRequestedError(Exception):
+    """Хук выборки останавливает модель до того, как микрокоманда выборки изменит состояние."""
+
+
+class Debugger:
+    """Отладочный запуск `control_unit`; `labels` -- метки памяти команд (таблица символов транслятора)."""
+
+    def __init__(self, control_unit: ControlUnit, labels: dict[str, int] | None = None):
+        self.control_unit = control_unit
+        self.labels = dict(labels or {})
+        self.symbols = SymbolTable(labels)
+        # Микрокод без хуков: из него собирается микрокод с хуками при каждом изменении точек останова
+        self.microcode = control_unit.microcode
+        self.breakpoints: set[int] = set()
+        self.memory_watches: dict[int, set[str]] = {}
+        self.port_watches: dict[int, set[str]] = {}
+        self.instruction_limit: int | None = None
+        # Число начатых инструкций -- как в `checkpoint.run_until`
+        self.instructions = 0
+        self.stops: list[str] = []
+        # Проверки текущей выборки уже выполнены (модель остановилась на ней), повторно не останавливаться
+        self.fetch_checked = False
+        self.finished: str | None = None
+        self.install()
+
+    def install(self):
+        """Собирает микрокод модели с хуками для установленных точек останова и наблюдений."""
+        microcode = []
+        for mpc, actions in enumerate(self.microcode):
+            hooked = tuple(self.hook(action) for action in actions)
+            microcode.append((self.fetch, *hooked) if mpc == 0 else hooked)
+        self.control_unit.microcode = microcode
+
+    def close(self):
+        """Возвращает модели микрокод без хуков."""
+        self.control_unit.microcode = self.microcode
+
+    def hook(self, action: Callable[[], None]) -> Callable[[], None]:
+        name = action.__name__
+        if name in memory_actions and self.memory_watches:
+            return self.memory_hook(action, memory_actions[name])
+        if name in port_actions and self.port_watches:
+            return self.port_hook(action, port_actions[name])
+        return action
+
+    def memory_hook(self, action: Callable[[], None], access: str) -> Callable[[], None]:
+        data_path = self.control_unit.data_path
+        watches = self.memory_watches
+
+        def hooked():
+            address = data_path.tos if access == "read" else data_path.top_stack_regs()
+            address &= ADDRESS_MASK
+            if access not in watches.get(address, ()):
+                action()
+                return
+            old = data_path.data_memory[address]
+            action()
+            if access == "read":
+                self.stops.append("read data[{}] = {}".format(address, old))
+            else:
+                self.stops.append("write data[{}]: {} -> {}".format(address, old, data_path.data_memory[address]))
+
+        return hooked
+
+    def port_hook(self, action: Callable[[], None], access: str) -> Callable[[], None]:
+        data_path = self.control_unit.data_path
+        watches = self.port_watches
+
+        def hooked():
+            action()
+            if access in watches.get(data_path.cu_arg, ()):
+                self.stops.append("{} port {}: {!r}".format(access, data_path.cu_arg, chr(data_path.tos)))
+
+        return hooked
+
+    def fetch(self):
+        """Первое действие микрокоманды выборки: проверки перед началом инструкции."""
+        if self.fetch_checked:
+            self.fetch_checked = False
+        else:
+            pc = self.control_unit.pc
+            if pc in self.breakpoints:
+                self.stops.append("breakpoint {}".format(self.symbols.location(pc)))
+            if self.instruction_limit is not None and self.instructions >= self.instruction_limit:
+                self.stops.append("instructions {}".format(self.instructions))
+                self.instruction_limit = None
+            if self.stops:
+                self.fetch_checked = True
+                raise StopRequestedError()
+        self.instructions += 1
+
+    def address(self, location: int | str) -> int:
+        """Адрес памяти команд по номеру или метке."""
+        if isinstance(location, int) or location.lstrip("-").isdigit():
+            return int(location)
+        assert location in self.labels, "Unknown label: {}".format(location)
+        return self.labels[location]
+
+    def add_breakpoint(self, location: int | str):
+        self.breakpoints.add(self.address(location))
+
+    def remove_breakpoint(self, location: int | str):
+        self.breakpoints.discard(self.address(location))
+
+    def watch_memory(self, address: int, access: str = "write"):
+        self.memory_watches.setdefault(address & ADDRESS_MASK, set()).update(access_kinds[access])
+        self.install()
+
+    def unwatch_memory(self, address: int):
+        self.memory_watches.pop(address & ADDRESS_MASK, None)
+        self.install()
+
+    def watch_port(self, port: int, access: str = "access"):
+        self.port_watches.setdefault(port, set()).update(access_kinds[access])
+        self.install()
+
+    def unwatch_port(self, port: int):
+        self.port_watches.pop(port, None)
+        self.install()
+
+    def run(self, ticks: int | None = None) -> list[str]:
+        """Моделирование до остановки, не дольше `ticks` тактов; возвращает причины остановки."""
+        assert self.finished is None, "The program has stopped: {}".format(self.finished)
+        control_unit = self.control_unit
+        try:
+            for _ in repeat(None) if ticks is None else repeat(None, ticks):
+                control_unit.execute_microprogram()
+                control_unit.tick()
+            if not self.stops:
+                self.stops.append("tick {}".format(control_unit.current_tick()))
+        except StopRequestedError:
+            pass
+        except EOFError:
+            self.finished = "input_exhausted"
+        except StopIteration:
+            # hlt выбирается, но не выполняется
+            self.instructions -= 1
+            self.finished = "halt"
+        if self.finished is not None:
+            self.stops.append(self.finished)
+        stops, self.stops = self.stops, []
+        return stops
+
+    def step(self, count: int = 1) -> list[str]:
+        """Выполняет `count` инструкций; начатая инструкция считается первой."""
+        in_progress = 1 if self.control_unit.mpc != 0 else 0
+        self.instruction_limit = self.instructions + count - in_progress
+        return self.run()
+
+    def step_micro(self, count: int = 1) -> list[str]:
+        return self.run(count)
+
+    def until_tick(self, tick: int) -> list[str]:
+        return self.run(max(0, tick - self.control_unit.current_tick()))
+
+    def until_instruction(self, instructions: int) -> list[str]:
+        """Моделирование до начала инструкции номер `instructions`."""
+        self.instruction_limit = instructions
+        return self.run()
+
+    def where(self) -> str:
+        control_unit = self.control_unit
+        pc = control_unit.pc
+        instruction = ""
+        if pc < len(control_unit.program):
+            instruction = "{} {}".format(Opcode(control_unit.program.opcodes[pc]).name, control_unit.program.args[pc])
+        return "tick {} instructions {} pc {} ({}) mpc {}: {}".format(
+            control_unit.current_tick(), self.instructions, pc, self.symbols.location(pc), control_unit.mpc, instruction
+        )
+
+    def output(self) -> str:
+        flush_ports(self.control_unit.data_path.io_ports)
+        return self.control_unit.data_path.io_ports[1].text()
+
+
+class DebuggerShell(cmd.Cmd):
+    """Интерактивные команды поверх `Debugger`."""
+
+    prompt = "(dbg) "
+
+    def __init__(self, debugger: Debugger, **kwargs):
+        super().__init__(**kwargs)
+        self.debugger = debugger
+
+    def report(self, stops: list[str]):
+        for stop in stops:
+            print("stopped:", stop, file=self.stdout)
+        print(self.debugger.where(), file=self.stdout)
+
+    def onecmd(self, line: str) -> bool:
+        try:
+            return super().onecmd(line)
+        except (AssertionError, ValueError, KeyError) as e:
+            print("error:", e, file=self.stdout)
+            return False
+
+    def emptyline(self) -> bool:
+        return False
+
+    def do_break(self, arg: str):
+        """break <pc|label> -- точка останова"""
+        self.debugger.add_breakpoint(arg.strip())
+
+    def do_delete(self, arg: str):
+        """delete <pc|label> -- удалить точку останова"""
+        self.debugger.remove_breakpoint(arg.strip())
+
+    def do_watch(self, arg: str):
+        """watch <address> [read|write|access] -- наблюдение за ячейкой памяти данных (по умолчанию запись)"""
+        address, *access = arg.split()
+        self.debugger.watch_memory(int(address, 0), *access)
+
+    def do_unwatch(self, arg: str):
+        """unwatch <address> -- снять наблюдение за ячейкой памяти данных"""
+        self.debugger.unwatch_memory(int(arg, 0))
+
+    def do_watchport(self, arg: str):
+        """watchport <port> [read|write|access] -- наблюдение за портом (по умолчанию ввод и вывод)"""
+        port, *access = arg.split()
+        self.debugger.watch_port(int(port), *access)
+
+    def do_unwatchport(self, arg: str):
+        """unwatchport <port> -- снять наблюдение за портом"""
+        self.debugger.unwatch_port(int(arg))
+
+    def do_continue(self, arg: str):
+        """continue -- выполнять до остановки"""
+        self.report(self.debugger.run())
+
+    def do_step(self, arg: str):
+        """step [n] -- выполнить n инструкций"""
+        self.report(self.debugger.step(int(arg or 1)))
+
+    def do_micro(self, arg: str):
+        """micro [n] -- выполнить n тактов (микрокоманд)"""
+        self.report(self.debugger.step_micro(int(arg or 1)))
+
+    def do_until(self, arg: str):
+        """until tick <n> | until instruction <n> -- выполнять до такта или до начала инструкции номер n"""
+        kind, value = arg.split()
+        if kind == "tick":
+            self.report(self.debugger.until_tick(int(value)))
+        else:
+            assert kind == "instruction", "Expected 'tick' or 'instruction'"
+            self.report(self.debugger.until_instruction(int(value)))
+
+    def do_where(self, arg: str):
+        """where -- текущая инструкция и такт"""
+        print(self.debugger.where(), file=self.stdout)
+
+    def do_state(self, arg: str):
+        """state -- регистры, стек, порты и память, как в журнале simulation()"""
+        print(repr(self.debugger.control_unit), file=self.stdout)
+
+    def do_mem(self, arg: str):
+        """mem <address> [count] -- содержимое памяти данных"""
+        address, *count = arg.split()
+        start = int(address, 0)
+        memory = self.debugger.control_unit.data_path.data_memory
+        words = [memory[start + offset] for offset in range(int(count[0]) if count else 1)]
+        print("{}: {}".format(start, words), file=self.stdout)
+
+    def do_output(self, arg: str):
+        """output -- вывод программы в порт 1 на данный момент"""
+        print(repr(self.debugger.output()), file=self.stdout)
+
+    def do_quit(self, arg: str) -> bool:
+        """quit -- завершить отладку"""
+        return True
+
+    do_EOF = do_quit  # noqa: N815
+
+
+def main(code_file, data_file, input_file, symbols_file=None, geometry: Geometry | None = None):
+    code, data, labels = load_program(code_file, data_file, symbols_file)
+    geometry = geometry or Geometry()
+    with open(input_file, encoding="utf-8") as file:
+        data_path = DataPath(data, geometry.stack_capacity, list(file.read()), geometry=geometry)
+    control_unit = ControlUnit(code, data_path, geometry.call_stack_capacity)
+    shell = DebuggerShell(Debugger(control_unit, labels))
+    shell.cmdloop(shell.debugger.where())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interactive debugger for the microcoded model")
+    parser.add_argument(
+        "files", nargs="+", metavar="file", help="image_file input_file or data_file code_file input_file"
+    )
+    parser.add_argument("--symbols", help="symbol table written by translator.py (overrides the image symbols)")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    code_file, data_file, (input_file,) = program_arguments(args.files)
+    main(code_file, data_file, input_file, args.symbols, geometry_from_arguments(args))
@@ -0,0 +1,96 @@
+"""Геометрия процессора: размеры регистрового стека и стека вызовов, выгрузка их дна в память данных.
+
+Без выгрузки выход за размер стека -- ошибка моделирования, как раньше. С выгрузкой (`spill`) push в
+заполненный стек сначала переносит в память данных самый нижний элемент, а pop, опустошивший стек,
+возвращает из памяти последний выгруженный (fill). Стек вызовов выгружается так же при `call` и `ret`.
+Каждый перенесённый элемент добавляет `spill_ticks` тактов. Выгруженные элементы лежат в отдельных
+областях памяти данных в конце адресного пространства: страницы `memory.PagedMemory` выделяются лениво,
+поэтому области ничего не стоят, пока стек не выгружается. Выгрузка обращается к памяти мимо кэша.
+"""
+
+from __future__ import annotations
+
+import argparse
+
+STACK_CAPACITY = 24
+CALL_STACK_CAPACITY = 16
+
+# Области выгрузки стека и стека вызовов: элемент номер i (от дна) лежит по адресу `base + i`
+SPILL_REGION_SIZE = 1 << 20
+STACK_SPILL_BASE = 0xFFE00000
+CALL_SPILL_BASE = STACK_SPILL_BASE + SPILL_REGION_SIZE
+
+
+class Geometry:
+    """Размеры стеков в элементах и режим выгрузки; счётчики выгрузок накапливаются за прогон, как у `cache.Cache`."""
+
+    def __init__(
+        self,
+        stack_capacity: int = STACK_CAPACITY,
+        call_stack_capacity: int = CALL_STACK_CAPACITY,
+        spill: bool = False,
+        spill_ticks: int = 1,
+    ):
+        assert stack_capacity > 0, "Stack capacity must be positive"
+        assert call_stack_capacity > 0, "Call stack capacity must be positive"
+        assert spill_ticks >= 0, "Spill cost must not be negative"
+        self.stack_capacity = stack_capacity
+        self.call_stack_capacity = call_stack_capacity
+        self.spill = spill
+        self.spill_ticks = spill_ticks
+        self.stack_spills = 0
+        self.stack_fills = 0
+        self.call_spills = 0
+        self.call_fills = 0
+        self.stall_ticks = 0
+
+    def stack_spill(self, spilled: int) -> int:
+        """Адрес для выгрузки очередного элемента стека; `spilled` -- уже выгруженных элементов."""
+        assert spilled < SPILL_REGION_SIZE, "stack spill region exceeded"
+        self.stack_spills += 1
+        self.stall_ticks += self.spill_ticks
+        return STACK_SPILL_BASE + spilled
+
+    def stack_fill(self, spilled: int) -> int:
+        """Адрес последнего выгруженного элемента стека."""
+        self.stack_fills += 1
+        self.stall_ticks += self.spill_ticks
+        return STACK_SPILL_BASE + spilled - 1
+
+    def call_spill(self, spilled: int) -> int:
+        assert spilled < SPILL_REGION_SIZE, "call stack spill region exceeded"
+        self.call_spills += 1
+        self.stall_ticks += self.spill_ticks
+        return CALL_SPILL_BASE + spilled
+
+    def call_fill(self, spilled: int) -> int:
+        self.call_fills += 1
+        self.stall_ticks += self.spill_ticks
+        return CALL_SPILL_BASE + spilled - 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "stack_spills": self.stack_spills,
+            "stack_fills": self.stack_fills,
+            "call_spills": self.call_spills,
+            "call_fills": self.call_fills,
+            "stall_ticks": self.stall_ticks,
+        }
+
+    def __str__(self) -> str:
+        return " ".join("{}: {}".format(name, value) for name, value in self.stats().items())
+
+
+def add_geometry_arguments(parser: argparse.ArgumentParser, spill: bool = True):
+    """Параметры геометрии в CLI; без `spill` -- только размеры стеков, для моделей без выгрузки."""
+    parser.add_argument("--stack", type=int, default=STACK_CAPACITY, help="data stack registers")
+    parser.add_argument("--call-stack", type=int, default=CALL_STACK_CAPACITY, help="call stack entries")
+    if spill:
+        parser.add_argument(
+            "--spill", action="store_true", help="spill stack overflow to data memory instead of failing"
+        )
+        parser.add_argument("--spill-ticks", type=int, default=1, help="ticks per spilled or filled stack entry")
+
+
+def geometry_from_arguments(args: argparse.Namespace) -> Geometry:
+    return Geometry(args.stack, args.call_stack, getattr(args, "spill", False), getattr(args, "spill_ticks", 1))
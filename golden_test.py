@@ -1,13 +1,32 @@
+import asyncio
 import contextlib
 import io
 import logging
 import os
 import tempfile
+from itertools import chain, dropwhile
 
+import analyzer
+import async_machine
+import batch
+import bench
+import cache
+import checkpoint
+import debugger
+import geometry
+import image
+import jit
+import linker
+import lockstep
 import machine
+import memory
+import pipeline
+import profiler
 import pytest
+import tracer
 import translator
-from isa import read_code, read_data
+from isa import MMAP_THRESHOLD, Opcode, as_program, iter_code, read_code, read_data
+from ports import StreamInputPort
 
 
 @pytest.mark.golden_test("golden/*.yml")
@@ -48,3 +67,899 @@ def test_translator_asm_and_machine(golden, caplog):
         assert formatted_data == golden.out["out_formatted_data"]
         assert stdout.getvalue() == golden.out["out_stdout"]
         assert caplog.text == golden.out["out_log"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize(("engine", "stream"), [("instr", False), ("jit", False), ("mc", True), ("jit", True)])
+def test_engine_matches_microcode(golden, engine, stream):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source = os.path.join(tmpdirname, "source")
+        input_stream = os.path.join(tmpdirname, "input")
+        target_data = os.path.join(tmpdirname, "target_data.o")
+        target_code = os.path.join(tmpdirname, "target_code.o")
+
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(golden["in_source"])
+        with open(input_stream, "w", encoding="utf-8") as file:
+            file.write(golden["in_stdin"])
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            translator.main(source, target_data, target_code)
+            print("============================================================")
+            machine.main(target_code, target_data, input_stream, engine, stream)
+
+        assert stdout.getvalue() == golden.out["out_stdout"]
+
+
+@pytest.mark.parametrize("engine", ["instr", "jit"])
+def test_engine_matches_microcode_after_page_allocation(engine):
+    # Чтение ещё не выделенной страницы, затем запись в неё по другому адресу и повторное чтение
+    source = """.text
+_main:
+    input 0
+    load
+    push 3000
+    push 7
+    store
+    pop
+    pop
+    pop
+    load
+    output 1
+    hlt
+"""
+    _, code = translator.translate(source)
+    expected = machine.simulation(code, [], [chr(3000)])
+    assert expected[0] == "\x07"
+    assert machine.simulation(code, [], [chr(3000)], engine) == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_trace_renders_simulation_log(golden, caplog):
+    caplog.set_level(logging.DEBUG)
+    data, code = translator.translate(golden["in_source"])
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_data = os.path.join(tmpdirname, "target_data.o")
+        target_code = os.path.join(tmpdirname, "target_code.o")
+        translator.write_data(target_data, data)
+        translator.write_code(target_code, code)
+
+        trace = io.BytesIO()
+        recorder = tracer.TraceRecorder(trace)
+        _, ticks = machine.simulation(
+            read_code(target_code), read_data(target_data), list(golden["in_stdin"]), recorder=recorder
+        )
+        recorder.flush()
+
+    reader = tracer.TraceReader(trace.getvalue())
+    rendered = "".join(
+        "{:<7} machine:{:<13} {}\n".format(
+            "INFO" if message.startswith("INSTRUCTION") else "DEBUG", "simulation", message
+        )
+        for message in tracer.render(reader, 0, ticks)
+    )
+    assert caplog.text.startswith(rendered)
+    assert rendered.endswith(repr(reader.state_at(ticks).control_unit()) + "\n")
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("stalls", ["cache", "spill", "cache+spill"])
+def test_trace_records_stall_ticks(golden, caplog, stalls):
+    caplog.set_level(logging.DEBUG)
+    data, code = translator.translate(golden["in_source"])
+    models = {}
+    if "cache" in stalls:
+        models["cache"] = cache.Cache(size=8, line_size=2, ways=1)
+    if "spill" in stalls:
+        models["geometry"] = geometry.Geometry(2, 1, spill=True, spill_ticks=3)
+
+    trace = io.BytesIO()
+    recorder = tracer.TraceRecorder(trace)
+    memory = list(chain.from_iterable(data.values()))
+    _, ticks = machine.simulation(code, memory, list(golden["in_stdin"]), recorder=recorder, **models)
+    recorder.flush()
+
+    rendered = "".join(
+        "{:<7} machine:{:<13} {}\n".format(
+            "INFO" if message.startswith("INSTRUCTION") else "DEBUG", "simulation", message
+        )
+        for message in tracer.render(tracer.TraceReader(trace.getvalue()), 0, ticks)
+    )
+    assert caplog.text.startswith(rendered)
+    # Последний такт трассы -- последний такт модели вместе с простоями
+    assert list(tracer.TraceReader(trace.getvalue()).states())[-1].tick == ticks
+
+
+def test_trace_state_at_covers_stalls_in_any_order(monkeypatch):
+    monkeypatch.setattr(tracer, "KEYFRAME_INTERVAL", 16)
+    source = ".data\nbuf: res 8\n.text\n_main:\n push buf\n ins 0\n push buf\n outs 1\n push 42\n call f\n hlt\nf:\n push 1\n ret\n"
+    _, code = translator.translate(source)
+    trace = io.BytesIO()
+    recorder = tracer.TraceRecorder(trace)
+    data_cache = cache.Cache(size=4, line_size=2, ways=1, miss_penalty=5)
+    _, ticks = machine.simulation(code, [0] * 8, list("abc\n"), recorder=recorder, cache=data_cache)
+    recorder.flush()
+
+    # Состояние, покрывающее такт: первое с `state.tick >= tick`, включая такты внутри простоев
+    covering = {}
+    previous = -1
+    for state in tracer.TraceReader(trace.getvalue()).states():
+        for tick in range(previous + 1, state.tick + 1):
+            covering[tick] = (state.tick, repr(state.control_unit()))
+        previous = state.tick
+    assert data_cache.stats()["stall_ticks"] > 0
+    assert len(covering) == ticks + 1
+
+    reader = tracer.TraceReader(trace.getvalue())
+    for tick in [*range(0, ticks + 1, 3), ticks, 5, *range(ticks, -1, -7), 0]:
+        state = reader.state_at(tick)
+        assert (state.tick, repr(state.control_unit())) == covering[tick]
+    assert len(reader.keyframes) > 1
+    with pytest.raises(IndexError):
+        reader.state_at(ticks + 1)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("policy", cache.replacement_policies)
+def test_cache_model_engines_agree(golden, policy):
+    data, code = translator.translate(golden["in_source"])
+    results = []
+    for engine in ["mc", "instr"]:
+        data_cache = cache.Cache(size=16, line_size=4, ways=2, policy=policy)
+        memory = list(chain.from_iterable(data.values()))
+        output, ticks = machine.simulation(code, memory, list(golden["in_stdin"]), engine, cache=data_cache)
+        results.append((output, ticks, data_cache.stats()))
+
+    assert results[0] == results[1]
+    output, ticks, stats = results[0]
+    assert output + "\n" in golden.out["out_stdout"]
+    assert "ticks: {}\n".format(ticks - stats["stall_ticks"]) in golden.out["out_stdout"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_profiler_accounts_every_tick(golden):
+    data, code, labels = translator.translate_with_labels(golden["in_source"])
+    memory = list(chain.from_iterable(data.values()))
+    output, ticks, prof = profiler.profile(code, memory, list(golden["in_stdin"]), labels)
+
+    assert "{}\nticks: {}\n".format(output, ticks) in golden.out["out_stdout"]
+    assert prof.total_ticks() == ticks
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in prof.folded()) == ticks
+    assert prof.by_function()["_main"][0] == ticks
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("ordered", [False, True])
+def test_batch_runner_matches_golden(golden, ordered):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source = os.path.join(tmpdirname, "source")
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(golden["in_source"])
+        with open(os.path.join(tmpdirname, "input"), "w", encoding="utf-8") as file:
+            file.write(golden["in_stdin"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main(source, os.path.join(tmpdirname, "data.o"), os.path.join(tmpdirname, "code.o"))
+
+        manifest = os.path.join(tmpdirname, "manifest.jsonl")
+        with open(manifest, "w", encoding="utf-8") as file:
+            for engine in ["mc", "instr", "jit"] * 2:
+                file.write('{{"code": "code.o", "data": "data.o", "input": "input", "engine": "{}"}}\n'.format(engine))
+
+        results = list(batch.run_batch(batch.read_manifest(manifest), workers=2, ordered=ordered))
+
+    assert sorted(result["id"] for result in results) == list(range(6))
+    if ordered:
+        assert [result["id"] for result in results] == list(range(6))
+    for result in results:
+        assert "{}\nticks: {}\n".format(result["output"], result["ticks"]) in golden.out["out_stdout"]
+        assert result["termination"] in {"halt", "input_exhausted"}
+
+
+def test_batch_runner_isolates_failing_jobs():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for name, source in [
+            ("good", ".text\n_main:\n push 65\n output 1\n hlt\n"),
+            ("bad", ".text\n_main:\n push -5\n output 1\n hlt\n"),
+        ]:
+            with open(os.path.join(tmpdirname, name), "w", encoding="utf-8") as file:
+                file.write(source)
+            with contextlib.redirect_stdout(io.StringIO()):
+                translator.main(
+                    os.path.join(tmpdirname, name),
+                    os.path.join(tmpdirname, name + "_data.o"),
+                    os.path.join(tmpdirname, name + "_code.o"),
+                )
+        with open(os.path.join(tmpdirname, "input"), "w", encoding="utf-8") as file:
+            file.write("")
+
+        manifest = os.path.join(tmpdirname, "manifest.jsonl")
+        with open(manifest, "w", encoding="utf-8") as file:
+            for name, input_file in [("good", "input"), ("bad", "input"), ("good", "missing"), ("good", "input")]:
+                file.write('{{"code": "{0}_code.o", "data": "{0}_data.o", "input": "{1}"}}\n'.format(name, input_file))
+
+        results = list(batch.run_batch(batch.read_manifest(manifest), workers=2, ordered=True))
+
+    assert [result["termination"] for result in results] == ["halt", "error", "error", "halt"]
+    assert [result["output"] for result in results] == ["A", "", "", "A"]
+    assert results[1]["error"].startswith("ValueError")
+    assert results[2]["error"].startswith("FileNotFoundError")
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_peephole_optimizer_preserves_output(golden):
+    optimizer = translator.PeepholeOptimizer()
+    data, code, labels = translator.translate_with_labels(golden["in_source"], optimizer)
+    memory = list(chain.from_iterable(data.values()))
+    output, ticks = machine.simulation(code, memory, list(golden["in_stdin"]))
+
+    _, plain_code = translator.translate(golden["in_source"])
+    assert output + "\n" in golden.out["out_stdout"]
+    assert len(code) == len(plain_code) - optimizer.total_removed()
+    assert ticks <= int(golden.out["out_stdout"].rsplit("ticks: ", 1)[1].split()[0])
+    assert all(0 <= address <= len(code) for address in labels.values())
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_linked_single_module_matches_translator(golden):
+    data, code = translator.translate(golden["in_source"])
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        object_file = os.path.join(tmpdirname, "module.obj")
+        linker.write_object(object_file, linker.compile_object(golden["in_source"], "module"))
+        program, linked_data, _ = linker.link([linker.read_object(object_file)])
+
+    assert list(program) == list(as_program(code))
+    assert list(chain.from_iterable(linked_data.values())) == list(chain.from_iterable(data.values()))
+
+
+def test_linker_resolves_globals_and_externs():
+    library = """.data
+digits: "0123456789"
+.text
+global print_digit
+print_digit:
+    push digits
+    add
+    load
+    output 1
+    pop
+    pop
+    pop
+    ret
+"""
+    program = """.data
+digits: 3, 1, 4
+.text
+extern print_digit
+_main:
+    push digits
+    load
+    call print_digit
+    pop
+    inc
+    swap
+    pop
+    load
+    call print_digit
+    hlt
+"""
+    objects = [linker.compile_object(program, "main"), linker.compile_object(library, "lib")]
+    code, data, labels = linker.link(objects)
+    output, _ = machine.simulation(code, list(chain.from_iterable(data.values())), [])
+
+    assert output == "31"
+    assert labels["print_digit"] == 1 + len(objects[0].code)
+    assert set(data) == {"main:digits", "lib:digits"}
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_checkpoint_resume_matches_full_run(golden):
+    data, code = translator.translate(golden["in_source"])
+    memory = list(chain.from_iterable(data.values()))
+    expected = machine.simulation(code, list(memory), list(golden["in_stdin"]))
+
+    for stop in [{"tick": expected[1] // 2}, {"instructions": 5}]:
+        control_unit = machine.ControlUnit(code, machine.DataPath(list(memory), 24, list(golden["in_stdin"])), 16)
+        _, executed = checkpoint.run_until(control_unit, **stop)
+        saved = checkpoint.snapshot(control_unit, executed)
+        restored, restored_executed = checkpoint.restore(saved)
+
+        assert repr(restored) == repr(control_unit)
+        assert restored_executed == executed
+        assert checkpoint.resume(restored, restored_executed) == expected
+        assert checkpoint.fork(saved, [list(control_unit.data_path.io_ports[0])]) == [expected]
+
+
+def test_bench_suite_reports_and_compares():
+    suite = bench.run_suite(scale=0.01, engines=["instr", "jit"], repeat=1, memory=False)
+    results = suite["results"]
+
+    assert results["example/prob2/instr"]["ticks"] == results["example/prob2/jit"]["ticks"] == 1712
+    assert results["translate/data_table"]["mb_per_second"] > 0
+    assert bench.compare(suite, suite, 0.1) == []
+    slower = {"results": {"example/prob2/jit": dict(results["example/prob2/jit"], ticks_per_second=0.0)}}
+    assert [name for name, _, _ in bench.compare(suite, slower, 0.1)] == ["example/prob2/jit"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_lockstep_lanes_match_simulation(golden):
+    pytest.importorskip("numpy")
+    data, code = translator.translate(golden["in_source"])
+    memory = list(chain.from_iterable(data.values()))
+    inputs = [golden["in_stdin"], "", "Bob\n", "a\nbc\n", golden["in_stdin"] * 2]
+
+    expected = [machine.simulation(code, list(memory), list(tokens), "instr") for tokens in inputs]
+    assert lockstep.simulation_lockstep(code, memory, [list(tokens) for tokens in inputs]) == expected
+
+
+def test_lockstep_memory_beyond_data_image():
+    if lockstep.np is None:
+        pytest.skip("numpy is not installed")
+    # Адрес из ввода: чтение ещё не записанной ячейки, запись по адресу 3000 и строка в конце адресного пространства
+    source = """.data
+value: 5
+.text
+_main:
+    input 0
+    load
+    push 3000
+    push 7
+    store
+    pop
+    pop
+    pop
+    load
+    output 1
+    push -2
+    ins 0
+    push -2
+    outs 1
+    hlt
+"""
+    data, code = translator.translate(source)
+    memory = list(chain.from_iterable(data.values()))
+    inputs = [chr(3000) + "a\n", chr(0) + "\n", chr(70000) + "bc\n", chr(3000) + "d"]
+    expected = [machine.simulation(code, list(memory), list(tokens), "instr") for tokens in inputs]
+    assert expected[0] == ("\x07a", expected[0][1])
+    assert lockstep.simulation_lockstep(code, memory, [list(tokens) for tokens in inputs]) == expected
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        # 100 / цифра ввода, затем столько же вложенных вызовов: ноль делит на ноль, "z" переполняет стек вызовов
+        "push 100\n div\n output 1\n pop\n pop\n f:\n jz done\n dec\n call f\n done:\n hlt\n",
+        # Цифра ввода -- число пар pop: лишние снимают пустой стек
+        "loop:\n jz done\n pop\n pop\n dec\n jmp loop\n done:\n hlt\n",
+    ],
+)
+def test_lockstep_fault_finishes_only_its_lane(body):
+    if lockstep.np is None:
+        pytest.skip("numpy is not installed")
+    _, code = translator.translate(".text\n_main:\n input 0\n push 48\n swap\n sub\n" + body)
+    inputs = ["2", "0", "5", "z"]
+    expected = []
+    for tokens in inputs:
+        try:
+            expected.append(machine.simulation(code, [], list(tokens)))
+        except (AssertionError, ZeroDivisionError) as e:
+            expected.append(e)
+
+    results = lockstep.simulation_lockstep(code, [], [list(tokens) for tokens in inputs])
+    assert [repr(result) for result in results] == [repr(result) for result in expected]
+    assert any(isinstance(result, tuple) for result in results)
+    assert any(isinstance(result, Exception) for result in results)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_async_machines_wait_for_input(golden):
+    data, code = translator.translate(golden["in_source"])
+    memory = list(chain.from_iterable(data.values()))
+    expected = machine.simulation(code, list(memory), list(golden["in_stdin"]), "instr")
+
+    async def feed(port):
+        # Ввод приходит по символу, пока машины уже работают
+        for char in golden["in_stdin"]:
+            await asyncio.sleep(0)
+            port.feed(char)
+        port.close()
+
+    async def run():
+        ports = [async_machine.AsyncInputPort() for _ in range(200)]
+        machines = [async_machine.make_machine(code, memory, port) for port in ports]
+        results, *_ = await asyncio.gather(async_machine.run_machines(machines, 50), *map(feed, ports))
+        return results
+
+    for reason, output, ticks in asyncio.run(run()):
+        assert reason in {"halt", "input_exhausted"}
+        assert (output, ticks) == expected
+
+
+def test_async_ins_resumes_split_line():
+    source = """.text
+_main:
+    push 100
+    ins 0
+    push 100
+    outs 1
+    hlt
+"""
+    _, code = translator.translate(source)
+    expected = machine.simulation(code, [], list("abc\n"))
+    assert expected[0] == "abc"
+
+    async def feed(port):
+        # Строка приходит двумя кусками: ins прерывается посреди цикла чтения
+        for chunk in ["ab", "c\n"]:
+            await asyncio.sleep(0)
+            port.feed(chunk)
+        port.close()
+
+    async def run():
+        port = async_machine.AsyncInputPort()
+        running = async_machine.make_machine(code, [], port)
+        results, _ = await asyncio.gather(async_machine.run_machines([running], 50), feed(port))
+        return results[0], running
+
+    (reason, output, ticks), running = asyncio.run(run())
+    assert reason == "halt"
+    assert (output, ticks) == expected
+    # Без повторного push адреса: в стеке только прежний TOS и адрес после прочитанной строки
+    assert running.stack == [0, 104]
+
+
+@pytest.mark.parametrize("words", [5, MMAP_THRESHOLD // 4 + 3])
+def test_object_files_round_trip(words):
+    # Файлы от MMAP_THRESHOLD байт читаются через mmap, iter_code читает код блоками
+    code = [
+        {"index": index, "opcode": Opcode.PUSH, "arg": index % (1 << 26) - (index & 1) * (1 << 25)}
+        for index in range(words - 1)
+    ]
+    code.append({"index": words - 1, "opcode": Opcode.HLT, "arg": 0})
+    data = {"first": [-1, 0, (1 << 31) - 1], "rest": [index * 7919 for index in range(words - 3)]}
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target_code = os.path.join(tmpdirname, "code.o")
+        target_data = os.path.join(tmpdirname, "data.o")
+        translator.write_code(target_code, code)
+        translator.write_data(target_data, data)
+        with open(target_code, "rb") as file:
+            assert file.seek(0, os.SEEK_END) == 4 * words
+
+        assert list(read_code(target_code)) == code
+        assert list(iter_code(target_code, chunk_words=1000)) == code
+        assert read_data(target_data) == [x & 0xFFFFFFFF for x in chain.from_iterable(data.values())]
+
+
+@pytest.mark.parametrize("engine", ["mc", "instr", "jit"])
+def test_output_to_input_only_device_fails(engine):
+    _, code = translator.translate(".text\n_main:\n    push 65\n    output 0\n    hlt\n")
+    with pytest.raises(AssertionError, match="StreamInputPort is read-only"):
+        machine.simulation(code, [], StreamInputPort(io.StringIO("")), engine)
+
+
+@pytest.mark.parametrize("engine", ["mc", "instr", "jit"])
+@pytest.mark.parametrize(
+    ("body", "message"),
+    [
+        ("pop\n pop\n hlt", "a negative stack pointer was received"),
+        ("push 1\n swap\n swap\n add\n pop\n pop\n pop\n hlt", "a negative stack pointer was received"),
+        ("ret", "a negative scp was received"),
+    ],
+)
+def test_stack_underflow_fails_alike(engine, body, message):
+    _, code = translator.translate(".text\n_main:\n " + body + "\n")
+    with pytest.raises(AssertionError, match=message):
+        machine.simulation(code, [], [], engine)
+
+
+def test_jit_code_cache_is_bounded():
+    for value in range(jit.CODE_CACHE_SIZE + 5):
+        _, code = translator.translate(".text\n_main:\n push {}\n output 1\n hlt\n".format(value))
+        assert machine.simulation(code, [], [], "jit")[0] == chr(value)
+    assert len(jit.code_cache) == jit.CODE_CACHE_SIZE
+
+
+@pytest.mark.parametrize("engine", ["mc", "instr", "jit"])
+def test_paged_memory_and_word_wraparound(engine):
+    source = """.data
+value: 0
+.text
+_main:
+    push 65536
+    push 32768
+    mul         ; 2^31 -> -2^31
+    push 1000000
+    swap
+    store       ; далеко за образом данных
+    push -1
+    swap
+    store       ; адрес 0xFFFFFFFF
+    dec         ; -2^31 - 1 -> 2^31 - 1
+    push value
+    swap
+    store
+    hlt
+"""
+    data, code = translator.translate(source)
+    data_memory = memory.PagedMemory(chain.from_iterable(data.values()))
+    assert machine.simulation(code, data_memory, [], engine)[0] == ""
+
+    assert data_memory[1000000] == data_memory[0xFFFFFFFF] == data_memory[-1] == -(1 << 31)
+    assert data_memory[0] == (1 << 31) - 1
+    assert data_memory[12345] == 0
+    assert len(data_memory) == 1
+    assert sorted(data_memory.pages) == [0, 1000000 >> memory.PAGE_BITS, 0xFFFFFFFF >> memory.PAGE_BITS]
+
+
+def test_debugger_breakpoints_watchpoints_and_steps():
+    with open("examples/hello_alice.asm", encoding="utf-8") as file:
+        data, code, labels = translator.translate_with_labels(file.read())
+    memory = list(chain.from_iterable(data.values()))
+    expected = machine.simulation(code, list(memory), list("Alice\n"))
+    control_unit = machine.ControlUnit(code, machine.DataPath(list(memory), 24, list("Alice\n")), 16)
+    session = debugger.Debugger(control_unit, labels)
+    buffer = len(data["question"]) + len(data["hello_str"])
+
+    session.add_breakpoint("input_str")
+    assert session.run() == ["breakpoint input_str"]
+    assert (control_unit.pc, control_unit.mpc) == (labels["input_str"], 0)
+    assert session.step() == ["instructions {}".format(session.instructions)]
+    assert control_unit.pc == labels["input_str"] + 1
+    assert session.step_micro(2) == ["tick {}".format(control_unit.current_tick())]
+    assert control_unit.mpc != 0
+
+    session.remove_breakpoint("input_str")
+    session.watch_memory(buffer)
+    session.watch_port(0, "read")
+    # Первый символ уже прочитан шагом по input
+    assert session.run() == ["write data[{}]: 0 -> 65".format(buffer)]
+    assert session.run() == ["read port 0: 'l'"]
+    session.unwatch_memory(buffer)
+    session.unwatch_port(0)
+    assert session.run() == ["halt"]
+    assert (session.output(), control_unit.current_tick()) == expected
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_analyzer_bounds_simulation(golden):
+    data, code, labels = translator.translate_with_labels(golden["in_source"])
+    program = analyzer.Analyzer(code, labels)
+
+    class DepthRecorder:
+        stack = calls = 0
+
+        def start(self, control_unit):
+            pass
+
+        def record(self, control_unit):
+            self.stack = max(self.stack, control_unit.data_path.stack_pointer + 1)
+            self.calls = max(self.calls, control_unit.scp + 1)
+
+    recorder = DepthRecorder()
+    _, ticks = machine.simulation(
+        code, list(chain.from_iterable(data.values())), list(golden["in_stdin"]), recorder=recorder
+    )
+
+    assert program.main.min_ticks <= ticks
+    assert program.main.call_depth == recorder.calls
+    if program.main.balanced:
+        assert program.check() == []
+        assert program.main.max_depth == recorder.stack
+    else:
+        # prob2 складывает цифры на стек в цикле и снимает их в другом
+        assert [issue.split(":")[0] for issue in program.check()] == ["digits_on_stack", "print_int"]
+
+
+def test_analyzer_exact_ticks_and_unbalanced_loop():
+    source = """.text
+_main:
+    push 1
+    call twice
+    jz skip
+    output 1
+skip:
+    hlt
+twice:
+    inc
+    swap
+    pop
+    ret
+"""
+    _, code, labels = translator.translate_with_labels(source)
+    program = analyzer.Analyzer(code, labels)
+    _, ticks = machine.simulation(code, [], [])
+
+    assert program.main.min_ticks <= ticks <= program.main.max_ticks
+    assert program.main.max_ticks - program.main.min_ticks == machine.ControlUnit.instruction_ticks()[Opcode.OUTPUT]
+    assert program.functions[labels["twice"]].effect == 0
+    assert (program.main.max_depth, program.main.call_depth, program.check()) == (2, 1, [])
+
+    unbalanced = analyzer.Analyzer(translator.translate(".text\n_main:\n    push 1\n    jmp _main\n")[1])
+    assert unbalanced.check() == ["0: loop at 1 changes stack depth: 0 -> 1"]
+    assert unbalanced.main.max_ticks is None
+
+
+def test_analyzer_counts_stack_peak_inside_ins():
+    # Цикл ins держит адрес строки в стеке: глубина на время чтения на 1 больше итоговой
+    _, code = translator.translate(".text\n_main:\n" + "    push 1\n" * 6 + "    ins 0\n    hlt\n")
+    program = analyzer.Analyzer(code)
+    assert program.main.max_depth == 7
+    assert program.check(6) == ["stack depth 7 exceeds capacity 6"]
+    assert program.check(7) == []
+    machine.simulation(code, [], list("a\n"), geometry=geometry.Geometry(7, 16))
+    with pytest.raises(AssertionError, match="stack capacity exceeded"):
+        machine.simulation(code, [], list("a\n"), geometry=geometry.Geometry(6, 16))
+
+
+@pytest.mark.parametrize("engine", ["mc", "instr"])
+def test_stack_spill_to_data_memory(engine):
+    source = """.text
+_main:
+    push 30
+    call down   ; 31 вложенный вызов
+    hlt
+down:
+    jz bottom
+    dec
+    call down
+    push 96
+    add
+    output 1
+    pop
+    pop
+    pop
+bottom:
+    ret
+"""
+    _, code = translator.translate(source)
+    expected, ticks = machine.simulation(code, [], [], "jit", geometry=geometry.Geometry(64, 64))
+    with pytest.raises(AssertionError, match="call stack capacity exceeded"):
+        machine.simulation(code, [], [], engine)
+
+    for stack, calls in [(24, 16), (4, 2), (1, 1)]:
+        spill = geometry.Geometry(stack, calls, spill=True, spill_ticks=2)
+        data_memory = memory.PagedMemory()
+        output = machine.simulation(code, data_memory, [], engine, geometry=spill)
+        assert output == (expected, ticks + spill.stall_ticks)
+        assert (spill.stack_spills, spill.call_spills) == (spill.stack_fills, spill.call_fills)
+        assert spill.stall_ticks == 2 * 2 * (spill.stack_spills + spill.call_spills)
+        # Вызовы только вкладываются, пока не дойдут до дна, поэтому выгружается каждый адрес сверх размера стека
+        assert spill.call_spills == 31 - calls
+        # Дно стека вызовов -- адрес возврата в _main
+        assert data_memory[geometry.CALL_SPILL_BASE] == 3
+
+
+def test_entry_points_accept_geometry():
+    # 31 вложенный вызов: стек вызовов по умолчанию (16) переполняется, 64 хватает
+    source = ".text\n_main:\n push 30\n call down\n hlt\ndown:\n jz bottom\n dec\n call down\n pop\nbottom:\n ret\n"
+    _, code = translator.translate(source)
+    wide = geometry.Geometry(64, 64)
+    expected = machine.simulation(code, [], [], geometry=wide)
+
+    assert profiler.profile(code, [], [], geometry=wide)[:2] == expected
+    machines = [
+        async_machine.make_machine(code, [], StreamInputPort(io.StringIO()), geometry=wide),
+        batch.make_machine("jit", as_program(code), memory.PagedMemory(), [], wide)[0],
+    ]
+    for instance in machines:
+        with contextlib.suppress(StopIteration):
+            instance.run()
+        assert instance.current_tick() == expected[1]
+    if lockstep.np is not None:
+        assert lockstep.simulation_lockstep(code, [], [[]], wide) == [expected]
+        with pytest.raises(AssertionError, match="spilling"):
+            lockstep.simulation_lockstep(code, [], [[]], geometry.Geometry(spill=True))
+    with pytest.raises(AssertionError, match="call stack capacity exceeded"):
+        profiler.profile(code, [], [])
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_pipelined_control_unit_matches_sequential(golden):
+    data, code = translator.translate(golden["in_source"])
+    memory = list(chain.from_iterable(data.values()))
+    output, ticks = machine.simulation(code, list(memory), list(golden["in_stdin"]))
+
+    flushes = {}
+    for predictor in pipeline.predictors:
+        pipelined_output, pipelined_ticks, control_unit = pipeline.simulation_pipelined(
+            code, list(memory), list(golden["in_stdin"]), predictor
+        )
+        assert pipelined_output == output
+        # Каждая выборка, совмещённая с предыдущей инструкцией, экономит ровно один такт
+        assert ticks - pipelined_ticks == control_unit.instructions - control_unit.fetch_ticks
+        assert control_unit.fetch_ticks <= control_unit.flushes + 1
+        assert control_unit.stats()["stall_ticks"] == 0
+        flushes[predictor] = control_unit.flushes
+    assert flushes["static"] <= flushes["none"]
+
+    spill = geometry.Geometry(4, 2, spill=True)
+    _, spill_ticks = machine.simulation(code, list(memory), list(golden["in_stdin"]), geometry=spill)
+    _, pipelined_ticks, control_unit = pipeline.simulation_pipelined(
+        code, list(memory), list(golden["in_stdin"]), geometry=geometry.Geometry(4, 2, spill=True)
+    )
+    assert control_unit.stats()["stall_ticks"] == spill.stall_ticks
+    assert spill_ticks - pipelined_ticks == control_unit.instructions - control_unit.fetch_ticks
+
+
+def test_extended_isa_shortens_prob2():
+    source = """.text
+_main:
+    push 0          ; сумма
+    push 2
+    push 8          ; [сумма a b]: a и b -- соседние чётные числа Фибоначчи
+cycle:
+    over
+    push 3999999
+    cmp
+    js ext
+    pop
+    rot
+    rot
+    dup
+    rot
+    addp            ; [b a сумма+a]
+    rot
+    rot
+    over            ; [сумма b a b]
+    dup
+    addp
+    dup
+    addp
+    addp            ; [сумма b a+4b]
+    jmp cycle
+
+ext:
+    drop2
+    pop
+    push -1
+    swap
+digits:
+    jz print
+    push 10
+    swap
+    mod             ; [.. 10 x x%10]
+    rot
+    rot
+    divp            ; [.. x%10 x/10]
+    jmp digits
+
+print:
+    pop
+print_digit:
+    js end
+    push 48
+    addp
+    output 1
+    pop
+    jmp print_digit
+end:
+    hlt
+"""
+    _, code = translator.translate(source)
+    results = [machine.simulation(code, [], [], engine) for engine in ["mc", "instr", "jit"]]
+    assert results == [("4613732", 1102)] * 3
+    # Тот же алгоритм на базовом наборе команд (golden/prob2.yml) -- 1712 тактов
+    assert machine.ControlUnit.instruction_ticks()[Opcode.ADDP] == 2
+
+    for stack, calls in [(1, 1), (3, 1)]:
+        spilled = [geometry.Geometry(stack, calls, spill=True) for _ in range(2)]
+        assert [
+            machine.simulation(code, [], [], engine, geometry=spill) for engine, spill in zip(["mc", "instr"], spilled)
+        ] == [("4613732", 1102 + spilled[0].stall_ticks)] * 2
+        assert spilled[0].stats() == spilled[1].stats()
+
+    if lockstep.np is not None:
+        assert lockstep.simulation_lockstep(code, [0], [[]]) == [("4613732", 1102)]
+
+
+def test_block_io_shortens_hello_alice():
+    source = """.data
+question: "What is your name?", 10, 0
+hello_str: "Hello, ", 0
+buffer: res 256
+exclamation_mark: "!", 0
+
+.text
+_main:
+    push question
+    outs 1
+    push buffer
+    ins 0
+    push hello_str
+    outs 1
+    push buffer
+    outs 1
+    push exclamation_mark
+    outs 1
+    hlt
+"""
+    data, code = translator.translate(source)
+    memory = list(chain.from_iterable(data.values()))
+    ticks = machine.ControlUnit.instruction_ticks()
+    loops = machine.ControlUnit.loop_ticks()
+    assert loops == {Opcode.OUTS: 3, Opcode.INS: 7}
+    # golden/hello_alice.yml с циклами на базовых инструкциях -- 1016 тактов
+    expected = ("What is your name?\nHello, Alice!", 177)
+    printed = len("What is your name?\nHello, Alice!")
+    base = ticks[Opcode.JMP] + 5 * ticks[Opcode.PUSH] + 4 * ticks[Opcode.OUTS] + ticks[Opcode.INS]
+    assert expected[1] == base + printed * loops[Opcode.OUTS] + len("Alice") * loops[Opcode.INS]
+    for engine in ["mc", "instr", "jit"]:
+        assert machine.simulation(code, memory, list("Alice\n"), engine) == expected
+        # Пустой буфер посреди ins: такты до обнаружения, как у input
+        assert machine.simulation(code, memory, list("Al"), engine) == ("What is your name?\n", 88)
+
+    spilled = [geometry.Geometry(1, 1, spill=True) for _ in range(2)]
+    assert [
+        machine.simulation(code, memory, list("Alice\n"), engine, geometry=spill)
+        for engine, spill in zip(["mc", "instr"], spilled)
+    ] == [(expected[0], expected[1] + spilled[0].stall_ticks)] * 2
+    assert spilled[0].stats() == spilled[1].stats()
+    caches = [cache.Cache() for _ in range(2)]
+    results = [
+        machine.simulation(code, memory, list("Alice\n"), engine, cache=model)
+        for engine, model in zip(["mc", "instr"], caches)
+    ]
+    assert results[0] == results[1]
+    assert caches[0].stats() == caches[1].stats()
+
+    # Перезапуск цикла микропрограммы -- не выборка новой инструкции
+    _, pipelined_ticks, control_unit = pipeline.simulation_pipelined(code, memory, list("Alice\n"))
+    assert control_unit.instructions == 11
+    assert expected[1] - pipelined_ticks == control_unit.instructions - control_unit.fetch_ticks
+    program = analyzer.Analyzer(code)
+    assert program.main.max_ticks is None
+    assert program.main.min_ticks == base
+    if lockstep.np is not None:
+        assert lockstep.simulation_lockstep(code, memory, [list("Alice\n"), list("Al")]) == [
+            expected,
+            ("What is your name?\n", 88),
+        ]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_program_image_matches_object_files(golden):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source = os.path.join(tmpdirname, "source")
+        input_stream = os.path.join(tmpdirname, "input")
+        target_image = os.path.join(tmpdirname, "program.img")
+
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(golden["in_source"])
+        with open(input_stream, "w", encoding="utf-8") as file:
+            file.write(golden["in_stdin"])
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            translator.main(source, target_image)
+            print("============================================================")
+            machine.main(target_image, None, input_stream)
+        assert stdout.getvalue() == golden.out["out_stdout"]
+
+        program = image.read_image(target_image)
+        data, code, labels = translator.translate_with_labels(golden["in_source"])
+        assert list(program.code) == list(as_program(code))
+        assert program.data == [x & 0xFFFFFFFF for x in chain.from_iterable(data.values())]
+        assert program.labels == labels
+        assert program.data_labels == translator.get_labels_to_num(data)
+        source_lines = golden["in_source"].splitlines()
+        for pc, instr in enumerate(program.code):
+            if program.lines.get(pc) is not None:
+                assert source_lines[program.lines[pc] - 1].split()[0] == instr["opcode"].name.lower()
+        assert program.line(0) is None
+
+        # Без таблиц образ короче, нулевой хвост данных не занимает места в файле
+        bare = os.path.join(tmpdirname, "bare.img")
+        image.write_image(bare, code, data)
+        bare_program = image.read_image(bare)
+        assert (bare_program.labels, bare_program.lines) == (None, {})
+        assert bare_program.data == program.data
+        initialized = len(list(dropwhile(lambda x: x == 0, reversed(program.data))))
+        with open(bare, "rb") as file:
+            size = len(file.read())
+        assert size == image.HEADER.size + 3 * image.SECTION.size + 4 * (len(code) + initialized)
+
+        with open(target_image, "r+b") as file:
+            file.seek(-1, os.SEEK_END)
+            last = file.read(1)
+            file.seek(-1, os.SEEK_END)
+            file.write(bytes([last[0] ^ 1]))
+        with pytest.raises(AssertionError, match="checksum"):
+            image.read_image(target_image)
@@ -0,0 +1,215 @@
+"""Образ программы: код, данные и таблицы символов в одном файле.
+
+Пара `target_data.o`/`target_code.o` не хранит ни заголовка, ни меток. Образ -- версионированный контейнер,
+который пишет `translator.py` и загружает `machine.py` одним отображением файла в память (mmap).
+
+Формат (числа -- little-endian):
+- заголовок: `IMAGE_MAGIC`, версия, CRC32 всего, что идёт после поля контрольной суммы, число секций
+  (по 4 байта);
+- таблица секций: вид, смещение от начала файла и размер (по 4 байта); размер кода, данных и BSS --
+  в машинных словах, таблиц -- в записях;
+- `SECTION_CODE` и `SECTION_DATA` -- машинные слова, как в объектных файлах `isa.py`;
+- `SECTION_BSS` -- нулевой хвост памяти данных (`res n` в конце `.data`): в файле хранится только размер;
+- `SECTION_LINES` (необязательная) -- записи `адрес инструкции, номер строки исходного текста`;
+- `SECTION_SYMBOLS` (необязательная) -- записи `вид метки (SYMBOL_TEXT/SYMBOL_DATA), адрес, имя`.
+
+BSS выделяется только из хвоста: метки данных адресуются подряд, перенос `res` из середины `.data`
+сдвинул бы адреса остальных меток.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from collections.abc import Iterable
+
+from isa import (
+    Opcode,
+    Program,
+    SymbolTable,
+    bytes_to_words,
+    encode_instruction,
+    read_code,
+    read_data,
+    read_symbols,
+    word_array,
+    words_to_bytes,
+    words_to_program,
+)
+
+IMAGE_MAGIC = b"MIMG"
+IMAGE_VERSION = 1
+
+HEADER = struct.Struct("<4sIII")
+SECTION = struct.Struct("<III")
+LINE = struct.Struct("<II")
+SYMBOL = struct.Struct("<BIH")
+
+SECTION_CODE = 0
+SECTION_DATA = 1
+SECTION_BSS = 2
+SECTION_LINES = 3
+SECTION_SYMBOLS = 4
+
+SYMBOL_TEXT = 0
+SYMBOL_DATA = 1
+
+
+class Image:
+    """Загруженный образ.
+
+    `data` -- начальная память данных вместе с нулями BSS; `labels` и `data_labels` -- метки `.text`
+    и `.data`; `lines` -- адрес инструкции -> номер строки исходного текста.
+    """
+
+    def __init__(
+        self,
+        code: Program,
+        data: list[int],
+        labels: dict[str, int] | None = None,
+        data_labels: dict[str, int] | None = None,
+        lines: dict[int, int] | None = None,
+    ):
+        self.code = code
+        self.data = data
+        self.labels = labels
+        self.data_labels = data_labels
+        self.lines = lines or {}
+        self.line_addresses = sorted(self.lines)
+
+    def symbols(self) -> SymbolTable:
+        return SymbolTable(self.labels)
+
+    def line(self, pc: int) -> int | None:
+        """Строка исходного текста инструкции (для адресов без записи -- ближайшей сверху)."""
+        index = bisect_right(self.line_addresses, pc)
+        return self.lines[self.line_addresses[index - 1]] if index else None
+
+
+def source_lines(code: Iterable[dict[str, Opcode | str | int]]) -> dict[int, int]:
+    """Номера строк, которые транслятор сохраняет в инструкциях (у `jmp _main` в начале кода строки нет)."""
+    return {pc: instr["line"] for pc, instr in enumerate(code) if "line" in instr}
+
+
+def write_image(
+    filename,
+    code: Iterable[dict[str, Opcode | str | int]],
+    data: dict[str, list[int]],
+    labels: dict[str, int] | None = None,
+    lines: dict[int, int] | None = None,
+):
+    """Пишет образ; таблица символов -- только при заданных `labels`, таблица строк -- при непустых `lines`."""
+    words = [x & 0xFFFFFFFF for arr in data.values() for x in arr]
+    initialized = len(words)
+    while initialized and words[initialized - 1] == 0:
+        initialized -= 1
+
+    encoded_code = words_to_bytes(word_array(encode_instruction(instr) for instr in code))
+    # Секция: вид, размер, содержимое
+    sections: list[tuple[int, int, bytes]] = [
+        (SECTION_CODE, len(encoded_code) // 4, encoded_code),
+        (SECTION_DATA, initialized, words_to_bytes(word_array(words[:initialized]))),
+        (SECTION_BSS, len(words) - initialized, b""),
+    ]
+    if lines:
+        content = b"".join(LINE.pack(pc, line) for pc, line in sorted(lines.items()))
+        sections.append((SECTION_LINES, len(lines), content))
+    if labels is not None:
+        symbols = [(SYMBOL_TEXT, label, address) for label, address in labels.items()]
+        address = 0
+        for label, arr in data.items():
+            symbols.append((SYMBOL_DATA, label, address))
+            address += len(arr)
+        content = bytearray()
+        for kind, label, address in symbols:
+            encoded = label.encode("utf-8")
+            content += SYMBOL.pack(kind, address, len(encoded)) + encoded
+        sections.append((SECTION_SYMBOLS, len(symbols), bytes(content)))
+
+    table = bytearray()
+    offset = HEADER.size + SECTION.size * len(sections)
+    for kind, size, content in sections:
+        table += SECTION.pack(kind, offset if content else 0, size)
+        offset += len(content)
+    body = struct.pack("<I", len(sections)) + table + b"".join(content for _, _, content in sections)
+    with open(filename, "wb") as file:
+        file.write(IMAGE_MAGIC + struct.pack("<II", IMAGE_VERSION, zlib.crc32(body)) + body)
+
+
+def read_image(filename) -> Image:
+    """Загружает образ одним отображением файла в память и проверяет версию и контрольную сумму."""
+    with open(filename, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        assert size >= HEADER.size, "Not a program image: {}".format(filename)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            return parse_image(view, filename)
+
+
+def parse_image(view: memoryview, filename) -> Image:
+    magic, version, checksum, count = HEADER.unpack_from(view, 0)
+    assert magic == IMAGE_MAGIC, "Not a program image: {}".format(filename)
+    assert version == IMAGE_VERSION, "Unsupported image version: {}".format(version)
+    assert zlib.crc32(view[HEADER.size - 4 :]) == checksum, "Image checksum mismatch: {}".format(filename)
+
+    sections: dict[int, tuple[int, int]] = {}
+    for number in range(count):
+        kind, offset, size = SECTION.unpack_from(view, HEADER.size + SECTION.size * number)
+        sections[kind] = (offset, size)
+    assert {SECTION_CODE, SECTION_DATA, SECTION_BSS} <= sections.keys(), "Image lacks code or data sections"
+
+    offset, size = sections[SECTION_CODE]
+    code = words_to_program(bytes_to_words(view[offset : offset + 4 * size]))
+    offset, size = sections[SECTION_DATA]
+    data = bytes_to_words(view[offset : offset + 4 * size]).tolist()
+    data.extend([0] * sections[SECTION_BSS][1])
+
+    lines: dict[int, int] = {}
+    if SECTION_LINES in sections:
+        offset, size = sections[SECTION_LINES]
+        for pc, line in LINE.iter_unpack(view[offset : offset + LINE.size * size]):
+            lines[pc] = line
+
+    labels = data_labels = None
+    if SECTION_SYMBOLS in sections:
+        labels, data_labels = {}, {}
+        pos, size = sections[SECTION_SYMBOLS]
+        for _ in range(size):
+            kind, address, length = SYMBOL.unpack_from(view, pos)
+            pos += SYMBOL.size
+            label = bytes(view[pos : pos + length]).decode("utf-8")
+            pos += length
+            (labels if kind == SYMBOL_TEXT else data_labels)[label] = address
+    return Image(code, data, labels, data_labels, lines)
+
+
+def is_image(filename) -> bool:
+    with open(filename, "rb") as file:
+        return file.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+
+def load_program(code_file, data_file=None, symbols_file=None) -> (Program, list[int], dict[str, int] | None):
+    """Программа, память данных и метки `.text`: из образа, если `data_file` не задан, иначе из пары
+    объектных файлов и необязательной таблицы символов. `symbols_file` заменяет метки образа."""
+    if data_file is None:
+        image = read_image(code_file)
+        code, data, labels = image.code, image.data, image.labels
+    else:
+        code, data, labels = read_code(code_file), read_data(data_file), None
+    if symbols_file is not None:
+        labels = read_symbols(symbols_file)
+    return code, data, labels
+
+
+def program_arguments(files: list[str]) -> (str, str | None, list[str]):
+    """Позиционные аргументы CLI: `image_file ...` или, как раньше, `data_file code_file ...`.
+
+    Возвращает файл кода (или образа), файл данных (`None` для образа) и остальные аргументы.
+    """
+    if files and is_image(files[0]):
+        return files[0], None, files[1:]
+    assert len(files) >= 2, "Expected an image file or a data file and a code file"
+    data_file, code_file, *rest = files
+    return code_file, data_file, rest
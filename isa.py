@@ -1,5 +1,12 @@
 from __future__ import annotations
 
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterable, Iterator
 from enum import Enum
 
 
@@ -32,10 +39,80 @@ class Opcode(int, Enum):
 
     HLT = 0x14
 
+    # Расширенный набор: перестановки стека, остаток, сравнение и АЛУ, снимающее второй операнд
+    DUP = 0x15
+    OVER = 0x16
+    ROT = 0x17
+    DROP2 = 0x18
+    MOD = 0x19
+    CMP = 0x1A
+    ADDP = 0x1B
+    SUBP = 0x1C
+    DIVP = 0x1D
+
+    # Блочный ввод-вывод: строка в памяти данных по адресу из TOS -- циклы микропрограммы
+    OUTS = 0x1E
+    INS = 0x1F
+
     def __str__(self) -> str:
         return str(self.value)
 
 
+# Тип элемента `array` для беззнакового 32-битного машинного слова
+WORD_TYPECODE = next(typecode for typecode in "IL" if array(typecode).itemsize == 4)
+# Начиная с этого размера объектные файлы читаются через mmap
+MMAP_THRESHOLD = 1 << 20
+# Диапазон значений 32-битного слова в дополнительном коде
+WORD_MIN = -(1 << 31)
+WORD_MAX = (1 << 31) - 1
+
+
+def to_word(value: int) -> int:
+    """Значение как 32-битное слово в дополнительном коде: так переполняются результаты АЛУ."""
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class Program:
+    """Упакованный образ программы: параллельные массивы опкодов (1 байт) и аргументов (4 байта).
+
+    Индексирование и итерация возвращают инструкции в виде словарей `{"index", "opcode", "arg"}`,
+    как их описывает транслятор; модели процессора читают `opcodes` и `args` напрямую.
+    """
+
+    __slots__ = ("args", "opcodes")
+
+    def __init__(self, opcodes: array | None = None, args: array | None = None):
+        self.opcodes = array("B") if opcodes is None else opcodes
+        self.args = array("i") if args is None else args
+
+    @classmethod
+    def from_instructions(cls, code: Iterable[dict[str, Opcode | int]]) -> Program:
+        program = cls()
+        for instr in code:
+            program.append(instr["opcode"], int(instr.get("arg", 0)))
+        return program
+
+    def append(self, opcode: int, arg: int):
+        self.opcodes.append(opcode)
+        self.args.append(arg)
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def __getitem__(self, index: int) -> dict[str, Opcode | int]:
+        if index < 0:
+            index += len(self)
+        return {"index": index, "opcode": Opcode(self.opcodes[index]), "arg": self.args[index]}
+
+    def __iter__(self) -> Iterator[dict[str, Opcode | int]]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def as_program(code: Program | Iterable[dict[str, Opcode | int]]) -> Program:
+    return code if isinstance(code, Program) else Program.from_instructions(code)
+
+
 def int_to_bytes(integer: int) -> bytearray:
     res = []
     # Машинное слово 4 байта
@@ -50,43 +127,121 @@ def bytes_to_int(byte_arr: bytes) -> int:
     return (byte_arr[3] << 24) + (byte_arr[2] << 16) + (byte_arr[1] << 8) + byte_arr[0]
 
 
+def word_array(words: Iterable[int] = ()) -> array:
+    """Массив беззнаковых 32-битных машинных слов."""
+    return array(WORD_TYPECODE, words)
+
+
+def words_to_bytes(words: array) -> bytes:
+    # В объектных файлах слова хранятся в little-endian независимо от порядка байт хоста
+    if sys.byteorder == "big":
+        words = array(WORD_TYPECODE, words)
+        words.byteswap()
+    return words.tobytes()
+
+
+def bytes_to_words(content: bytes | memoryview) -> array:
+    assert len(content) % 4 == 0, "File size must be a multiple of the machine word (4 bytes)"
+    words = array(WORD_TYPECODE)
+    words.frombytes(content)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+def read_words(filename) -> array:
+    """Читает файл целиком в массив слов; большие файлы отображаются в память без промежуточной копии."""
+    with open(filename, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return bytes_to_words(file.read())
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            return bytes_to_words(view)
+
+
+def encode_instruction(instr: dict[str, Opcode | str | int]) -> int:
+    if "arg" in instr:
+        return (int(instr["opcode"]) << 27) + (int(instr["arg"]) + 0x07FFFFFF) % 0x07FFFFFF
+    return int(instr["opcode"]) << 27
+
+
+def decode_arg(word: int) -> int:
+    arg = word & 0x07FFFFFF
+    if arg > (1 << 26) - 1:
+        arg -= 0x07FFFFFF
+    return arg
+
+
 def write_code(filename, code):
     with open(filename, "wb") as file:
-        int_codes: list[int] = [
-            (int(instr["opcode"]) << 27) + (int(instr["arg"]) + 0x07FFFFFF) % 0x07FFFFFF
-            if "arg" in instr
-            else (int(instr["opcode"]) << 27)
-            for instr in code
-        ]
-        for x in int_codes:
-            file.write(int_to_bytes(x))
+        file.write(words_to_bytes(word_array(encode_instruction(instr) for instr in code)))
 
 
 def write_data(filename, data: dict[str, list[int]]):
     with open(filename, "wb") as file:
         for arr in data.values():
-            for x in arr:
-                file.write(int_to_bytes(x))
+            file.write(words_to_bytes(word_array(x & 0xFFFFFFFF for x in arr)))
 
 
 def read_data(filename) -> list[int]:
-    res = []
-    with open(filename, "rb") as file:
-        byte_content = file.read()
-        ind = 0
-        while ind < len(byte_content):
-            res.append(bytes_to_int(byte_content[ind : ind + 4]))
-            ind += 4
-    return res
+    return read_words(filename).tolist()
 
 
-def read_code(filename) -> list[dict[str, int]]:
-    arr_int = read_data(filename)
-    res = []
-    for num, x in enumerate(arr_int):
-        opcode = (x & (0xF8 << 24)) >> 27
-        arg = x & 0x07FFFFFF
-        if arg > (1 << 26) - 1:
-            arg -= 0x07FFFFFF
-        res.append({"index": num, "opcode": Opcode(opcode), "arg": arg})
-    return res
+def words_to_program(words: Iterable[int]) -> Program:
+    words = list(words)
+    return Program(array("B", [x >> 27 for x in words]), array("i", [decode_arg(x) for x in words]))
+
+
+def read_code(filename) -> Program:
+    return words_to_program(read_words(filename))
+
+
+def iter_code(filename, chunk_words: int = 1 << 14) -> Iterator[dict[str, Opcode | int]]:
+    """Потоково читает машинный код, не загружая файл целиком."""
+    index = 0
+    with open(filename, "rb") as file:
+        while chunk := file.read(4 * chunk_words):
+            assert len(chunk) % 4 == 0, "File size must be a multiple of the machine word (4 bytes)"
+            for (x,) in struct.iter_unpack("<I", chunk):
+                yield {"index": index, "opcode": Opcode(x >> 27), "arg": decode_arg(x)}
+                index += 1
+
+
+class SymbolTable:
+    """Метки памяти команд: имя метки по адресу и ближайшая к адресу метка."""
+
+    def __init__(self, labels: dict[str, int] | None = None):
+        self.names: dict[int, str] = {}
+        for label, address in (labels or {}).items():
+            self.names.setdefault(address, label)
+        self.addresses = sorted(self.names)
+
+    def location(self, pc: int) -> str:
+        """Метка, ближайшая к адресу сверху, и смещение от неё."""
+        index = bisect_right(self.addresses, pc)
+        if index == 0:
+            return str(pc)
+        address = self.addresses[index - 1]
+        label = self.names[address]
+        return label if address == pc else "{}+{}".format(label, pc - address)
+
+    def region(self, pc: int) -> str:
+        index = bisect_right(self.addresses, pc)
+        return self.names[self.addresses[index - 1]] if index else "<start>"
+
+
+def write_symbols(filename, labels: dict[str, int]):
+    """Таблица символов памяти команд: строки `<адрес> <метка>` в порядке адресов."""
+    with open(filename, "w", encoding="utf-8") as file:
+        for label, address in sorted(labels.items(), key=lambda item: item[1]):
+            file.write("{} {}\n".format(address, label))
+
+
+def read_symbols(filename) -> dict[str, int]:
+    labels: dict[str, int] = {}
+    with open(filename, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                address, label = line.split()
+                labels[label] = int(address)
+    return labels
@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+
+from isa import WORD_MAX, WORD_MIN, Opcode, Program, as_program, to_word
+from memory import OFFSET_MASK, PAGE_BITS, PAGE_MASK, ZERO_PAGE, PagedMemory, as_memory
+from ports import Port, make_ports
+
+# Инструкции, после которых начинается новый базовый блок
+block_terminators: set[Opcode] = {
+    Opcode.JMP,
+    Opcode.JZ,
+    Opcode.JNZ,
+    Opcode.JS,
+    Opcode.JNS,
+    Opcode.CALL,
+    Opcode.RET,
+    Opcode.HLT,
+}
+
+# Условие перехода: шаблон для генерируемого кода и то же условие для TOS, известного при трансляции
+jump_conditions: dict[Opcode, tuple[str, Callable[[int], bool]]] = {
+    Opcode.JZ: ("{} == 0", lambda tos: tos == 0),
+    Opcode.JNZ: ("{} != 0", lambda tos: tos != 0),
+    Opcode.JS: ("{} < 0", lambda tos: tos < 0),
+    Opcode.JNS: ("{} >= 0", lambda tos: tos >= 0),
+}
+
+# Сигнатура скомпилированного блока: (tos, stack, call_stack, memory, ports, clock) -> (next_pc | None, tos);
+# в `clock[0]` блок прибавляет такты повторов цикла outs и ins -- их число известно только при исполнении
+Block = Callable[[int, list[int], list[int], PagedMemory, dict[int, Port], list[int]], tuple[int | None, int]]
+
+
+# Скомпилированные блоки для каждого образа программы и геометрии стеков; при переполнении
+# вытесняются блоки программы, которая дольше всех не запускалась (LRU)
+CODE_CACHE_SIZE = 64
+code_cache: OrderedDict[tuple, dict[int, tuple[Block, int]]] = OrderedDict()
+
+
+class InputExhaustedError(EOFError):
+    """Буфер ввода опустел посреди блока; `ticks` -- такты блока, выполненные до этого момента."""
+
+    def __init__(self, ticks: int):
+        super().__init__()
+        self.ticks = ticks
+
+
+def write_string(memory: PagedMemory, port: Port, address: int) -> tuple[int, int]:
+    """`outs`: выводит строку до нулевого символа; адрес после него и число выведенных символов."""
+    count = 0
+    while char := memory[address]:
+        port.write(chr(char))
+        address = to_word(address + 1)
+        count += 1
+    return to_word(address + 1), count
+
+
+def read_line(memory: PagedMemory, port: Port, address: int) -> tuple[int | None, int]:
+    """`ins`: читает строку до перевода строки и заменяет его нулевым символом; адрес после него
+    (None -- буфер ввода опустел) и число символов до перевода строки."""
+    count = 0
+    while True:
+        try:
+            char = port.read()
+        except EOFError:
+            return None, count
+        if char == "\n":
+            memory[address] = 0
+            return to_word(address + 1), count
+        memory[address] = ord(char)
+        address = to_word(address + 1)
+        count += 1
+
+
+def atom(value: int | str) -> str:
+    if isinstance(value, int):
+        return "({})".format(value) if value < 0 else str(value)
+    return value
+
+
+class BlockBuilder:
+    """Генерирует исходный код Python для одного базового блока.
+
+    Значения, положенные на стек внутри блока, хранятся в локальных переменных (`virtual_stack`)
+    и попадают в настоящий стек только при выходе из блока.
+    Элемент `virtual_stack` и `tos` -- число (известная при трансляции константа) или имя переменной.
+    """
+
+    def __init__(
+        self,
+        ticks: dict[Opcode, int],
+        input_eof_ticks: dict[Opcode, int],
+        loop_ticks: dict[Opcode, int],
+        stack_capacity,
+        call_stack_capacity,
+    ):
+        self.instruction_ticks = ticks
+        self.input_eof_ticks = input_eof_ticks
+        self.loop_ticks = loop_ticks
+        self.stack_capacity = stack_capacity
+        self.call_stack_capacity = call_stack_capacity
+        self.lines: list[str] = []
+        self.virtual_stack: list[int | str] = []
+        self.tos: int | str = "tos"
+        self.depth = 0
+        self.peak = 0
+        # Элементы настоящего стека, снятые блоком, и наибольшее их число, которое уже проверено
+        self.floor = 0
+        self.checked_floor = 0
+        self.ticks = 0
+        self.temps = 0
+        # Страницы памяти данных, уже найденные в блоке: адрес -> (переменная со страницей, годится ли для записи)
+        self.page_vars: dict[str, tuple[str, bool]] = {}
+
+    def emit(self, line: str):
+        self.lines.append("    " + line)
+
+    def temp(self, expression: str) -> str:
+        name = "t{}".format(self.temps)
+        self.temps += 1
+        self.emit("{} = {}".format(name, expression))
+        return name
+
+    def grow(self, value: int | str):
+        self.depth += 1
+        if self.depth > self.peak:
+            self.peak = self.depth
+            self.emit("if room < {}:".format(self.depth))
+            self.emit('    raise AssertionError("stack capacity exceeded")')
+        self.virtual_stack.append(value)
+
+    def require(self, count: int):
+        """Проверка, что при входе в блок в стеке было не меньше `count` элементов."""
+        if count > self.checked_floor:
+            self.checked_floor = count
+            self.emit("if room > {}:".format(self.stack_capacity - count))
+            self.emit('    raise AssertionError("a negative stack pointer was received")')
+
+    def shrink(self) -> int | str:
+        self.depth -= 1
+        if self.virtual_stack:
+            return self.virtual_stack.pop()
+        self.floor += 1
+        self.require(self.floor)
+        return self.temp("stack.pop()")
+
+    def top(self) -> int | str:
+        if self.virtual_stack:
+            return self.virtual_stack[-1]
+        self.require(self.floor + 1)
+        return self.temp("stack[-1]")
+
+    def flush(self):
+        if self.virtual_stack:
+            values = ", ".join(atom(value) for value in self.virtual_stack)
+            self.emit("stack.extend(({},))".format(values))
+            self.virtual_stack = []
+
+    def exit(self, next_pc: str):
+        self.flush()
+        self.emit("return {}, {}".format(next_pc, atom(self.tos)))
+
+    def add(self, pc: int, opcode: Opcode, arg: int):
+        getattr(self, "op_" + opcode.name.lower())(pc, arg)
+        self.ticks += self.instruction_ticks[opcode]
+
+    def source(self, name: str) -> str:
+        header = ["def {}(tos, stack, call_stack, memory, ports, clock):".format(name)]
+        if self.peak or self.checked_floor:
+            header.append("    room = {} - len(stack)".format(self.stack_capacity))
+        header.append("    pages = memory.pages")
+        return "\n".join(header + self.lines) + "\n"
+
+    def op_push(self, pc, arg):
+        self.grow(self.tos)
+        self.tos = arg
+
+    def op_pop(self, pc, arg):
+        self.tos = self.shrink()
+
+    def op_swap(self, pc, arg):
+        if self.virtual_stack:
+            self.tos, self.virtual_stack[-1] = self.virtual_stack[-1], self.tos
+        else:
+            top = self.top()
+            self.emit("stack[-1] = {}".format(atom(self.tos)))
+            self.tos = top
+
+    def op_dup(self, pc, arg):
+        self.grow(self.tos)
+
+    def op_over(self, pc, arg):
+        second = self.top()
+        self.grow(self.tos)
+        self.tos = second
+
+    def op_rot(self, pc, arg):
+        second = self.shrink()
+        third = self.top()
+        if self.virtual_stack:
+            self.virtual_stack[-1] = second
+        else:
+            self.emit("stack[-1] = {}".format(atom(second)))
+        self.grow(self.tos)
+        self.tos = third
+
+    def op_drop2(self, pc, arg):
+        self.shrink()
+        self.tos = self.shrink()
+
+    def op_jmp(self, pc, arg):
+        self.exit(str(arg))
+
+    def conditional_jump(self, pc, arg, opcode: Opcode):
+        template, predicate = jump_conditions[opcode]
+        if isinstance(self.tos, int):
+            self.exit(str(arg if predicate(self.tos) else pc + 1))
+        else:
+            self.exit("{} if {} else {}".format(arg, template.format(self.tos), pc + 1))
+
+    def op_jz(self, pc, arg):
+        self.conditional_jump(pc, arg, Opcode.JZ)
+
+    def op_jnz(self, pc, arg):
+        self.conditional_jump(pc, arg, Opcode.JNZ)
+
+    def op_js(self, pc, arg):
+        self.conditional_jump(pc, arg, Opcode.JS)
+
+    def op_jns(self, pc, arg):
+        self.conditional_jump(pc, arg, Opcode.JNS)
+
+    def op_call(self, pc, arg):
+        self.emit("if len(call_stack) >= {}:".format(self.call_stack_capacity))
+        self.emit('    raise AssertionError("call stack capacity exceeded")')
+        self.emit("call_stack.append({})".format(pc + 1))
+        self.exit(str(arg))
+
+    def op_ret(self, pc, arg):
+        self.emit("if not call_stack:")
+        self.emit('    raise AssertionError("a negative scp was received")')
+        self.exit("call_stack.pop()")
+
+    def op_input(self, pc, arg):
+        self.emit("try:")
+        self.emit("    char = ports[{}].read()".format(arg))
+        self.emit("except EOFError:")
+        self.emit("    raise InputExhaustedError({}) from None".format(self.ticks + self.input_eof_ticks[Opcode.INPUT]))
+        self.grow(self.tos)
+        self.tos = self.temp("ord(char)")
+
+    def op_output(self, pc, arg):
+        assert 0 <= arg < 16, "Invalid port"
+        self.emit("ports[{}].write(chr({}))".format(arg, atom(self.tos)))
+
+    def stream(self, call: str) -> tuple[str, str]:
+        """Вызов `write_string` или `read_line`: переменные с адресом после строки и числом повторов цикла."""
+        address, count = "t{}".format(self.temps), "t{}".format(self.temps + 1)
+        self.temps += 2
+        self.emit("{}, {} = {}".format(address, count, call))
+        return address, count
+
+    def op_outs(self, pc, arg):
+        assert 0 <= arg < 16, "Invalid port"
+        address, count = self.stream("write_string(memory, ports[{}], {})".format(arg, atom(self.tos)))
+        self.emit("clock[0] += {} * {}".format(count, self.loop_ticks[Opcode.OUTS]))
+        self.tos = address
+
+    def op_ins(self, pc, arg):
+        # Микропрограмма хранит адрес в стеке на время чтения символа: в стеке нужно свободное место
+        self.grow(self.tos)
+        self.shrink()
+        address, count = self.stream("read_line(memory, ports[{}], {})".format(arg, atom(self.tos)))
+        self.emit("clock[0] += {} * {}".format(count, self.loop_ticks[Opcode.INS]))
+        self.emit("if {} is None:".format(address))
+        self.emit("    raise InputExhaustedError({})".format(self.ticks + self.input_eof_ticks[Opcode.INS]))
+        # Строка записана в память в обход блока: страницы, найденные до неё, ищутся заново
+        self.page_vars = {}
+        self.tos = address
+
+    def result(
+        self, expression: str, fold: Callable[[], int] | None, overflow: str = "not {} <= {} <= {}"
+    ) -> int | str:
+        if fold is not None:
+            return to_word(fold())
+        result = self.temp(expression)
+        # Результат -- 32-битное слово; полное приведение нужно только при переполнении
+        self.emit("if {}:".format(overflow.format(WORD_MIN, result, WORD_MAX)))
+        self.emit("    {} = to_word({})".format(result, result))
+        return result
+
+    def alu(self, expression: str, fold: Callable[[], int] | None = None, overflow: str = "not {} <= {} <= {}"):
+        # АЛУ оставляет оба операнда на стеке: прежний TOS уходит в стек, результат -- в TOS
+        result = self.result(expression, fold, overflow)
+        self.grow(self.tos)
+        self.tos = result
+
+    def binary(self, operator: str, fold: Callable[[int, int], int] | None):
+        left, right = self.tos, self.top()
+        constant = fold is not None and isinstance(left, int) and isinstance(right, int)
+        self.alu(
+            "{} {} {}".format(atom(left), operator, atom(right)), (lambda: fold(left, right)) if constant else None
+        )
+
+    def op_add(self, pc, arg):
+        self.binary("+", lambda a, b: a + b)
+
+    def op_sub(self, pc, arg):
+        self.binary("-", lambda a, b: a - b)
+
+    def op_mul(self, pc, arg):
+        self.binary("*", lambda a, b: a * b)
+
+    def op_div(self, pc, arg):
+        self.binary("//", None)
+
+    def op_mod(self, pc, arg):
+        self.binary("%", None)
+
+    def consuming(self, operator: str, fold: Callable[[int, int], int] | None):
+        # Второй операнд снимается со стека, результат -- в TOS
+        left, right = self.tos, self.shrink()
+        constant = fold is not None and isinstance(left, int) and isinstance(right, int)
+        self.tos = self.result(
+            "{} {} {}".format(atom(left), operator, atom(right)),
+            (lambda: fold(left, right)) if constant else None,
+        )
+
+    def op_cmp(self, pc, arg):
+        left, right = self.tos, self.shrink()
+        if isinstance(left, int) and isinstance(right, int):
+            self.tos = (left > right) - (left < right)
+        else:
+            self.tos = self.temp("({0} > {1}) - ({0} < {1})".format(atom(left), atom(right)))
+
+    def op_addp(self, pc, arg):
+        self.consuming("+", lambda a, b: a + b)
+
+    def op_subp(self, pc, arg):
+        self.consuming("-", lambda a, b: a - b)
+
+    def op_divp(self, pc, arg):
+        self.consuming("//", None)
+
+    def op_inc(self, pc, arg):
+        value = self.tos
+        self.alu("{} + 1".format(atom(value)), (lambda: value + 1) if isinstance(value, int) else None, "{2} < {1}")
+
+    def op_dec(self, pc, arg):
+        value = self.tos
+        self.alu("{} - 1".format(atom(value)), (lambda: value - 1) if isinstance(value, int) else None, "{1} < {0}")
+
+    def page_and_offset(self, address: int | str) -> tuple[str, str]:
+        """Номер страницы и смещение в ней (см. `memory.PagedMemory`); для константы -- вычисленные при трансляции."""
+        if isinstance(address, int):
+            return str(address >> PAGE_BITS & PAGE_MASK), str(address & OFFSET_MASK)
+        return "{} >> {} & {}".format(address, PAGE_BITS, PAGE_MASK), "{} & {}".format(address, OFFSET_MASK)
+
+    def memory_cell(self, address: int | str, write: bool) -> str:
+        """Ячейка памяти данных; страница по одному и тому же адресу ищется в блоке один раз."""
+        number, offset = self.page_and_offset(address)
+        page, writable = self.page_vars.get(atom(address), (None, False))
+        if page is None or (write and not writable):
+            if write:
+                if not number.isdigit():
+                    number = self.temp(number)
+                page = self.temp("pages.get({0}) or memory.page({0})".format(number))
+                # Запись могла выделить страницу, которую другой адрес блока прочитал как ZERO_PAGE
+                self.page_vars = {key: cached for key, cached in self.page_vars.items() if cached[1]}
+            else:
+                # Невыделенная страница читается как ZERO_PAGE, для записи её нужно выделить
+                page = self.temp("pages.get({}) or ZERO_PAGE".format(number))
+            self.page_vars[atom(address)] = (page, write)
+        return "{}[{}]".format(page, offset)
+
+    def op_load(self, pc, arg):
+        value = self.temp(self.memory_cell(self.tos, write=False))
+        self.grow(self.tos)
+        self.tos = value
+
+    def op_store(self, pc, arg):
+        self.emit("{} = {}".format(self.memory_cell(self.top(), write=True), atom(self.tos)))
+
+    def op_hlt(self, pc, arg):
+        self.exit("None")
+
+
+class BlockCompiler:
+    """Разбивает программу на базовые блоки и лениво компилирует каждый блок при первом входе в него."""
+
+    def __init__(
+        self,
+        program,
+        ticks: dict[Opcode, int],
+        input_eof_ticks: dict[Opcode, int],
+        loop_ticks: dict[Opcode, int],
+        stack_capacity,
+        call_stack_capacity,
+    ):
+        program: Program = as_program(program)
+        self.program = [(Opcode(opcode), arg) for opcode, arg in zip(program.opcodes, program.args)]
+        self.ticks = ticks
+        self.input_eof_ticks = input_eof_ticks
+        self.loop_ticks = loop_ticks
+        self.stack_capacity = stack_capacity
+        self.call_stack_capacity = call_stack_capacity
+        self.leaders = self.find_leaders()
+        key = (program.opcodes.tobytes(), program.args.tobytes(), stack_capacity, call_stack_capacity)
+        self.blocks = code_cache.setdefault(key, {})
+        code_cache.move_to_end(key)
+        while len(code_cache) > CODE_CACHE_SIZE:
+            code_cache.popitem(last=False)
+
+    def find_leaders(self) -> set[int]:
+        leaders = {0}
+        for pc, (opcode, arg) in enumerate(self.program):
+            if opcode in block_terminators:
+                leaders.add(pc + 1)
+                if opcode not in {Opcode.RET, Opcode.HLT}:
+                    leaders.add(arg)
+        return leaders
+
+    def block(self, start: int) -> tuple[Block, int]:
+        block = self.blocks.get(start)
+        if block is None:
+            block = self.blocks[start] = self.compile(start)
+        return block
+
+    def compile(self, start: int) -> tuple[Block, int]:
+        builder = BlockBuilder(
+            self.ticks, self.input_eof_ticks, self.loop_ticks, self.stack_capacity, self.call_stack_capacity
+        )
+        pc = start
+        while True:
+            opcode, arg = self.program[pc]
+            builder.add(pc, opcode, arg)
+            pc += 1
+            if opcode in block_terminators:
+                break
+            if pc in self.leaders or pc == len(self.program):
+                builder.exit(str(pc))
+                break
+
+        name = "block_{}".format(start)
+        namespace = {
+            "InputExhaustedError": InputExhaustedError,
+            "ZERO_PAGE": ZERO_PAGE,
+            "read_line": read_line,
+            "to_word": to_word,
+            "write_string": write_string,
+        }
+        exec(compile(builder.source(name), "<block {}>".format(start), "exec"), namespace)
+        return namespace[name], builder.ticks
+
+
+class BlockMachine:
+    """Модель процессора, исполняющая программу скомпилированными в Python базовыми блоками."""
+
+    compiler: BlockCompiler = None
+    pc = None
+    tos: int = None
+    stack: list[int] = None
+    call_stack: list[int] = None
+    data_memory: PagedMemory = None
+    io_ports: dict[int, Port] = None
+    _tick = None
+
+    def __init__(
+        self,
+        compiler: BlockCompiler,
+        data,
+        input_tokens: Iterable[str] | Port,
+        devices: dict[int, Port] | None = None,
+    ):
+        self.compiler = compiler
+        self.pc = 0
+        self.tos = 0
+        self.stack = []
+        self.call_stack = []
+        self.data_memory = as_memory(data)
+        self.io_ports = make_ports(input_tokens, devices)
+        self._tick = 0
+
+    def current_tick(self):
+        return self._tick
+
+    def run(self):
+        blocks = self.compiler.blocks
+        stack, call_stack, memory, ports = self.stack, self.call_stack, self.data_memory, self.io_ports
+        pc, tos = self.pc, self.tos
+        # Такты повторов цикла outs и ins, которые блоки насчитали при исполнении
+        clock = [0]
+        try:
+            while pc is not None:
+                block, ticks = blocks.get(pc) or self.compiler.block(pc)
+                pc, tos = block(tos, stack, call_stack, memory, ports, clock)
+                self._tick += ticks
+        except InputExhaustedError as e:
+            self._tick += e.ticks
+            raise
+        finally:
+            self.pc, self.tos = pc, tos
+            self._tick += clock[0]
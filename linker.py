@@ -0,0 +1,308 @@
+"""Раздельная трансляция и компоновка.
+
+Каждый исходный модуль транслируется в перемещаемый объектный файл: код и данные модуля с адресами
+от нуля, таблица символов (метки `.text` и `.data`, признак `global`) и таблица перемещений --
+инструкции `jmp/jz/.../call label` и `push label`, аргумент которых подставляет компоновщик.
+Метки, не объявленные в `global`, видны только внутри модуля; `extern` объявляет метки других модулей.
+Метка `_main` экспортируется всегда: компоновщик начинает программу переходом на неё.
+
+Формат объектного файла (числа -- little-endian):
+- заголовок: `OBJECT_MAGIC`, версия (4 байта), имя модуля, число инструкций и слов данных (по 4 байта);
+- машинные слова кода (аргументы перемещаемых инструкций -- нули) и данных;
+- таблицы символов, внешних имён и перемещений (см. `write_object`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import struct
+from pathlib import Path
+
+from isa import (
+    Opcode,
+    Program,
+    bytes_to_words,
+    encode_instruction,
+    word_array,
+    words_to_bytes,
+    words_to_program,
+    write_code,
+    write_data,
+    write_symbols,
+)
+from translator import (
+    PeepholeOptimizer,
+    get_data,
+    get_directives,
+    get_labels_to_num,
+    is_number,
+    translate_stage_1,
+)
+
+OBJECT_MAGIC = b"MOBJ"
+OBJECT_VERSION = 1
+
+SECTION_TEXT = 0
+SECTION_DATA = 1
+
+ENTRY_LABEL = "_main"
+
+
+class ObjectFile:
+    """Перемещаемый объектный модуль.
+
+    `symbols[section]` -- метка -> смещение в секции модуля; `relocations` -- (номер инструкции, секция, метка).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        code: Program,
+        data: dict[str, list[int]],
+        symbols: dict[int, dict[str, int]],
+        global_names: set[str],
+        extern_names: set[str],
+        relocations: list[tuple[int, int, str]],
+    ):
+        self.name = name
+        self.code = code
+        self.data = data
+        self.symbols = symbols
+        self.global_names = global_names
+        self.extern_names = extern_names
+        self.relocations = relocations
+
+    def data_size(self) -> int:
+        return sum(len(words) for words in self.data.values())
+
+    def exports(self) -> dict[tuple[int, str], int]:
+        """Символы, видимые другим модулям: (секция, метка) -> смещение."""
+        return {
+            (section, label): offset
+            for section, symbols in self.symbols.items()
+            for label, offset in symbols.items()
+            if label in self.global_names or label == ENTRY_LABEL
+        }
+
+
+def compile_object(source: str, name: str, optimizer: PeepholeOptimizer | None = None) -> ObjectFile:
+    text = source.splitlines()
+    global_names, extern_names = get_directives(text)
+    data = get_data(text)
+    labels, code = translate_stage_1(text, entry=False)
+    if optimizer is not None:
+        labels, code = optimizer.optimize(labels, code)
+    symbols = {SECTION_TEXT: labels, SECTION_DATA: get_labels_to_num(data)}
+    for label in global_names:
+        assert label in labels or label in symbols[SECTION_DATA], "Global label not defined: {}".format(label)
+
+    relocations: list[tuple[int, int, str]] = []
+    for instruction in code:
+        if "arg" not in instruction:
+            continue
+        opcode, arg = instruction["opcode"], instruction["arg"]
+        if opcode in {Opcode.INPUT, Opcode.OUTPUT, Opcode.OUTS, Opcode.INS}:
+            assert 0 <= int(arg) <= 15, "Number of port must take values in the segment [0; 15]"
+            continue
+        if opcode is Opcode.PUSH and is_number(arg):
+            assert -(1 << 26) <= int(arg) <= (1 << 26) - 1, "Integer must take values in the segment [-2^26; 2^26 - 1]"
+            continue
+        # push label ссылается на память данных, переходы -- на память команд
+        section = SECTION_DATA if opcode is Opcode.PUSH else SECTION_TEXT
+        assert arg in symbols[section] or arg in extern_names, "Label not defined: " + arg
+        relocations.append((instruction["index"], section, arg))
+        instruction["arg"] = 0
+
+    return ObjectFile(name, Program.from_instructions(code), data, symbols, global_names, extern_names, relocations)
+
+
+def layout(objects: list[ObjectFile]) -> (list[int], list[int], dict[tuple[int, str], int]):
+    """Базовые адреса кода и данных каждого модуля и адреса экспортируемых символов."""
+    code_bases, data_bases = [], []
+    code_size, data_size = 1, 0  # по адресу 0 -- переход на _main
+    exported: dict[tuple[int, str], int] = {}
+    for obj in objects:
+        code_bases.append(code_size)
+        data_bases.append(data_size)
+        for (section, label), offset in obj.exports().items():
+            assert (section, label) not in exported, "Duplicate global label: {}".format(label)
+            exported[section, label] = offset + (code_size if section == SECTION_TEXT else data_size)
+        code_size += len(obj.code)
+        data_size += obj.data_size()
+    assert (SECTION_TEXT, ENTRY_LABEL) in exported, "Label not defined: " + ENTRY_LABEL
+    return code_bases, data_bases, exported
+
+
+def link(objects: list[ObjectFile]) -> (Program, dict[str, list[int]], dict[str, int]):
+    """Компоновка: код, данные и метки памяти команд программы (для таблицы символов профилировщика)."""
+    code_bases, data_bases, exported = layout(objects)
+    program = Program()
+    program.append(Opcode.JMP, exported[SECTION_TEXT, ENTRY_LABEL])
+    data: dict[str, list[int]] = {}
+    labels: dict[str, int] = {}
+    for obj, code_base, data_base in zip(objects, code_bases, data_bases):
+        bases = {SECTION_TEXT: code_base, SECTION_DATA: data_base}
+        args = obj.code.args[:]
+        for index, section, label in obj.relocations:
+            if label in obj.symbols[section]:
+                args[index] = obj.symbols[section][label] + bases[section]
+            else:
+                assert (section, label) in exported, "Unresolved external label: {}".format(label)
+                args[index] = exported[section, label]
+        program.opcodes.extend(obj.code.opcodes)
+        program.args.extend(args)
+
+        for label, words in obj.data.items():
+            data[qualified_name(obj, label)] = words
+        for label, offset in obj.symbols[SECTION_TEXT].items():
+            labels[qualified_name(obj, label)] = offset + code_base
+    return program, data, labels
+
+
+def qualified_name(obj: ObjectFile, label: str) -> str:
+    # Локальные метки разных модулей могут совпадать
+    return label if label in obj.global_names or label == ENTRY_LABEL else "{}:{}".format(obj.name, label)
+
+
+def write_string(file, string: str):
+    encoded = string.encode("utf-8")
+    file.write(struct.pack("<H", len(encoded)))
+    file.write(encoded)
+
+
+def read_string(content: bytes, pos: int) -> tuple[str, int]:
+    (length,) = struct.unpack_from("<H", content, pos)
+    pos += 2
+    return content[pos : pos + length].decode("utf-8"), pos + length
+
+
+def write_object(filename, obj: ObjectFile):
+    data = [word for words in obj.data.values() for word in words]
+    with open(filename, "wb") as file:
+        file.write(OBJECT_MAGIC + struct.pack("<I", OBJECT_VERSION))
+        write_string(file, obj.name)
+        file.write(struct.pack("<II", len(obj.code), len(data)))
+        file.write(words_to_bytes(word_array(encode_instruction(instr) for instr in obj.code)))
+        file.write(words_to_bytes(word_array(x & 0xFFFFFFFF for x in data)))
+
+        # Символ: секция, признак global, смещение, метка; для данных смещения задают и границы массивов меток
+        symbols = [
+            (section, label, offset) for section, labels in obj.symbols.items() for label, offset in labels.items()
+        ]
+        file.write(struct.pack("<I", len(symbols)))
+        for section, label, offset in symbols:
+            file.write(struct.pack("<BBI", section, label in obj.global_names, offset))
+            write_string(file, label)
+        file.write(struct.pack("<I", len(obj.extern_names)))
+        for label in sorted(obj.extern_names):
+            write_string(file, label)
+        file.write(struct.pack("<I", len(obj.relocations)))
+        for index, section, label in obj.relocations:
+            file.write(struct.pack("<IB", index, section))
+            write_string(file, label)
+
+
+def read_object(filename) -> ObjectFile:
+    with open(filename, "rb") as file:
+        content = file.read()
+    assert content[:4] == OBJECT_MAGIC, "Not an object file: {}".format(filename)
+    (version,) = struct.unpack_from("<I", content, 4)
+    assert version == OBJECT_VERSION, "Unsupported object file version: {}".format(version)
+    name, pos = read_string(content, 8)
+    code_size, data_size = struct.unpack_from("<II", content, pos)
+    pos += 8
+    code = words_to_program(bytes_to_words(content[pos : pos + 4 * code_size]))
+    pos += 4 * code_size
+    # Память данных хранит знаковые числа, как их пишет транслятор
+    words = [x - (1 << 32) if x >> 31 else x for x in bytes_to_words(content[pos : pos + 4 * data_size])]
+    pos += 4 * data_size
+
+    symbols: dict[int, dict[str, int]] = {SECTION_TEXT: {}, SECTION_DATA: {}}
+    global_names: set[str] = set()
+    (count,) = struct.unpack_from("<I", content, pos)
+    pos += 4
+    for _ in range(count):
+        section, is_global, offset = struct.unpack_from("<BBI", content, pos)
+        label, pos = read_string(content, pos + 6)
+        symbols[section][label] = offset
+        if is_global:
+            global_names.add(label)
+
+    extern_names: set[str] = set()
+    (count,) = struct.unpack_from("<I", content, pos)
+    pos += 4
+    for _ in range(count):
+        label, pos = read_string(content, pos)
+        extern_names.add(label)
+
+    relocations: list[tuple[int, int, str]] = []
+    (count,) = struct.unpack_from("<I", content, pos)
+    pos += 4
+    for _ in range(count):
+        index, section = struct.unpack_from("<IB", content, pos)
+        label, pos = read_string(content, pos + 5)
+        relocations.append((index, section, label))
+
+    # Массивы меток данных восстанавливаются по смещениям меток
+    data: dict[str, list[int]] = {}
+    starts = sorted(symbols[SECTION_DATA].items(), key=lambda item: item[1])
+    for number, (label, start) in enumerate(starts):
+        end = starts[number + 1][1] if number + 1 < len(starts) else len(words)
+        data[label] = words[start:end]
+    return ObjectFile(name, code, data, symbols, global_names, extern_names, relocations)
+
+
+def compile_file(source_file, object_file, optimize: bool = False):
+    with open(source_file, encoding="utf-8") as file:
+        source = file.read()
+    optimizer = PeepholeOptimizer() if optimize else None
+    write_object(object_file, compile_object(source, Path(source_file).stem, optimizer))
+
+
+def link_files(object_files: list[str], target_data_file, target_program_file, target_symbols_file=None):
+    program, data, labels = link([read_object(object_file) for object_file in object_files])
+    write_data(target_data_file, data)
+    write_code(target_program_file, program)
+    if target_symbols_file is not None:
+        write_symbols(target_symbols_file, labels)
+    print("objects:", len(object_files), "code instr:", len(program))
+
+
+def build(source_files: list[str], target_data_file, target_program_file, target_symbols_file=None, optimize=False):
+    """Транслирует только модули, исходник которых новее объектного файла `<source>.obj`, и компонует программу."""
+    object_files = []
+    for source_file in source_files:
+        object_file = Path(source_file + ".obj")
+        if not object_file.exists() or object_file.stat().st_mtime < Path(source_file).stat().st_mtime:
+            compile_file(source_file, object_file, optimize)
+            print("compiled:", source_file)
+        object_files.append(object_file)
+    link_files(object_files, target_data_file, target_program_file, target_symbols_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Separate compilation and linking")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser("compile", help="translate one source file to an object file")
+    compile_parser.add_argument("source_file")
+    compile_parser.add_argument("object_file")
+    compile_parser.add_argument("-O", "--optimize", action="store_true", help="run the peephole optimizer")
+    link_parser = commands.add_parser("link", help="link object files into data and code images")
+    link_parser.add_argument("target_data_file")
+    link_parser.add_argument("target_program_file")
+    link_parser.add_argument("object_files", nargs="+")
+    link_parser.add_argument("--symbols", help="write code label addresses to this file")
+    build_parser = commands.add_parser("build", help="recompile changed sources and link them")
+    build_parser.add_argument("target_data_file")
+    build_parser.add_argument("target_program_file")
+    build_parser.add_argument("source_files", nargs="+")
+    build_parser.add_argument("--symbols", help="write code label addresses to this file")
+    build_parser.add_argument("-O", "--optimize", action="store_true", help="run the peephole optimizer")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        compile_file(args.source_file, args.object_file, args.optimize)
+    elif args.command == "link":
+        link_files(args.object_files, args.target_data_file, args.target_program_file, args.symbols)
+    else:
+        build(args.source_files, args.target_data_file, args.target_program_file, args.symbols, args.optimize)
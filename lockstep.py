@@ -0,0 +1,389 @@
+"""Моделирование многих экземпляров одной программы в ногу (lockstep) на массивах NumPy.
+
+Состояние каждого экземпляра -- отдельная полоса (lane) массивов: `pc`, TOS, регистры стека и указатель
+стека, стек вызовов, память данных, позиция ввода и счётчик тактов. За один раунд каждая работающая
+полоса выполняет одну инструкцию: полосы группируются по `pc`, и инструкция выполняется сразу над всей
+группой. После ветвлений полосы расходятся по разным группам и снова сливаются, когда их `pc` совпадут.
+
+Как и `machine.InstructionMachine`, модель работает с точностью до инструкции: вывод и число тактов
+каждой полосы совпадают с `machine.simulation()` для её ввода. Память данных, как `memory.PagedMemory`,
+покрывает всё 32-битное адресное пространство: образ `.data` -- плотная матрица полос, ячейки за его пределами
+хранятся в словаре своей полосы (ещё не записанные читаются как 0). Ошибка модели (переполнение стека или
+стека вызовов, деление на ноль) завершает только свою полосу: вместо вывода и тактов её результатом
+становится исключение, которое `machine.simulation()` выбросила бы для этого ввода. Ограничения: порт 0
+используется только для ввода, модель кэша не поддерживается.
+
+NumPy -- необязательная зависимость, нужная только этому модулю.
+"""
+
+from __future__ import annotations
+
+import operator
+from collections import deque
+from collections.abc import Iterable
+
+from geometry import Geometry
+from isa import Opcode, Program, as_program, to_word
+from machine import ControlUnit
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy не установлен
+    np = None
+
+
+def division_error(operation) -> ZeroDivisionError:
+    """Ошибка деления целых на ноль операцией `operation`, как её выбрасывает Python (текст зависит от версии)."""
+    try:
+        operation(1, 0)
+    except ZeroDivisionError as e:
+        error = e
+    return error
+
+
+class LockstepMachine:
+    """`lanes` экземпляров программы `program` с общей начальной памятью `data` и своим вводом у каждого."""
+
+    def __init__(self, program, data: list[int], inputs: list[Iterable[str]], stack_capacity, call_stack_capacity):
+        assert np is not None, "lockstep simulation requires numpy"
+        self.program: Program = as_program(program)
+        ticks = ControlUnit.instruction_ticks()
+        self.decoded = [
+            (getattr(self, "op_" + Opcode(opcode).name.lower()), arg, ticks[opcode])
+            for opcode, arg in zip(self.program.opcodes, self.program.args)
+        ]
+        self.input_eof_ticks = ControlUnit.input_eof_ticks()
+        self.loop_ticks = ControlUnit.loop_ticks()
+
+        inputs = [[ord(char) for char in tokens] for tokens in inputs]
+        lanes = len(inputs)
+        self.lanes = lanes
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.tos = np.zeros(lanes, dtype=np.int64)
+        self.stack = np.zeros((lanes, stack_capacity), dtype=np.int64)
+        self.sp = np.zeros(lanes, dtype=np.int64)  # число элементов в стеке
+        self.call_stack = np.zeros((lanes, call_stack_capacity), dtype=np.int64)
+        self.csp = np.zeros(lanes, dtype=np.int64)
+        self.data_memory = np.tile(np.array([to_word(word) for word in data], dtype=np.int64), (lanes, 1))
+        # Ячейки за пределами образа `.data`: адрес -> значение, отдельно для каждой полосы
+        self.sparse_memory: list[dict[int, int]] = [{} for _ in range(lanes)]
+        self.ticks = np.zeros(lanes, dtype=np.int64)
+        self.running = np.ones(lanes, dtype=bool)
+        self.errors: list[Exception | None] = [None] * lanes
+
+        # Ввод порта 0: коды символов всех полос в одной матрице
+        self.input_length = np.array([len(tokens) for tokens in inputs], dtype=np.int64)
+        self.input = np.zeros((lanes, max([*self.input_length.tolist(), 1])), dtype=np.int64)
+        for lane, tokens in enumerate(inputs):
+            self.input[lane, : len(tokens)] = tokens
+        self.input_pos = np.zeros(lanes, dtype=np.int64)
+        # Порты 1..15 каждой полосы: порт -> буфер символов
+        self.ports: list[dict[int, deque[str]]] = [{} for _ in range(lanes)]
+
+    def run(self):
+        while True:
+            active = np.flatnonzero(self.running)
+            if active.size == 0:
+                return
+            pcs = self.pc[active]
+            first = int(pcs[0])
+            if (pcs == first).all():
+                # Все полосы на одной инструкции -- обычный случай до первого расхождения
+                groups = [(first, active)]
+            else:
+                groups = [(pc, active[pcs == pc]) for pc in np.unique(pcs).tolist()]
+            for pc, lanes in groups:
+                execute, arg, ticks = self.decoded[pc]
+                self.ticks[lanes] += ticks
+                execute(pc, arg, lanes)
+
+    def results(self) -> list[tuple[str, int] | Exception]:
+        """Вывод и число тактов каждой полосы; для полосы, завершённой ошибкой, -- сама ошибка."""
+        return [
+            ("".join(self.ports[lane].get(1, ())), int(self.ticks[lane])) if error is None else error
+            for lane, error in enumerate(self.errors)
+        ]
+
+    def fault(self, lanes, mask, error: Exception):
+        """Завершает полосы `lanes[mask]` ошибкой `error` и возвращает остальные."""
+        for lane in lanes[mask].tolist():
+            self.errors[lane] = error
+        self.finish(lanes[mask])
+        return lanes[~mask]
+
+    def require(self, lanes, depth=0, room=0):
+        """Полосы, в стеке которых есть `depth` элементов и место ещё для `room`; остальные завершаются ошибкой."""
+        lanes = self.fault(lanes, self.sp[lanes] < depth, AssertionError("a negative stack pointer was received"))
+        return self.fault(lanes, self.sp[lanes] + room > self.stack.shape[1], AssertionError("stack capacity exceeded"))
+
+    def require_divisor(self, lanes, operation):
+        lanes = self.require(lanes, depth=1)
+        return self.fault(lanes, self.stack_top(lanes) == 0, division_error(operation))
+
+    def push_stack(self, lanes, values):
+        self.stack[lanes, self.sp[lanes]] = values
+        self.sp[lanes] += 1
+
+    def pop_stack(self, lanes):
+        self.sp[lanes] -= 1
+        return self.stack[lanes, self.sp[lanes]]
+
+    def stack_top(self, lanes):
+        return self.stack[lanes, self.sp[lanes] - 1]
+
+    def read_memory(self, lanes, addresses):
+        addresses = addresses & 0xFFFFFFFF
+        inside = addresses < self.data_memory.shape[1]
+        if inside.all():
+            return self.data_memory[lanes, addresses]
+        values = np.zeros(lanes.size, dtype=np.int64)
+        values[inside] = self.data_memory[lanes[inside], addresses[inside]]
+        for index in np.flatnonzero(~inside).tolist():
+            values[index] = self.sparse_memory[lanes[index]].get(int(addresses[index]), 0)
+        return values
+
+    def write_memory(self, lanes, addresses, values):
+        addresses = addresses & 0xFFFFFFFF
+        inside = addresses < self.data_memory.shape[1]
+        if inside.all():
+            self.data_memory[lanes, addresses] = values
+            return
+        values = np.broadcast_to(values, lanes.shape)
+        self.data_memory[lanes[inside], addresses[inside]] = values[inside]
+        for index in np.flatnonzero(~inside).tolist():
+            self.sparse_memory[lanes[index]][int(addresses[index])] = int(values[index])
+
+    def op_push(self, pc, arg, lanes):
+        lanes = self.require(lanes, room=1)
+        self.push_stack(lanes, self.tos[lanes])
+        self.tos[lanes] = arg
+        self.pc[lanes] = pc + 1
+
+    def op_pop(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        self.tos[lanes] = self.pop_stack(lanes)
+        self.pc[lanes] = pc + 1
+
+    def op_swap(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        top = self.stack_top(lanes)
+        self.stack[lanes, self.sp[lanes] - 1] = self.tos[lanes]
+        self.tos[lanes] = top
+        self.pc[lanes] = pc + 1
+
+    def op_dup(self, pc, arg, lanes):
+        lanes = self.require(lanes, room=1)
+        self.push_stack(lanes, self.tos[lanes])
+        self.pc[lanes] = pc + 1
+
+    def op_over(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1, room=1)
+        second = self.stack_top(lanes)
+        self.push_stack(lanes, self.tos[lanes])
+        self.tos[lanes] = second
+        self.pc[lanes] = pc + 1
+
+    def op_rot(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=2)
+        second = self.pop_stack(lanes)
+        third = self.stack_top(lanes)
+        self.stack[lanes, self.sp[lanes] - 1] = second
+        self.push_stack(lanes, self.tos[lanes])
+        self.tos[lanes] = third
+        self.pc[lanes] = pc + 1
+
+    def op_drop2(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=2)
+        self.pop_stack(lanes)
+        self.tos[lanes] = self.pop_stack(lanes)
+        self.pc[lanes] = pc + 1
+
+    def op_jmp(self, pc, arg, lanes):
+        self.pc[lanes] = arg
+
+    def jump(self, pc, arg, lanes, condition):
+        self.pc[lanes] = np.where(condition, arg, pc + 1)
+
+    def op_jz(self, pc, arg, lanes):
+        self.jump(pc, arg, lanes, self.tos[lanes] == 0)
+
+    def op_jnz(self, pc, arg, lanes):
+        self.jump(pc, arg, lanes, self.tos[lanes] != 0)
+
+    def op_js(self, pc, arg, lanes):
+        self.jump(pc, arg, lanes, self.tos[lanes] < 0)
+
+    def op_jns(self, pc, arg, lanes):
+        self.jump(pc, arg, lanes, self.tos[lanes] >= 0)
+
+    def op_call(self, pc, arg, lanes):
+        full = self.csp[lanes] >= self.call_stack.shape[1]
+        lanes = self.fault(lanes, full, AssertionError("call stack capacity exceeded"))
+        self.call_stack[lanes, self.csp[lanes]] = pc + 1
+        self.csp[lanes] += 1
+        self.pc[lanes] = arg
+
+    def op_ret(self, pc, arg, lanes):
+        lanes = self.fault(lanes, self.csp[lanes] <= 0, AssertionError("a negative scp was received"))
+        self.csp[lanes] -= 1
+        self.pc[lanes] = self.call_stack[lanes, self.csp[lanes]]
+
+    def finish(self, lanes):
+        self.running[lanes] = False
+
+    def read_input(self, pc, arg, lanes):
+        """Очередной символ порта `arg` для полос `lanes`: маска полос, у которых он есть, и коды символов.
+
+        Пустой буфер ввода завершает моделирование полосы посреди микропрограммы инструкции по адресу `pc`.
+        """
+        if arg == 0:
+            eof = self.input_pos[lanes] >= self.input_length[lanes]
+            values = self.input[lanes[~eof], self.input_pos[lanes[~eof]]]
+            self.input_pos[lanes[~eof]] += 1
+        else:
+            buffers = [self.ports[lane].get(arg) for lane in lanes.tolist()]
+            eof = np.array([not buffer for buffer in buffers], dtype=bool)
+            values = np.array([ord(buffer.popleft()) for buffer in buffers if buffer], dtype=np.int64)
+        opcode = self.program.opcodes[pc]
+        self.ticks[lanes[eof]] += self.input_eof_ticks[opcode] - self.decoded[pc][2]
+        self.finish(lanes[eof])
+        return ~eof, values
+
+    def op_input(self, pc, arg, lanes):
+        ready, values = self.read_input(pc, arg, lanes)
+        full = self.sp[lanes[ready]] >= self.stack.shape[1]
+        lanes = self.fault(lanes[ready], full, AssertionError("stack capacity exceeded"))
+        values = values[~full]
+        self.push_stack(lanes, self.tos[lanes])
+        self.tos[lanes] = values
+        self.pc[lanes] = pc + 1
+
+    def op_output(self, pc, arg, lanes):
+        assert 0 < arg < 16, "lockstep simulation supports output to ports 1..15"
+        for lane, value in zip(lanes.tolist(), self.tos[lanes].tolist()):
+            self.ports[lane].setdefault(arg, deque()).append(chr(value))
+        self.pc[lanes] = pc + 1
+
+    def op_outs(self, pc, arg, lanes):
+        assert 0 < arg < 16, "lockstep simulation supports output to ports 1..15"
+        # Повтор цикла микропрограммы выводит по символу во всех полосах, у которых строка не кончилась
+        addresses = self.tos[lanes]
+        while lanes.size:
+            chars = self.read_memory(lanes, addresses)
+            # Следующий адрес -- 32-битное слово, как `isa.to_word(address + 1)`
+            addresses = ((addresses + 0x80000001) & 0xFFFFFFFF) - 0x80000000
+            done = chars == 0
+            self.tos[lanes[done]] = addresses[done]
+            self.pc[lanes[done]] = pc + 1
+            lanes, addresses = lanes[~done], addresses[~done]
+            for lane, char in zip(lanes.tolist(), chars[~done].tolist()):
+                self.ports[lane].setdefault(arg, deque()).append(chr(char))
+            self.ticks[lanes] += self.loop_ticks[Opcode.OUTS]
+
+    def op_ins(self, pc, arg, lanes):
+        # Повтор цикла микропрограммы читает по символу во всех полосах, у которых не кончилась строка;
+        # на время чтения адрес лежит в стеке, перевод строки заменяется нулевым символом
+        addresses = self.tos[lanes]
+        while lanes.size:
+            full = self.sp[lanes] >= self.stack.shape[1]
+            lanes, addresses = self.fault(lanes, full, AssertionError("stack capacity exceeded")), addresses[~full]
+            ready, chars = self.read_input(pc, arg, lanes)
+            lanes, addresses = lanes[ready], addresses[ready]
+            done = chars == ord("\n")
+            self.write_memory(lanes, addresses, np.where(done, 0, chars))
+            # Следующий адрес -- 32-битное слово, как `isa.to_word(address + 1)`
+            addresses = ((addresses + 0x80000001) & 0xFFFFFFFF) - 0x80000000
+            self.tos[lanes[done]] = addresses[done]
+            self.pc[lanes[done]] = pc + 1
+            lanes, addresses = lanes[~done], addresses[~done]
+            self.ticks[lanes] += self.loop_ticks[Opcode.INS]
+
+    def alu(self, pc, lanes, result):
+        # АЛУ оставляет оба операнда на стеке: прежний TOS уходит в стек, результат -- в TOS
+        self.push_stack(lanes, self.tos[lanes])
+        # Результат -- 32-битное слово, как `isa.to_word`
+        self.tos[lanes] = ((result + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        self.pc[lanes] = pc + 1
+
+    def op_add(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1, room=1)
+        self.alu(pc, lanes, self.tos[lanes] + self.stack_top(lanes))
+
+    def op_sub(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1, room=1)
+        self.alu(pc, lanes, self.tos[lanes] - self.stack_top(lanes))
+
+    def op_mul(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1, room=1)
+        self.alu(pc, lanes, self.tos[lanes] * self.stack_top(lanes))
+
+    def op_div(self, pc, arg, lanes):
+        lanes = self.require(self.require_divisor(lanes, operator.floordiv), room=1)
+        divisor = self.stack_top(lanes)
+        self.alu(pc, lanes, self.tos[lanes] // divisor)
+
+    def op_mod(self, pc, arg, lanes):
+        lanes = self.require(self.require_divisor(lanes, operator.mod), room=1)
+        divisor = self.stack_top(lanes)
+        self.alu(pc, lanes, self.tos[lanes] % divisor)
+
+    def consume(self, pc, lanes, result):
+        # Потребляющие операции АЛУ снимают второй операнд со стека, результат -- в TOS
+        self.pop_stack(lanes)
+        self.tos[lanes] = ((result + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        self.pc[lanes] = pc + 1
+
+    def op_cmp(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        self.consume(pc, lanes, np.sign(self.tos[lanes] - self.stack_top(lanes)))
+
+    def op_addp(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        self.consume(pc, lanes, self.tos[lanes] + self.stack_top(lanes))
+
+    def op_subp(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        self.consume(pc, lanes, self.tos[lanes] - self.stack_top(lanes))
+
+    def op_divp(self, pc, arg, lanes):
+        lanes = self.require_divisor(lanes, operator.floordiv)
+        divisor = self.stack_top(lanes)
+        self.consume(pc, lanes, self.tos[lanes] // divisor)
+
+    def op_inc(self, pc, arg, lanes):
+        lanes = self.require(lanes, room=1)
+        self.alu(pc, lanes, self.tos[lanes] + 1)
+
+    def op_dec(self, pc, arg, lanes):
+        lanes = self.require(lanes, room=1)
+        self.alu(pc, lanes, self.tos[lanes] - 1)
+
+    def op_load(self, pc, arg, lanes):
+        lanes = self.require(lanes, room=1)
+        values = self.read_memory(lanes, self.tos[lanes])
+        self.push_stack(lanes, self.tos[lanes])
+        self.tos[lanes] = values
+        self.pc[lanes] = pc + 1
+
+    def op_store(self, pc, arg, lanes):
+        lanes = self.require(lanes, depth=1)
+        self.write_memory(lanes, self.stack_top(lanes), self.tos[lanes])
+        self.pc[lanes] = pc + 1
+
+    def op_hlt(self, pc, arg, lanes):
+        # hlt прерывает моделирование на выборке и тактов не добавляет
+        self.finish(lanes)
+
+
+def simulation_lockstep(
+    code, data: list[int], inputs: list[Iterable[str]], geometry: Geometry | None = None
+) -> list[tuple[str, int] | Exception]:
+    """Вывод и число тактов для каждого ввода из `inputs`, как у `machine.simulation(code, data, input)`.
+
+    Для ввода, на котором `simulation()` выбросила бы ошибку модели, вместо результата -- это исключение.
+    """
+    geometry = geometry or Geometry()
+    assert not geometry.spill, "lockstep simulation does not model stack spilling"
+    machine = LockstepMachine(code, data, inputs, geometry.stack_capacity, geometry.call_stack_capacity)
+    machine.run()
+    return machine.results()
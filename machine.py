@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import argparse
 import logging
 import sys
+from collections.abc import Callable, Iterable
 from enum import Enum
 from typing import ClassVar
 
-from isa import Opcode, read_code, read_data
+from cache import Cache, replacement_policies, write_policies
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from image import load_program, program_arguments
+from isa import WORD_MAX, WORD_MIN, Opcode, Program, as_program, to_word
+from jit import BlockCompiler, BlockMachine
+from memory import OFFSET_MASK, PAGE_BITS, PAGE_MASK, ZERO_PAGE, PagedMemory, as_memory
+from ports import Port, StreamInputPort, StreamOutputPort, flush_ports, make_ports
 
 
 class Signal(int, Enum):
@@ -39,6 +47,10 @@ class Signal(int, Enum):
     ALU_DIV = 1 << 27
     ALU_INC = (1 << 27) + (1 << 25)
     ALU_DEC = (1 << 27) + (1 << 26)
+    ALU_MOD = (1 << 27) + (1 << 26) + (1 << 25)
+    ALU_CMP = 1 << 24
+    ALU_PASS = (1 << 24) + (1 << 25)
+    ALU_EOL = (1 << 26) + (1 << 24)
     SEL_JMP = 1 << 28
     SEL_JS = 1 << 29
     SEL_JNS = (1 << 29) + (1 << 28)
@@ -46,6 +58,7 @@ class Signal(int, Enum):
     SEL_JNZ = (1 << 30) + (1 << 28)
     SEL_RET = (1 << 30) + (1 << 29)
     SEL_NEXT = (1 << 30) + (1 << 29) + (1 << 28)
+    SEL_MPC_BREAK_Z = 1 << 31
 
 
 m_program = [
@@ -113,39 +126,133 @@ m_program = [
     0b01110000000010001000110100100100,
     # store
     0b01110000000010000000110000001000,
+    # dup
+    0b00000000001000000000100001000001,
+    0b01110000000010000000111000100000,
+    # over
+    0b00000000001000000100100000000110,
+    0b00000000001000000000100001000001,
+    0b01110000000010000000110100100000,
+    # rot
+    0b00000000001000000100100000000110,
+    0b00000000001000000000100010000001,
+    0b00000011001000000000101000100000,
+    0b00000000001000000000100001000001,
+    0b01110000000010010000110100100100,
+    # drop2
+    0b00000000001000000100100010000101,
+    0b01110000000010000000110010000001,
+    # mod
+    0b00000000001000000000100000000010,
+    0b00001110001000010000100001000101,
+    0b01110000000010000000110100100000,
+    # cmp
+    0b01110001000010010000110010000101,
+    # addp
+    0b01110010000010010000110010000101,
+    # subp
+    0b01110100000010010000110010000101,
+    # divp
+    0b01111000000010010000110010000101,
+    # outs
+    0b00001010001000001000100000000100,
+    0b10000000000000000000100000000000,
+    0b00000000000100010000100000010100,
+    0b01110000000010010000110000000100,
+    # ins
+    0b00000000001000000000100001000001,
+    0b00000000001000000000101000100000,
+    0b00000000001000100000100000000100,
+    0b00000101001000010000100000001100,
+    0b10000000000000000000100000000000,
+    0b00000000001000000100100000000100,
+    0b00001010000100010000100010000101,
+    0b00000000001000000100100000001100,
+    0b01111010000010010000110010000101,
 ]
 
 
 class DataPath:
-    stack_registers: list[int] = None
-    stack_pointer = None
-    swap_register = None
-    tos: int = None
-    data_memory: list[int] = None
-    result_alu = None
-    cu_arg = None
-    io_ports: dict[int, list[str]] = None
-
-    def __init__(self, data, stack_capacity, input_tokens: list[str]):
-        self.data_memory = data
+    __slots__ = (
+        "cache",
+        "cu_arg",
+        "data_memory",
+        "geometry",
+        "io_ports",
+        "result_alu",
+        "spilled",
+        "stack_pointer",
+        "stack_registers",
+        "stall",
+        "swap_register",
+        "tos",
+    )
+
+    stack_registers: list[int]
+    stack_pointer: int
+    swap_register: int
+    tos: int
+    data_memory: PagedMemory
+    result_alu: int
+    cu_arg: int
+    io_ports: dict[int, Port]
+    # Модель кэша памяти данных (None -- память без кэша)
+    cache: Cache | None
+    # Размеры стеков и режим выгрузки (None -- без выгрузки) и число элементов стека, выгруженных в память данных
+    geometry: Geometry | None
+    spilled: int
+    # Такты простоя из-за последнего обращения к памяти данных: промах кэша, выгрузка или загрузка стека
+    stall: int
+
+    def __init__(
+        self,
+        data,
+        stack_capacity,
+        input_tokens: Iterable[str] | Port,
+        devices: dict[int, Port] | None = None,
+        cache: Cache | None = None,
+        geometry: Geometry | None = None,
+    ):
+        self.data_memory = as_memory(data)
         self.stack_registers = [0] * stack_capacity
         self.stack_pointer = -1
         self.swap_register = 0
         self.tos = 0
         self.result_alu = 0
         self.cu_arg = 0
-        self.io_ports = {0: input_tokens}  # 0 - input, 1 - output by default
-        for num_port in range(1, 16):  # count of ports is 16
-            self.io_ports[num_port] = []
-
-    def latch_sp(self, sel: list[Signal]):
-        if Signal.SEL_SP_NEXT in sel:
-            assert self.stack_pointer < len(self.stack_registers), "stack capacity exceeded"
-            self.stack_pointer += 1
-        elif Signal.SEL_SP_PREV in sel:
-            assert self.stack_pointer >= 0, "a negative stack pointer was received"
-            self.stack_registers[self.stack_pointer] = 0
+        self.io_ports = make_ports(input_tokens, devices)  # 0 - input, 1 - output by default
+        self.cache = cache
+        self.geometry = geometry
+        self.spilled = 0
+        self.stall = 0
+
+    def latch_sp_next(self):
+        assert self.stack_pointer < len(self.stack_registers) - 1, "stack capacity exceeded"
+        self.stack_pointer += 1
+
+    def latch_sp_prev(self):
+        assert self.stack_pointer >= 0, "a negative stack pointer was received"
+        self.stack_registers[self.stack_pointer] = 0
+        self.stack_pointer -= 1
+
+    def latch_sp_next_spill(self):
+        # В заполненном стеке дно уходит в память данных, остальные регистры сдвигаются вниз
+        if self.stack_pointer == len(self.stack_registers) - 1:
+            self.data_memory[self.geometry.stack_spill(self.spilled)] = self.stack_registers.pop(0)
+            self.stack_registers.append(0)
+            self.spilled += 1
             self.stack_pointer -= 1
+            self.stall += self.geometry.spill_ticks
+        self.stack_pointer += 1
+
+    def latch_sp_prev_fill(self):
+        self.latch_sp_prev()
+        # Опустевший стек загружает из памяти данных последний выгруженный элемент
+        if self.stack_pointer < 0 and self.spilled:
+            self.stack_registers[0] = self.data_memory[self.geometry.stack_fill(self.spilled)]
+            self.spilled -= 1
+            self.stack_pointer = 0
+            self.stall += self.geometry.spill_ticks
 
     def latch_swr(self):
         self.swap_register = self.tos
@@ -153,62 +260,105 @@ class DataPath:
     def top_stack_regs(self) -> int:
         return self.stack_registers[self.stack_pointer]
 
-    def latch_tos(self, sel: list[Signal]):
-        if Signal.SEL_TOS_ALU in sel:
-            self.tos = self.result_alu
-        elif Signal.SEL_TOS_SREG in sel:
-            self.tos = self.top_stack_regs()
-        elif Signal.SEL_TOS_CU_ARG in sel:
-            self.tos = self.cu_arg
-        elif Signal.SEL_TOS_DATA_MEM in sel:
-            self.tos = self.data_memory[self.tos]
-        elif Signal.SEL_TOS_INPUT in sel:
-            buffer = self.io_ports[self.cu_arg]
-            if not buffer:
-                raise EOFError()
-            self.tos = ord(buffer[0])
-            self.io_ports[self.cu_arg] = self.io_ports[self.cu_arg][1:]
+    def latch_tos_alu(self):
+        self.tos = self.result_alu
+
+    def latch_tos_sreg(self):
+        self.tos = self.top_stack_regs()
+
+    def latch_tos_cu_arg(self):
+        self.tos = self.cu_arg
+
+    def latch_tos_data_mem(self):
+        self.tos = self.data_memory[self.tos]
+
+    def latch_tos_data_mem_cached(self):
+        self.stall += self.cache.read(self.tos)
+        self.tos = self.data_memory[self.tos]
+
+    def latch_tos_input(self):
+        self.tos = ord(self.io_ports[self.cu_arg].read())
 
     def write_dm(self):
         self.data_memory[self.top_stack_regs()] = self.tos
 
+    def write_dm_cached(self):
+        self.stall += self.cache.write(self.top_stack_regs())
+        self.data_memory[self.top_stack_regs()] = self.tos
+
     def write_io(self):
         assert self.cu_arg in self.io_ports, "Invalid port"
-        self.io_ports[self.cu_arg].append(chr(self.tos))
+        self.io_ports[self.cu_arg].write(chr(self.tos))
+
+    def latch_sreg_tos(self):
+        self.stack_registers[self.stack_pointer] = self.tos
 
-    def latch_sreg(self, sel: list[Signal]):
-        if Signal.SEL_SREG_TOS in sel:
-            self.stack_registers[self.stack_pointer] = self.tos
-        elif Signal.SEL_SREG_SWR in sel:
-            self.stack_registers[self.stack_pointer] = self.swap_register
+    def latch_sreg_swr(self):
+        self.stack_registers[self.stack_pointer] = self.swap_register
 
     def alu_add(self):
-        self.result_alu = self.tos + self.top_stack_regs()
+        self.result_alu = to_word(self.tos + self.top_stack_regs())
 
     def alu_sub(self):
-        self.result_alu = self.tos - self.top_stack_regs()
+        self.result_alu = to_word(self.tos - self.top_stack_regs())
 
     def alu_mul(self):
-        self.result_alu = self.tos * self.top_stack_regs()
+        self.result_alu = to_word(self.tos * self.top_stack_regs())
 
     def alu_div(self):
-        self.result_alu = self.tos // self.top_stack_regs()
+        self.result_alu = to_word(self.tos // self.top_stack_regs())
 
     def alu_inc(self):
-        self.result_alu = self.tos + 1
+        self.result_alu = to_word(self.tos + 1)
 
     def alu_dec(self):
-        self.result_alu = self.tos - 1
+        self.result_alu = to_word(self.tos - 1)
+
+    def alu_mod(self):
+        self.result_alu = to_word(self.tos % self.top_stack_regs())
+
+    def alu_cmp(self):
+        # Знак разности без переполнения: -1, 0 или 1
+        self.result_alu = (self.tos > self.top_stack_regs()) - (self.tos < self.top_stack_regs())
+
+    def alu_pass(self):
+        # Второй операнд без изменений: АЛУ служит временным регистром (микропрограмма rot)
+        self.result_alu = self.top_stack_regs()
+
+    def alu_eol(self):
+        # Ноль, если в TOS перевод строки: условие выхода из цикла микропрограммы ins
+        self.result_alu = self.tos - ord("\n")
 
 
 class ControlUnit:
-    program = None
-    pc = None
-    mpc = None
-    data_path: DataPath = None
-    call_stack = None
-    scp = None
-    _tick = None
+    __slots__ = (
+        "_tick",
+        "call_spilled",
+        "call_stack",
+        "data_path",
+        "loop_exits",
+        "microcode",
+        "mpc",
+        "mpc_by_opcode",
+        "pc",
+        "program",
+        "scp",
+    )
+
+    program: Program
+    pc: int
+    mpc: int
+    data_path: DataPath
+    call_stack: list[int]
+    scp: int
+    # Число адресов возврата, выгруженных в память данных (см. `geometry.Geometry`)
+    call_spilled: int
+    microcode: list[tuple[Callable[[], None], ...]]
+    # Адрес выхода из цикла для микрокоманд с SEL_MPC_BREAK_Z (см. `loop_exit`)
+    loop_exits: list[int | None]
+    # Адрес микропрограммы по значению опкода (None -- у опкода нет микропрограммы)
+    mpc_by_opcode: list[int | None]
+    _tick: int
 
     opcode_to_mp: ClassVar[dict[Opcode, int]] = {
         Opcode.PUSH: 1,
@@ -231,28 +381,46 @@ class ControlUnit:
         Opcode.DEC: 37,
         Opcode.LOAD: 40,
         Opcode.STORE: 42,
+        Opcode.DUP: 43,
+        Opcode.OVER: 45,
+        Opcode.ROT: 48,
+        Opcode.DROP2: 53,
+        Opcode.MOD: 55,
+        Opcode.CMP: 58,
+        Opcode.ADDP: 59,
+        Opcode.SUBP: 60,
+        Opcode.DIVP: 61,
+        Opcode.OUTS: 62,
+        Opcode.INS: 66,
     }
 
     def __init__(self, program, data_path: DataPath, call_stack_capacity):
-        self.program = program
+        self.program = as_program(program)
         self.pc = 0
         self.mpc = 0
         self.data_path = data_path
         self.call_stack = [0] * call_stack_capacity
         self.scp = -1
+        self.call_spilled = 0
         self._tick = 0
+        # Микрокод декодируется один раз: на каждом такте выполняются уже готовые действия
+        self.microcode = [self.__decode_microprogram(mprogram) for mprogram in m_program]
+        self.loop_exits = [
+            self.loop_exit(mpc) if mprogram & Signal.SEL_MPC_BREAK_Z else None for mpc, mprogram in enumerate(m_program)
+        ]
+        self.mpc_by_opcode = [self.opcode_to_mp.get(opcode) for opcode in range(max(Opcode) + 1)]
 
     @staticmethod
     def __int_to_list_signals(mc: int) -> list[Signal]:
         signals: list[Signal] = []
 
-        # add signals from latch_sp (0) to sel_pc (24)
-        for i in range(25):
+        # add signals from latch_sp (0) to sel_scp_prev (23)
+        for i in range(24):
             mask = 1 << i
             if (mc & mask) != 0:
                 signals.append(Signal(mask))
 
-        alu_mask = (1 << 25) + (1 << 26) + (1 << 27)
+        alu_mask = (1 << 24) + (1 << 25) + (1 << 26) + (1 << 27)
         if (mc & alu_mask) != 0:
             signals.append(Signal(mc & alu_mask))
 
@@ -260,6 +428,107 @@ class ControlUnit:
         if (mc & jmp_mask) != 0:
             signals.append(Signal(mc & jmp_mask))
 
+        if mc & Signal.SEL_MPC_BREAK_Z:
+            signals.append(Signal.SEL_MPC_BREAK_Z)
+
+        return signals
+
+    def __wiring(self) -> list[tuple[Signal, dict[Signal | None, Callable[[], None]]]]:
+        """Сигналы в порядке их срабатывания в такте и действия, выбираемые мультиплексорами.
+
+        Ключ `None` означает, что у сигнала нет мультиплексора.
+        """
+        dp = self.data_path
+        spill = dp.geometry is not None and dp.geometry.spill
+        return [
+            (Signal.ALU_SUM, {None: dp.alu_add}),
+            (Signal.ALU_SUB, {None: dp.alu_sub}),
+            (Signal.ALU_MUL, {None: dp.alu_mul}),
+            (Signal.ALU_DIV, {None: dp.alu_div}),
+            (Signal.ALU_INC, {None: dp.alu_inc}),
+            (Signal.ALU_DEC, {None: dp.alu_dec}),
+            (Signal.ALU_MOD, {None: dp.alu_mod}),
+            (Signal.ALU_CMP, {None: dp.alu_cmp}),
+            (Signal.ALU_PASS, {None: dp.alu_pass}),
+            (Signal.ALU_EOL, {None: dp.alu_eol}),
+            # Память данных и порты записывают значения регистров на начало такта
+            (Signal.WRITE_DM, {None: dp.write_dm if dp.cache is None else dp.write_dm_cached}),
+            (Signal.WRITE_IO, {None: dp.write_io}),
+            (
+                Signal.LATCH_SP,
+                {
+                    Signal.SEL_SP_NEXT: dp.latch_sp_next_spill if spill else dp.latch_sp_next,
+                    Signal.SEL_SP_PREV: dp.latch_sp_prev_fill if spill else dp.latch_sp_prev,
+                },
+            ),
+            (Signal.LATCH_SWR, {None: dp.latch_swr}),
+            (
+                Signal.LATCH_TOS,
+                {
+                    Signal.SEL_TOS_ALU: dp.latch_tos_alu,
+                    Signal.SEL_TOS_SREG: dp.latch_tos_sreg,
+                    Signal.SEL_TOS_CU_ARG: dp.latch_tos_cu_arg,
+                    Signal.SEL_TOS_DATA_MEM: dp.latch_tos_data_mem
+                    if dp.cache is None
+                    else dp.latch_tos_data_mem_cached,
+                    Signal.SEL_TOS_INPUT: dp.latch_tos_input,
+                },
+            ),
+            (Signal.LATCH_SREG, {Signal.SEL_SREG_TOS: dp.latch_sreg_tos, Signal.SEL_SREG_SWR: dp.latch_sreg_swr}),
+            (
+                Signal.LATCH_MPC,
+                {
+                    Signal.SEL_MPC_ZERO: self.latch_mpc_zero,
+                    Signal.SEL_MPC_NEXT: self.latch_mpc_next,
+                    Signal.SEL_MPC_OPCODE: self.latch_mpc_opcode,
+                    Signal.SEL_MPC_BREAK_Z: self.latch_mpc_break_z,
+                },
+            ),
+            (
+                Signal.LATCH_PC,
+                {
+                    Signal.SEL_JS: self.latch_pc_js,
+                    Signal.SEL_JNS: self.latch_pc_jns,
+                    Signal.SEL_JZ: self.latch_pc_jz,
+                    Signal.SEL_JNZ: self.latch_pc_jnz,
+                    Signal.SEL_JMP: self.latch_pc_jmp,
+                    Signal.SEL_RET: self.latch_pc_ret,
+                    Signal.SEL_NEXT: self.latch_pc_next,
+                },
+            ),
+            (
+                Signal.LATCH_SCP,
+                {
+                    Signal.SEL_SCP_NEXT: self.latch_scp_next_spill if spill else self.latch_scp_next,
+                    Signal.SEL_SCP_PREV: self.latch_scp_prev_fill if spill else self.latch_scp_prev,
+                },
+            ),
+            (Signal.LATCH_CALLST, {None: self.latch_callst}),
+        ]
+
+    def __decode_microprogram(self, mprogram: int) -> tuple[Callable[[], None], ...]:
+        signals = self.__int_to_list_signals(mprogram)
+        actions: list[Callable[[], None]] = []
+        for signal, mux in self.__wiring():
+            if signal not in signals:
+                continue
+            for sel, action in mux.items():
+                if sel is None or sel in signals:
+                    actions.append(action)
+                    break
+        if mprogram & self.__stall_signals():
+            actions.append(self.latch_stall)
+        return tuple(actions)
+
+    def __stall_signals(self) -> int:
+        """Сигналы, после которых такт может задержаться на обращение к памяти данных."""
+        signals = 0
+        # С кэшем -- на время промаха
+        if self.data_path.cache is not None:
+            signals |= Signal.WRITE_DM | Signal.SEL_TOS_DATA_MEM
+        # С выгрузкой стека -- на перенос его дна в память данных и обратно
+        if self.data_path.geometry is not None and self.data_path.geometry.spill:
+            signals |= Signal.LATCH_SP
         return signals
 
     def tick(self):
@@ -268,88 +537,186 @@ class ControlUnit:
     def current_tick(self):
         return self._tick
 
-    def latch_pc(self, sel: list[Signal]):
-        tos = self.data_path.tos
-
-        # First MUX
-        if (
-            Signal.SEL_JS in sel
-            and tos < 0
-            or Signal.SEL_JNS in sel
-            and tos >= 0
-            or Signal.SEL_JZ in sel
-            and tos == 0
-            or Signal.SEL_JNZ in sel
-            and tos != 0
-        ):
-            sel.append(Signal.SEL_JMP)
-        elif Signal.SEL_JS in sel or Signal.SEL_JNS in sel or Signal.SEL_JZ in sel or Signal.SEL_JNZ in sel:
-            sel.append(Signal.SEL_NEXT)
-
-        # Second MUX
-        if Signal.SEL_JMP in sel:
-            self.pc = self.program[self.pc]["arg"]
-        elif Signal.SEL_RET in sel:
-            assert self.pc >= 0, "return with empty call stack"
-            self.pc = self.call_stack[self.scp]
-        elif Signal.SEL_NEXT in sel:
-            self.pc += 1
-
-    def latch_mpc(self, sel: list[Signal]):
-        if Signal.SEL_MPC_ZERO in sel:
-            self.mpc = 0
-        elif Signal.SEL_MPC_NEXT in sel:
-            self.mpc += 1
-        elif Signal.SEL_MPC_OPCODE in sel:
-            if Opcode.HLT is Opcode(self.program[self.pc]["opcode"]):
-                raise StopIteration()
-            self.mpc = self.opcode_to_mp[Opcode(self.program[self.pc]["opcode"])]
-
-    def latch_scp(self, sel: list[Signal]):
-        if Signal.SEL_SCP_NEXT in sel:
-            assert self.scp < len(self.call_stack), "call stack capacity exceeded"
-            self.scp += 1
-        elif Signal.SEL_SCP_PREV in sel:
-            assert self.scp >= 0, "a negative scp was received"
+    def latch_pc_js(self):
+        if self.data_path.tos < 0:
+            self.latch_pc_jmp()
+        else:
+            self.latch_pc_next()
+
+    def latch_pc_jns(self):
+        if self.data_path.tos >= 0:
+            self.latch_pc_jmp()
+        else:
+            self.latch_pc_next()
+
+    def latch_pc_jz(self):
+        if self.data_path.tos == 0:
+            self.latch_pc_jmp()
+        else:
+            self.latch_pc_next()
+
+    def latch_pc_jnz(self):
+        if self.data_path.tos != 0:
+            self.latch_pc_jmp()
+        else:
+            self.latch_pc_next()
+
+    def latch_pc_jmp(self):
+        self.pc = self.program.args[self.pc]
+
+    def latch_pc_ret(self):
+        assert self.pc >= 0, "return with empty call stack"
+        self.pc = self.call_stack[self.scp]
+
+    def latch_pc_next(self):
+        self.pc += 1
+
+    def latch_mpc_zero(self):
+        self.mpc = 0
+
+    def latch_mpc_next(self):
+        self.mpc += 1
+
+    def latch_mpc_opcode(self):
+        # Выборка инструкции: аргумент команды подаётся в DataPath вместе с декодированием опкода
+        self.data_path.cu_arg = self.program.args[self.pc]
+        opcode = self.program.opcodes[self.pc]
+        if opcode == Opcode.HLT:
+            raise StopIteration()
+        self.mpc = self.mpc_by_opcode[opcode]
+
+    def latch_mpc_break_z(self):
+        # Цикл микропрограммы (outs, ins) повторяется перезапуском с SEL_MPC_OPCODE без выборки,
+        # ноль в TOS -- выход из цикла
+        self.mpc = self.loop_exits[self.mpc] if self.data_path.tos == 0 else self.mpc + 1
+
+    def latch_scp_next(self):
+        assert self.scp < len(self.call_stack) - 1, "call stack capacity exceeded"
+        self.scp += 1
+
+    def latch_scp_prev(self):
+        assert self.scp >= 0, "a negative scp was received"
+        self.scp -= 1
+
+    def latch_scp_next_spill(self):
+        # Как у стека данных: самый старый адрес возврата уходит в память данных
+        if self.scp == len(self.call_stack) - 1:
+            geometry = self.data_path.geometry
+            self.data_path.data_memory[geometry.call_spill(self.call_spilled)] = self.call_stack.pop(0)
+            self.call_stack.append(0)
+            self.call_spilled += 1
             self.scp -= 1
+            self._tick += geometry.spill_ticks
+        self.scp += 1
+
+    def latch_scp_prev_fill(self):
+        self.latch_scp_prev()
+        if self.scp < 0 and self.call_spilled:
+            geometry = self.data_path.geometry
+            self.call_stack[0] = self.data_path.data_memory[geometry.call_fill(self.call_spilled)]
+            self.call_spilled -= 1
+            self.scp = 0
+            self._tick += geometry.spill_ticks
+
+    def latch_stall(self):
+        self._tick += self.data_path.stall
+        self.data_path.stall = 0
 
     def latch_callst(self):
         self.call_stack[self.scp] = self.pc + 1
 
-    def execute_microprogram(self, mprogram: int):  # noqa: C901
-        signals = self.__int_to_list_signals(mprogram)
-        if Signal.ALU_SUM in signals:
-            self.data_path.alu_add()
-        if Signal.ALU_SUB in signals:
-            self.data_path.alu_sub()
-        if Signal.ALU_MUL in signals:
-            self.data_path.alu_mul()
-        if Signal.ALU_DIV in signals:
-            self.data_path.alu_div()
-        if Signal.ALU_INC in signals:
-            self.data_path.alu_inc()
-        if Signal.ALU_DEC in signals:
-            self.data_path.alu_dec()
-        if Signal.LATCH_SP in signals:
-            self.data_path.latch_sp(signals)
-        if Signal.LATCH_SWR in signals:
-            self.data_path.latch_swr()
-        if Signal.LATCH_TOS in signals:
-            self.data_path.latch_tos(signals)
-        if Signal.WRITE_DM in signals:
-            self.data_path.write_dm()
-        if Signal.WRITE_IO in signals:
-            self.data_path.write_io()
-        if Signal.LATCH_SREG in signals:
-            self.data_path.latch_sreg(signals)
-        if Signal.LATCH_MPC in signals:
-            self.latch_mpc(signals)
-        if Signal.LATCH_PC in signals:
-            self.latch_pc(signals)
-        if Signal.LATCH_SCP in signals:
-            self.latch_scp(signals)
-        if Signal.LATCH_CALLST in signals:
-            self.latch_callst()
+    @staticmethod
+    def loop_exit(mpc: int) -> int:
+        """Выход из цикла микропрограммы: микрокоманда после ближайшей, перезапускающей микропрограмму."""
+        while not m_program[mpc] & Signal.SEL_MPC_OPCODE:
+            mpc += 1
+        return mpc + 1
+
+    @classmethod
+    def exit_path(cls, opcode: Opcode) -> list[int]:
+        """Микрокоманды инструкции от начала до конца без повторов цикла (для outs и ins -- пустая строка)."""
+        mpc = cls.opcode_to_mp[opcode]
+        path = [mpc]
+        while not m_program[mpc] & Signal.SEL_MPC_ZERO:
+            mpc = cls.loop_exit(mpc) if m_program[mpc] & Signal.SEL_MPC_BREAK_Z else mpc + 1
+            path.append(mpc)
+        return path
+
+    @classmethod
+    def instruction_ticks(cls) -> dict[Opcode, int]:
+        """Число тактов каждой инструкции: выборка + её микропрограмма в `m_program` без повторов цикла.
+
+        Каждый повтор цикла outs и ins добавляет `loop_ticks()` тактов.
+        """
+        ticks = {Opcode.HLT: 0}  # на hlt выборка прерывает моделирование до конца такта
+        for opcode in cls.opcode_to_mp:
+            ticks[opcode] = 1 + len(cls.exit_path(opcode))
+        return ticks
+
+    @classmethod
+    def loop_ticks(cls) -> dict[Opcode, int]:
+        """Такты одного повтора цикла микропрограммы -- от её начала до перезапуска -- для инструкций с циклом."""
+        loops = {}
+        for opcode, start in cls.opcode_to_mp.items():
+            mpc = start
+            while not m_program[mpc] & (Signal.SEL_MPC_ZERO | Signal.SEL_MPC_OPCODE):
+                mpc += 1
+            if m_program[mpc] & Signal.SEL_MPC_OPCODE:
+                loops[opcode] = 1 + mpc - start
+        return loops
+
+    @classmethod
+    def instruction_effects(cls) -> dict[Opcode, tuple[int, int]]:
+        """Изменение глубины стека и стека вызовов каждой инструкцией: сигналы `LATCH_SP` и `LATCH_SCP` её микропрограммы."""
+        effects = {Opcode.HLT: (0, 0)}
+        for opcode in cls.opcode_to_mp:
+            stack = calls = 0
+            for mpc in cls.exit_path(opcode):
+                mc = m_program[mpc]
+                if mc & Signal.LATCH_SP:
+                    stack += 1 if mc & Signal.SEL_SP_NEXT else -1
+                if mc & Signal.LATCH_SCP:
+                    calls += 1 if mc & Signal.SEL_SCP_NEXT else -1
+            effects[opcode] = (stack, calls)
+        return effects
+
+    @classmethod
+    def instruction_peaks(cls) -> dict[Opcode, int]:
+        """Наибольший подъём глубины стека внутри микропрограммы, в том числе в повторе цикла.
+
+        Может превышать итоговое изменение из `instruction_effects`: ins держит адрес в стеке, пока читает символ.
+        """
+        peaks = {Opcode.HLT: 0}
+        loops = cls.loop_ticks()
+        for opcode, start in cls.opcode_to_mp.items():
+            paths = [cls.exit_path(opcode)]
+            if opcode in loops:
+                paths.append(range(start, start + loops[opcode]))
+            peak = 0
+            for path in paths:
+                stack = 0
+                for mpc in path:
+                    if m_program[mpc] & Signal.LATCH_SP:
+                        stack += 1 if m_program[mpc] & Signal.SEL_SP_NEXT else -1
+                        peak = max(peak, stack)
+            peaks[opcode] = peak
+        return peaks
+
+    @classmethod
+    def input_eof_ticks(cls) -> dict[Opcode, int]:
+        """Число тактов, выполненных инструкциями ввода до обнаружения пустого буфера (у ins -- без повторов цикла)."""
+        eof_ticks = {}
+        for opcode, start in cls.opcode_to_mp.items():
+            mpc = start
+            while not m_program[mpc] & (Signal.SEL_TOS_INPUT | Signal.SEL_MPC_ZERO):
+                mpc += 1
+            if m_program[mpc] & Signal.SEL_TOS_INPUT:
+                eof_ticks[opcode] = 1 + mpc - start
+        return eof_ticks
+
+    def execute_microprogram(self):
+        for action in self.microcode[self.mpc]:
+            action()
 
     def __repr__(self):
         return (
@@ -375,49 +742,543 @@ class ControlUnit:
         )
 
 
-def simulation(code, data, input_tokens) -> (str, int):
-    data_path = DataPath(data, 24, input_tokens)
-    control_unit = ControlUnit(code, data_path, 16)
+class InstructionMachine:
+    """Модель процессора с точностью до инструкции.
+
+    Каждая инструкция выполняется целиком над TOS, стеком и стеком вызовов, а к счётчику тактов
+    прибавляется число тактов, которое заняла бы её микропрограмма в `ControlUnit`.
+    Вывод и число тактов совпадают с микропрограммной моделью.
+    """
+
+    __slots__ = (
+        "_tick",
+        "cache",
+        "call_spilled",
+        "call_stack",
+        "call_stack_capacity",
+        "data_memory",
+        "geometry",
+        "ins_address",
+        "io_ports",
+        "loop_ticks",
+        "pc",
+        "program",
+        "stack",
+        "stack_capacity",
+        "stack_spilled",
+        "tos",
+    )
+
+    program: Program
+    pc: int
+    tos: int
+    stack: list[int]
+    stack_capacity: int
+    call_stack: list[int]
+    call_stack_capacity: int
+    data_memory: PagedMemory
+    io_ports: dict[int, Port]
+    cache: Cache | None
+    # Выгрузка стеков в память данных (см. `geometry.Geometry`; None -- без выгрузки)
+    # и число выгруженных элементов стека и стека вызовов
+    geometry: Geometry | None
+    stack_spilled: int
+    call_spilled: int
+    # Такты повтора цикла outs и ins (см. `ControlUnit.loop_ticks`)
+    loop_ticks: dict[Opcode, int]
+    # Адрес символа, на чтении которого прервана инструкция ins (адрес уже лежит в стеке), иначе None
+    ins_address: int | None
+    _tick: int
+
+    def __init__(
+        self,
+        program,
+        data,
+        input_tokens: Iterable[str] | Port,
+        stack_capacity,
+        call_stack_capacity,
+        devices: dict[int, Port] | None = None,
+        cache: Cache | None = None,
+        geometry: Geometry | None = None,
+    ):
+        self.program = as_program(program)
+        self.pc = 0
+        self.tos = 0
+        self.stack = []
+        self.stack_capacity = stack_capacity
+        self.call_stack = []
+        self.call_stack_capacity = call_stack_capacity
+        self.data_memory = as_memory(data)
+        self.io_ports = make_ports(input_tokens, devices)
+        self.cache = cache
+        self.geometry = geometry if geometry is not None and geometry.spill else None
+        self.stack_spilled = 0
+        self.call_spilled = 0
+        self.loop_ticks = ControlUnit.loop_ticks()
+        self.ins_address = None
+        self._tick = 0
+
+    def current_tick(self):
+        return self._tick
+
+    def decode(self) -> list[tuple[Callable[[int, int], int], int, int]]:
+        ticks = ControlUnit.instruction_ticks()
+        return [
+            (getattr(self, self.handler_name(opcode)), arg, ticks[opcode])
+            for opcode, arg in zip(self.program.opcodes, self.program.args)
+        ]
+
+    def handler_name(self, opcode: int) -> str:
+        name = "op_" + Opcode(opcode).name.lower()
+        # Обработчики с моделью кэша подставляются, только если кэш включён
+        if self.cache is not None and opcode in {Opcode.LOAD, Opcode.STORE}:
+            name += "_cached"
+        return name
+
+    def run(self):
+        decoded = self.decode()
+        pc = self.pc
+        try:
+            while True:
+                execute, arg, ticks = decoded[pc]
+                pc = execute(pc, arg)
+                self._tick += ticks
+        finally:
+            self.pc = pc
+
+    def run_profiled(self, profiler):
+        """Как `run`, но после каждой инструкции вызывает `profiler.account(pc, next_pc, ticks)` (см. `profiler.py`).
+
+        Такты последней инструкции (HLT, ввод из пустого буфера) учитываются с `next_pc = None`.
+        """
+        decoded = self.decode()
+        account = profiler.account
+        pc = self.pc
+        tick = self._tick
+        try:
+            while True:
+                execute, arg, ticks = decoded[pc]
+                next_pc = execute(pc, arg)
+                self._tick += ticks
+                account(pc, next_pc, self._tick - tick)
+                tick = self._tick
+                pc = next_pc
+        finally:
+            account(pc, None, self._tick - tick)
+            self.pc = pc
+
+    def push_stack(self, value: int):
+        if len(self.stack) >= self.stack_capacity:
+            self.spill_stack()
+        self.stack.append(value)
+
+    def pop_stack(self) -> int:
+        assert self.stack, "a negative stack pointer was received"
+        value = self.stack.pop()
+        if not self.stack and self.stack_spilled:
+            self.fill_stack()
+        return value
+
+    def spill_stack(self):
+        geometry = self.geometry
+        assert geometry is not None, "stack capacity exceeded"
+        self.data_memory[geometry.stack_spill(self.stack_spilled)] = self.stack.pop(0)
+        self.stack_spilled += 1
+        self._tick += geometry.spill_ticks
+
+    def fill_stack(self):
+        geometry = self.geometry
+        self.stack.append(self.data_memory[geometry.stack_fill(self.stack_spilled)])
+        self.stack_spilled -= 1
+        self._tick += geometry.spill_ticks
+
+    def op_push(self, pc, arg):
+        self.push_stack(self.tos)
+        self.tos = arg
+        return pc + 1
+
+    def op_pop(self, pc, arg):
+        self.tos = self.pop_stack()
+        return pc + 1
+
+    def op_swap(self, pc, arg):
+        self.tos, self.stack[-1] = self.stack[-1], self.tos
+        return pc + 1
+
+    def op_dup(self, pc, arg):
+        self.push_stack(self.tos)
+        return pc + 1
+
+    def op_over(self, pc, arg):
+        second = self.stack[-1]
+        self.push_stack(self.tos)
+        self.tos = second
+        return pc + 1
+
+    def op_rot(self, pc, arg):
+        # Как микропрограмма: второй элемент снимается со стека (опустевший стек загружается),
+        # встаёт на место третьего, а прежний TOS кладётся сверху (заполненный стек выгружается)
+        second = self.pop_stack()
+        third = self.stack[-1]
+        self.stack[-1] = second
+        self.push_stack(self.tos)
+        self.tos = third
+        return pc + 1
+
+    def op_drop2(self, pc, arg):
+        self.pop_stack()
+        self.tos = self.pop_stack()
+        return pc + 1
+
+    def op_jmp(self, pc, arg):
+        return arg
+
+    def op_jz(self, pc, arg):
+        return arg if self.tos == 0 else pc + 1
+
+    def op_jnz(self, pc, arg):
+        return arg if self.tos != 0 else pc + 1
+
+    def op_js(self, pc, arg):
+        return arg if self.tos < 0 else pc + 1
+
+    def op_jns(self, pc, arg):
+        return arg if self.tos >= 0 else pc + 1
+
+    def op_call(self, pc, arg):
+        if len(self.call_stack) >= self.call_stack_capacity:
+            self.spill_call_stack()
+        self.call_stack.append(pc + 1)
+        return arg
+
+    def op_ret(self, pc, arg):
+        assert self.call_stack, "a negative scp was received"
+        address = self.call_stack.pop()
+        if not self.call_stack and self.call_spilled:
+            self.fill_call_stack()
+        return address
+
+    def spill_call_stack(self):
+        geometry = self.geometry
+        assert geometry is not None, "call stack capacity exceeded"
+        self.data_memory[geometry.call_spill(self.call_spilled)] = self.call_stack.pop(0)
+        self.call_spilled += 1
+        self._tick += geometry.spill_ticks
+
+    def fill_call_stack(self):
+        geometry = self.geometry
+        self.call_stack.append(self.data_memory[geometry.call_fill(self.call_spilled)])
+        self.call_spilled -= 1
+        self._tick += geometry.spill_ticks
+
+    def op_input(self, pc, arg):
+        try:
+            char = self.io_ports[arg].read()
+        except EOFError:
+            # Микропрограмма input сдвигает указатель стека (и выгружает дно) до чтения порта
+            if len(self.stack) >= self.stack_capacity:
+                self.spill_stack()
+            self._tick += ControlUnit.input_eof_ticks()[Opcode.INPUT]
+            raise
+        self.push_stack(self.tos)
+        self.tos = ord(char)
+        return pc + 1
+
+    def op_output(self, pc, arg):
+        assert arg in self.io_ports, "Invalid port"
+        self.io_ports[arg].write(chr(self.tos))
+        return pc + 1
+
+    def read_memory(self, address: int) -> int:
+        if self.cache is not None:
+            self._tick += self.cache.read(address)
+        return self.data_memory[address]
+
+    def write_memory(self, address: int, value: int):
+        if self.cache is not None:
+            self._tick += self.cache.write(address)
+        self.data_memory[address] = value
+
+    def op_outs(self, pc, arg):
+        # Как микропрограмма: нулевой символ читается, но не выводится; каждый выведенный -- повтор цикла
+        address = self.tos
+        while char := self.read_memory(address):
+            assert arg in self.io_ports, "Invalid port"
+            self.io_ports[arg].write(chr(char))
+            address = to_word(address + 1)
+            self._tick += self.loop_ticks[Opcode.OUTS]
+        self.tos = to_word(address + 1)
+        return pc + 1
+
+    def op_ins(self, pc, arg):
+        # Как микропрограмма: на время чтения символа адрес лежит в стеке (полный стек выгружается),
+        # перевод строки записывается и заменяется нулевым символом; каждый символ до него -- повтор цикла.
+        # Если чтение прервано исключением порта (`async_machine.InputPendingError`), повторное выполнение
+        # продолжает с того же символа: записанные символы и такты повторов цикла уже учтены
+        address = self.ins_address
+        if address is None:
+            address = self.tos
+            self.push_stack(address)
+        while True:
+            self.ins_address = address
+            try:
+                char = ord(self.io_ports[arg].read())
+            except EOFError:
+                self._tick += ControlUnit.input_eof_ticks()[Opcode.INS]
+                raise
+            self.ins_address = None
+            self.write_memory(address, char)
+            if char == ord("\n"):
+                break
+            self.pop_stack()
+            address = to_word(address + 1)
+            self._tick += self.loop_ticks[Opcode.INS]
+            self.push_stack(address)
+        self.write_memory(address, 0)
+        self.pop_stack()
+        self.tos = to_word(address + 1)
+        return pc + 1
+
+    def alu(self, pc, result: int):
+        # АЛУ оставляет оба операнда на стеке: прежний TOS уходит в стек, результат -- в TOS
+        self.push_stack(self.tos)
+        # Переполнение редко: полное приведение к слову -- только для значений вне диапазона
+        self.tos = result if WORD_MIN <= result <= WORD_MAX else to_word(result)
+        return pc + 1
+
+    def op_add(self, pc, arg):
+        return self.alu(pc, self.tos + self.stack[-1])
+
+    def op_sub(self, pc, arg):
+        return self.alu(pc, self.tos - self.stack[-1])
+
+    def op_mul(self, pc, arg):
+        return self.alu(pc, self.tos * self.stack[-1])
+
+    def op_div(self, pc, arg):
+        return self.alu(pc, self.tos // self.stack[-1])
+
+    def op_inc(self, pc, arg):
+        return self.alu(pc, self.tos + 1)
+
+    def op_dec(self, pc, arg):
+        return self.alu(pc, self.tos - 1)
+
+    def op_mod(self, pc, arg):
+        return self.alu(pc, self.tos % self.stack[-1])
+
+    def consume(self, pc, result: int):
+        # Потребляющие операции АЛУ снимают второй операнд со стека, результат -- в TOS
+        self.pop_stack()
+        self.tos = result if WORD_MIN <= result <= WORD_MAX else to_word(result)
+        return pc + 1
+
+    def op_cmp(self, pc, arg):
+        second = self.stack[-1]
+        return self.consume(pc, (self.tos > second) - (self.tos < second))
+
+    def op_addp(self, pc, arg):
+        return self.consume(pc, self.tos + self.stack[-1])
+
+    def op_subp(self, pc, arg):
+        return self.consume(pc, self.tos - self.stack[-1])
+
+    def op_divp(self, pc, arg):
+        return self.consume(pc, self.tos // self.stack[-1])
+
+    def op_load(self, pc, arg):
+        self.push_stack(self.tos)
+        # То же, что `self.data_memory[address]`, без вызова метода на горячем пути
+        address = self.tos
+        self.tos = (self.data_memory.pages.get(address >> PAGE_BITS & PAGE_MASK) or ZERO_PAGE)[address & OFFSET_MASK]
+        return pc + 1
+
+    def op_store(self, pc, arg):
+        address = self.stack[-1]
+        number = address >> PAGE_BITS & PAGE_MASK
+        memory = self.data_memory
+        (memory.pages.get(number) or memory.page(number))[address & OFFSET_MASK] = self.tos
+        return pc + 1
+
+    def op_load_cached(self, pc, arg):
+        self._tick += self.cache.read(self.tos)
+        return self.op_load(pc, arg)
+
+    def op_store_cached(self, pc, arg):
+        self._tick += self.cache.write(self.stack[-1])
+        return self.op_store(pc, arg)
+
+    def op_hlt(self, pc, arg):
+        raise StopIteration()
+
+
+def simulation_instr(code, data, input_tokens, devices=None, cache=None, geometry=None) -> (str, int):
+    geometry = geometry or Geometry()
+    machine = InstructionMachine(
+        code, data, input_tokens, geometry.stack_capacity, geometry.call_stack_capacity, devices, cache, geometry
+    )
+    try:
+        machine.run()
+    except EOFError:
+        logging.warning("Input buffer is empty!")
+    except StopIteration:
+        pass
+
+    flush_ports(machine.io_ports)
+    output_buffer = machine.io_ports[1].text()
+    logging.info("output_buffer: %s", repr(output_buffer))
+    return output_buffer, machine.current_tick()
+
+
+def simulation_jit(code, data, input_tokens, devices=None, cache=None, geometry=None) -> (str, int):
+    assert cache is None, "jit engine does not model the data cache"
+    geometry = geometry or Geometry()
+    assert not geometry.spill, "jit engine does not model stack spilling"
+    compiler = BlockCompiler(
+        code,
+        ControlUnit.instruction_ticks(),
+        ControlUnit.input_eof_ticks(),
+        ControlUnit.loop_ticks(),
+        geometry.stack_capacity,
+        geometry.call_stack_capacity,
+    )
+    machine = BlockMachine(compiler, data, input_tokens, devices)
+    try:
+        machine.run()
+    except EOFError:
+        logging.warning("Input buffer is empty!")
+
+    flush_ports(machine.io_ports)
+    output_buffer = machine.io_ports[1].text()
+    logging.info("output_buffer: %s", repr(output_buffer))
+    return output_buffer, machine.current_tick()
+
+
+# Альтернативные движки моделирования; "mc" -- потактовая микропрограммная модель в `simulation`
+engines: dict[str, Callable[..., tuple[str, int]]] = {
+    "instr": simulation_instr,
+    "jit": simulation_jit,
+}
+
+
+def simulation(  # noqa: C901
+    code, data, input_tokens, engine: str = "mc", recorder=None, devices=None, cache=None, geometry=None
+) -> (str, int):
+    """Моделирование программы.
+
+    `input_tokens` -- символы ввода для порта 0 или устройство `ports.Port`;
+    `devices` -- устройства, подключаемые к портам вместо буферов в памяти (см. `ports.py`);
+    `cache` -- модель кэша памяти данных `cache.Cache`, её счётчики накапливаются за прогон;
+    `geometry` -- размеры стеков и режим их выгрузки в память данных `geometry.Geometry`
+    (по умолчанию 24 элемента стека и 16 адресов возврата без выгрузки).
+
+    `recorder` -- необязательный объект с методами `start(control_unit)` и `record(control_unit)`,
+    которому передаётся состояние процессора до первого такта и после каждого такта (см. `tracer.py`).
+    Используется только потактовой моделью `mc`.
+    """
+    if engine != "mc":
+        return engines[engine](code, data, input_tokens, devices, cache, geometry)
+
+    geometry = geometry or Geometry()
+    data_path = DataPath(data, geometry.stack_capacity, input_tokens, devices, cache, geometry)
+    control_unit = ControlUnit(code, data_path, geometry.call_stack_capacity)
+    # Уровень логирования проверяется один раз, а не на каждом такте
+    log_instructions = logging.getLogger().isEnabledFor(logging.INFO)
+    log_state = logging.getLogger().isEnabledFor(logging.DEBUG)
     logging.debug("%s", control_unit)
+    if recorder is not None:
+        recorder.start(control_unit)
     try:
         while True:
-            if control_unit.mpc == 0:
-                data_path.cu_arg = control_unit.program[control_unit.pc]["arg"]
+            if log_instructions and control_unit.mpc == 0:
                 logging.info(
                     "INSTRUCTION: %s, PC: %s",
-                    Opcode(control_unit.program[control_unit.pc]["opcode"]).name,
+                    Opcode(control_unit.program.opcodes[control_unit.pc]).name,
                     control_unit.pc,
                 )
-            mprogram = m_program[control_unit.mpc]
-            control_unit.execute_microprogram(mprogram)
+            control_unit.execute_microprogram()
             control_unit.tick()
-            logging.debug("%s", control_unit)
+            if log_state:
+                logging.debug("%s", control_unit)
+            if recorder is not None:
+                recorder.record(control_unit)
     except EOFError:
         logging.warning("Input buffer is empty!")
     except StopIteration:
         pass
 
-    output_buffer = data_path.io_ports[1]
-    logging.info("output_buffer: %s", repr("".join(output_buffer)))
-    return "".join(output_buffer), control_unit.current_tick()
+    flush_ports(data_path.io_ports)
+    output_buffer = data_path.io_ports[1].text()
+    logging.info("output_buffer: %s", repr(output_buffer))
+    return output_buffer, control_unit.current_tick()
 
 
-def main(code_file, data_file, input_file):
-    code = read_code(code_file)
-    data = read_data(data_file)
-    with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        input_token = []
-        for char in input_text:
-            input_token.append(char)
+def main(
+    code_file,
+    data_file,
+    input_file,
+    engine: str = "mc",
+    stream: bool = False,
+    cache: Cache | None = None,
+    geometry: Geometry | None = None,
+):
+    """Запуск модели. При `stream` ввод читается из файла лениво, а вывод сразу пишется в stdout.
 
-    output, ticks = simulation(code, data, input_token)
+    Без `data_file` программа загружается из образа `code_file` (см. `image.py`).
+    """
+    assert engine == "mc" or engine in engines, "Unknown engine: {}".format(engine)
+    code, data, _ = load_program(code_file, data_file)
+    with open(input_file, encoding="utf-8") as file:
+        if stream:
+            output, ticks = simulation(
+                code,
+                data,
+                StreamInputPort(file),
+                engine,
+                devices={1: StreamOutputPort(sys.stdout)},
+                cache=cache,
+                geometry=geometry,
+            )
+        else:
+            output, ticks = simulation(code, data, list(file.read()), engine, cache=cache, geometry=geometry)
 
-    print("".join(output))
+    print(output)
     print("ticks:", ticks)
+    if cache is not None:
+        print("cache:", cache)
+    if geometry is not None and geometry.spill:
+        print("spill:", geometry)
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 4, "Wrong arguments: machine.py <data_file> <code_file> <input_file>"
-    _, data_file, code_file, input_file = sys.argv
-    main(code_file, data_file, input_file)
+    parser = argparse.ArgumentParser(description="Processor model")
+    parser.add_argument(
+        "files",
+        nargs="+",
+        metavar="file",
+        help="image_file input_file [engine] or data_file code_file input_file [engine]; engine: mc (default), instr or jit",
+    )
+    parser.add_argument("--stream", action="store_true", help="read input lazily and write output as it is produced")
+    parser.add_argument("--cache-size", type=int, help="enable the data cache model with this size in words")
+    parser.add_argument("--cache-line", type=int, default=4, help="cache line size in words")
+    parser.add_argument("--cache-ways", type=int, default=2, help="cache associativity")
+    parser.add_argument("--cache-policy", choices=replacement_policies, default="lru")
+    parser.add_argument("--cache-write", choices=write_policies, default="back")
+    parser.add_argument("--cache-miss-penalty", type=int, default=10, help="ticks to fetch a line from memory")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    cache = None
+    if args.cache_size is not None:
+        cache = Cache(
+            args.cache_size,
+            args.cache_line,
+            args.cache_ways,
+            args.cache_policy,
+            args.cache_write,
+            args.cache_miss_penalty,
+        )
+    geometry = geometry_from_arguments(args)
+    code_file, data_file, rest = program_arguments(args.files)
+    assert len(rest) in {1, 2}, "Expected an input file and an optional engine"
+    input_file, engine = rest[0], rest[1] if len(rest) == 2 else "mc"
+    main(code_file, data_file, input_file, engine, args.stream, cache, geometry)
@@ -0,0 +1,84 @@
+"""Память данных: 32-битное адресное пространство из лениво выделяемых страниц.
+
+Адрес -- 32-битное слово: отрицательный адрес `a` обозначает ячейку `a mod 2**32`. Страница из `PAGE_SIZE`
+слов (`array('i')`) выделяется при первой записи в неё, чтение невыделенной ячейки возвращает 0, поэтому
+занятая память пропорциональна числу затронутых страниц, а не наибольшему адресу.
+
+Образ `.data` занимает адреса `[0, len(memory))`; итерация и строковое представление (журнал `simulation()`)
+показывают только его, как прежний список слов.
+"""
+
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterable, Iterator
+
+from isa import to_word
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+OFFSET_MASK = PAGE_SIZE - 1
+ADDRESS_MASK = 0xFFFFFFFF
+# Номер страницы адреса -- `address >> PAGE_BITS & PAGE_MASK` (то же, что `(address & ADDRESS_MASK) >> PAGE_BITS`)
+PAGE_MASK = ADDRESS_MASK >> PAGE_BITS
+
+# Общая страница нулей для чтения невыделенных страниц; в неё никогда не пишут
+ZERO_PAGE = array("i", bytes(PAGE_SIZE * 4))
+
+
+class PagedMemory:
+    __slots__ = ("pages", "size")
+
+    pages: dict[int, array]
+    # Размер образа `.data`, с которым создана память
+    size: int
+
+    def __init__(self, words: Iterable[int] = ()):
+        words = list(words)
+        self.pages = {}
+        self.size = len(words)
+        for start in range(0, self.size, PAGE_SIZE):
+            chunk = words[start : start + PAGE_SIZE]
+            try:
+                page = array("i", chunk)
+            except OverflowError:
+                # Слова из файла данных беззнаковые: приводятся к знаковым, как их видит АЛУ
+                page = array("i", map(to_word, chunk))
+            page.frombytes(bytes((PAGE_SIZE - len(page)) * 4))
+            self.pages[start >> PAGE_BITS] = page
+
+    def page(self, number: int) -> array:
+        """Страница для записи, выделяется при первом обращении."""
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = array("i", bytes(PAGE_SIZE * 4))
+        return page
+
+    def __getitem__(self, address: int) -> int:
+        return (self.pages.get(address >> PAGE_BITS & PAGE_MASK) or ZERO_PAGE)[address & OFFSET_MASK]
+
+    def __setitem__(self, address: int, value: int):
+        number = address >> PAGE_BITS & PAGE_MASK
+        (self.pages.get(number) or self.page(number))[address & OFFSET_MASK] = value
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        for address in range(self.size):
+            yield self[address]
+
+    def __str__(self) -> str:
+        return str(list(self))
+
+    __repr__ = __str__
+
+    def copy(self) -> PagedMemory:
+        memory = PagedMemory()
+        memory.pages = {number: array("i", page) for number, page in self.pages.items()}
+        memory.size = self.size
+        return memory
+
+
+def as_memory(data: PagedMemory | Iterable[int]) -> PagedMemory:
+    return data if isinstance(data, PagedMemory) else PagedMemory(data)
@@ -0,0 +1,195 @@
+"""Конвейерный режим устройства управления: выборка следующей инструкции совмещена с последним микрошагом текущей.
+
+В `ControlUnit` каждая инструкция начинается с отдельного такта выборки (`m_program[0]`). `PipelinedControlUnit`
+выбирает инструкцию по предсказанному адресу в том же такте, в котором выполняется последняя микрокоманда
+предыдущей, и следующая инструкция сразу начинает свою микропрограмму. Если последняя микрокоманда записала
+в PC другой адрес, выбранная инструкция сбрасывается (flush) и выполняется обычный такт выборки.
+
+Предсказание адреса следующей инструкции (`predictor`):
+
+- `none` -- всегда `pc + 1`: любой переход сбрасывает конвейер;
+- `static` -- `jmp` и `call` переходят по адресу из инструкции, условные переходы назад считаются
+  выполненными, вперёд -- невыполненными.
+
+Если последняя микрокоманда не пишет PC (`ret` берёт адрес возврата на предыдущем микрошаге), адрес уже
+известен и сброса не бывает. Вывод программы совпадает с `simulation()`, меняются только такты.
+
+`python3 pipeline.py <data_file> <code_file> <input_file> [--predictor none|static]` -- такты, CPI и счётчики
+конвейера рядом с последовательной моделью.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from collections.abc import Iterable
+
+from cache import Cache
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from isa import Opcode, read_code, read_data
+from machine import ControlUnit, DataPath, Signal, m_program, simulation
+from ports import Port, flush_ports
+
+predictors = ("none", "static")
+conditional_jumps = {Opcode.JZ, Opcode.JNZ, Opcode.JS, Opcode.JNS}
+transfers = conditional_jumps | {Opcode.JMP, Opcode.CALL}
+
+
+class PipelinedControlUnit(ControlUnit):
+    __slots__ = (
+        "branches",
+        "fetch_ticks",
+        "final",
+        "flushes",
+        "instructions",
+        "latches_pc",
+        "predictions",
+        "prefetched",
+        "steps",
+    )
+
+    # Микрокоманда завершает микропрограмму и пишет PC -- по адресу mPC
+    final: list[bool]
+    latches_pc: list[bool]
+    # Предсказанный адрес следующей инструкции для каждой инструкции программы
+    predictions: list[int]
+    # Инструкция по адресу PC уже выбрана последним микрошагом предыдущей
+    prefetched: bool
+    instructions: int
+    branches: int
+    flushes: int
+    # Такты выборки, не совмещённые с предыдущей инструкцией
+    fetch_ticks: int
+    # Выполненные микрокоманды; остальные такты -- простой из-за кэша и выгрузки стеков
+    steps: int
+
+    def __init__(self, program, data_path: DataPath, call_stack_capacity, predictor: str = "static"):
+        assert predictor in predictors, "Unknown branch predictor: {}".format(predictor)
+        super().__init__(program, data_path, call_stack_capacity)
+        self.final = [bool(mc & Signal.SEL_MPC_ZERO) for mc in m_program]
+        self.latches_pc = [bool(mc & Signal.LATCH_PC) for mc in m_program]
+        self.predictions = [
+            self.predict(pc, opcode, arg, predictor)
+            for pc, (opcode, arg) in enumerate(zip(self.program.opcodes, self.program.args))
+        ]
+        self.prefetched = False
+        self.instructions = 0
+        self.branches = 0
+        self.flushes = 0
+        self.fetch_ticks = 0
+        self.steps = 0
+
+    @staticmethod
+    def predict(pc: int, opcode: int, arg: int, predictor: str) -> int:
+        if predictor == "static":
+            if opcode in (Opcode.JMP, Opcode.CALL):
+                return arg
+            if opcode in conditional_jumps and arg <= pc:
+                return arg
+        return pc + 1
+
+    def execute_microprogram(self):
+        if self.mpc == 0:
+            # Инструкции считаются при выборке: SEL_MPC_OPCODE также перезапускает цикл микропрограммы outs и ins
+            if self.program.opcodes[self.pc] in transfers:
+                self.branches += 1
+            if self.prefetched:
+                # Инструкция выбрана в предыдущем такте: декодирование без отдельного такта выборки
+                self.prefetched = False
+                self.latch_mpc_opcode()
+                self.instructions += 1
+            else:
+                super().execute_microprogram()
+                self.instructions += 1
+                self.fetch_ticks += 1
+                self.steps += 1
+                return
+        mpc = self.mpc
+        if not self.final[mpc]:
+            super().execute_microprogram()
+            self.steps += 1
+            return
+        # Последний микрошаг: в этом же такте выбирается инструкция по предсказанному адресу
+        fetched = self.predictions[self.pc] if self.latches_pc[mpc] else self.pc
+        super().execute_microprogram()
+        self.steps += 1
+        if fetched == self.pc:
+            self.prefetched = True
+        else:
+            self.flushes += 1
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "instructions": self.instructions,
+            "ticks": self._tick,
+            "cpi": round(self._tick / max(self.instructions, 1), 3),
+            "fetch_ticks": self.fetch_ticks,
+            "branches": self.branches,
+            "flushes": self.flushes,
+            "stall_ticks": self._tick - self.steps,
+        }
+
+    def __str__(self) -> str:
+        return " ".join("{}: {}".format(name, value) for name, value in self.stats().items())
+
+
+def simulation_pipelined(
+    code,
+    data,
+    input_tokens: Iterable[str] | Port,
+    predictor: str = "static",
+    devices: dict[int, Port] | None = None,
+    cache: Cache | None = None,
+    geometry: Geometry | None = None,
+) -> tuple[str, int, PipelinedControlUnit]:
+    """Как `machine.simulation`, но конвейерным устройством управления; третье значение -- его счётчики."""
+    geometry = geometry or Geometry()
+    data_path = DataPath(data, geometry.stack_capacity, input_tokens, devices, cache, geometry)
+    control_unit = PipelinedControlUnit(code, data_path, geometry.call_stack_capacity, predictor)
+    try:
+        while True:
+            control_unit.execute_microprogram()
+            control_unit.tick()
+    except EOFError:
+        logging.warning("Input buffer is empty!")
+    except StopIteration:
+        pass
+
+    flush_ports(data_path.io_ports)
+    return data_path.io_ports[1].text(), control_unit.current_tick(), control_unit
+
+
+def main(code_file, data_file, input_file, predictor="static", geometry: Geometry | None = None):
+    code = read_code(code_file)
+    data = read_data(data_file)
+    with open(input_file, encoding="utf-8") as file:
+        input_tokens = list(file.read())
+
+    output, ticks = simulation(code, list(data), list(input_tokens), geometry=geometry)
+    pipelined_output, pipelined_ticks, control_unit = simulation_pipelined(
+        code, data, input_tokens, predictor, geometry=geometry
+    )
+    assert pipelined_output == output, "Pipelined model output differs from the sequential model"
+    # Обе модели выполняют одну и ту же последовательность инструкций
+    instructions = max(control_unit.instructions, 1)
+
+    print(output)
+    print("{:>12} {:>10} {:>7} {:>10} {:>8}".format("model", "ticks", "CPI", "fetch", "flushes"))
+    print("{:>12} {:>10} {:>7.3f} {:>10} {:>8}".format("sequential", ticks, ticks / instructions, instructions, "-"))
+    print(
+        "{:>12} {:>10} {:>7.3f} {:>10} {:>8}".format(
+            "pipelined", pipelined_ticks, pipelined_ticks / instructions, control_unit.fetch_ticks, control_unit.flushes
+        )
+    )
+    print("pipeline:", control_unit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sequential and the pipelined control unit")
+    parser.add_argument("data_file")
+    parser.add_argument("code_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--predictor", choices=predictors, default="static", help="static branch prediction scheme")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    main(args.code_file, args.data_file, args.input_file, args.predictor, geometry_from_arguments(args))
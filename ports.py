@@ -0,0 +1,119 @@
+"""Устройства ввода-вывода, подключаемые к 16 портам процессора."""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterable, Iterator
+from typing import TextIO
+
+PORTS_COUNT = 16
+
+
+class Port:
+    """Устройство на порту. `read` возвращает один символ или бросает `EOFError`, если данных нет."""
+
+    def read(self) -> str:
+        raise EOFError()
+
+    def write(self, char: str):
+        # Ошибка модели, как нарушенные assert в остальном коде
+        raise AssertionError("{} is read-only".format(type(self).__name__))
+
+    def flush(self):
+        pass
+
+    def text(self) -> str:
+        """Данные, оставшиеся в устройстве после моделирования (вывод программы для буферного порта)."""
+        return ""
+
+
+class BufferPort(Port):
+    """Порт-буфер в памяти: запись добавляет символ в конец, чтение забирает символ из начала за O(1)."""
+
+    def __init__(self, tokens: Iterable[str] = ()):
+        self.buffer: deque[str] = deque(tokens)
+
+    def read(self) -> str:
+        if not self.buffer:
+            raise EOFError()
+        return self.buffer.popleft()
+
+    def write(self, char: str):
+        self.buffer.append(char)
+
+    def text(self) -> str:
+        return "".join(self.buffer)
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.buffer)
+
+    def __str__(self) -> str:
+        # Тот же вид, что у списка символов в журнале состояния процессора
+        return str(list(self.buffer))
+
+
+class StreamInputPort(Port):
+    """Порт ввода из файла или канала: данные читаются лениво, блоками по `chunk_size` символов."""
+
+    def __init__(self, stream: TextIO, chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunk = ""
+        self.pos = 0
+
+    def read(self) -> str:
+        if self.pos == len(self.chunk):
+            self.chunk = self.stream.read(self.chunk_size)
+            self.pos = 0
+            if not self.chunk:
+                raise EOFError()
+        char = self.chunk[self.pos]
+        self.pos += 1
+        return char
+
+    def __str__(self) -> str:
+        return str(list(self.chunk[self.pos :]))
+
+
+class StreamOutputPort(Port):
+    """Порт вывода в поток: символы копятся в небольшом буфере и сбрасываются в поток по мере заполнения."""
+
+    def __init__(self, stream: TextIO, flush_size: int = 1 << 12):
+        self.stream = stream
+        self.flush_size = flush_size
+        self.pending: list[str] = []
+
+    def write(self, char: str):
+        self.pending.append(char)
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write("".join(self.pending))
+        self.pending.clear()
+        self.stream.flush()
+
+    def text(self) -> str:
+        self.flush()
+        return ""
+
+    def __str__(self) -> str:
+        return str(self.pending)
+
+
+def make_ports(input_tokens: Iterable[str] | Port, devices: dict[int, Port] | None = None) -> dict[int, Port]:
+    """Порты процессора: 0 -- ввод (по умолчанию), 1 -- вывод (по умолчанию), `devices` заменяют буферы."""
+    ports: dict[int, Port] = {0: input_tokens if isinstance(input_tokens, Port) else BufferPort(input_tokens)}
+    for num_port in range(1, PORTS_COUNT):
+        ports[num_port] = BufferPort()
+    if devices:
+        ports.update(devices)
+    return ports
+
+
+def flush_ports(ports: dict[int, Port]):
+    for port in ports.values():
+        port.flush()
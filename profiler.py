@@ -0,0 +1,193 @@
+"""Профилировщик программ: такты по адресам инструкций, меткам исходного кода и подпрограммам.
+
+Программа выполняется моделью `InstructionMachine`, поэтому такты совпадают с микропрограммной моделью,
+а накладные расходы -- несколько операций над списками на инструкцию.
+Метки берутся из таблицы символов, которую пишет `translator.py` (четвёртый аргумент).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from collections.abc import Iterable, Iterator
+
+from cache import Cache
+from geometry import Geometry, add_geometry_arguments, geometry_from_arguments
+from image import load_program, program_arguments
+from isa import Opcode, Program, SymbolTable, as_program
+from machine import InstructionMachine
+from ports import Port, flush_ports
+
+
+class Profiler:
+    """Накапливает такты и число выполнений для каждого адреса и для каждого стека вызовов.
+
+    Стек вызовов -- узел дерева `frame_*`: CALL переходит в дочерний узел с именем метки адреса перехода,
+    RET -- в родительский. Корень дерева -- точка входа программы (цель первой инструкции `jmp`).
+    """
+
+    def __init__(self, program, labels: dict[str, int] | None = None):
+        self.program: Program = as_program(program)
+        self.symbols = SymbolTable(labels)
+        self.ticks_by_pc = [0] * len(self.program)
+        self.executions = [0] * len(self.program)
+
+        entry = self.program.args[0] if self.program.opcodes[0] == Opcode.JMP else 0
+        self.frame = 0
+        self.frame_names = [self.function_name(entry)]
+        self.frame_parents = [-1]
+        self.frame_ticks = [0]
+        self.frame_calls = [1]
+        self.frame_children: dict[tuple[int, int], int] = {}
+
+    def location(self, pc: int) -> str:
+        return self.symbols.location(pc)
+
+    def region(self, pc: int) -> str:
+        return self.symbols.region(pc)
+
+    def function_name(self, address: int) -> str:
+        return self.symbols.names.get(address, str(address))
+
+    def account(self, pc: int, next_pc: int | None, ticks: int):
+        self.ticks_by_pc[pc] += ticks
+        self.executions[pc] += 1
+        self.frame_ticks[self.frame] += ticks
+        opcode = self.program.opcodes[pc]
+        if opcode == Opcode.CALL:
+            self.enter(next_pc)
+        elif opcode == Opcode.RET and self.frame:
+            self.frame = self.frame_parents[self.frame]
+
+    def enter(self, address: int):
+        key = (self.frame, address)
+        child = self.frame_children.get(key)
+        if child is None:
+            child = self.frame_children[key] = len(self.frame_names)
+            self.frame_names.append(self.function_name(address))
+            self.frame_parents.append(self.frame)
+            self.frame_ticks.append(0)
+            self.frame_calls.append(0)
+        self.frame_calls[child] += 1
+        self.frame = child
+
+    def total_ticks(self) -> int:
+        return sum(self.ticks_by_pc)
+
+    def stack(self, frame: int) -> list[str]:
+        names = []
+        while frame != -1:
+            names.append(self.frame_names[frame])
+            frame = self.frame_parents[frame]
+        return names[::-1]
+
+    def by_label(self) -> dict[str, int]:
+        ticks: dict[str, int] = {}
+        for pc, value in enumerate(self.ticks_by_pc):
+            if value:
+                label = self.region(pc)
+                ticks[label] = ticks.get(label, 0) + value
+        return ticks
+
+    def by_function(self) -> dict[str, tuple[int, int, int]]:
+        """Имя подпрограммы -> (такты с вложенными вызовами, собственные такты, число вызовов)."""
+        inclusive: dict[str, int] = {}
+        exclusive: dict[str, int] = {}
+        calls: dict[str, int] = {}
+        for frame, ticks in enumerate(self.frame_ticks):
+            name = self.frame_names[frame]
+            exclusive[name] = exclusive.get(name, 0) + ticks
+            calls[name] = calls.get(name, 0) + self.frame_calls[frame]
+            # При рекурсии такты засчитываются подпрограмме один раз
+            for caller in set(self.stack(frame)):
+                inclusive[caller] = inclusive.get(caller, 0) + ticks
+        return {name: (inclusive[name], exclusive[name], calls[name]) for name in calls}
+
+    def folded(self) -> Iterator[str]:
+        """Строки `корень;вызываемая;... такты` для flamegraph.pl, speedscope и подобных инструментов."""
+        for frame, ticks in enumerate(self.frame_ticks):
+            if ticks:
+                yield "{} {}".format(";".join(self.stack(frame)), ticks)
+
+    def report(self, top: int = 10) -> str:
+        total = self.total_ticks() or 1
+        lines = ["ticks: {} instructions: {}".format(self.total_ticks(), sum(self.executions)), "", "labels:"]
+        lines.append("{:>10} {:>7}  {}".format("ticks", "%", "label"))
+        for label, ticks in sorted(self.by_label().items(), key=lambda item: -item[1]):
+            lines.append("{:>10} {:>7.2f}  {}".format(ticks, 100 * ticks / total, label))
+
+        lines += ["", "functions:", "{:>10} {:>10} {:>7}  {}".format("inclusive", "exclusive", "calls", "function")]
+        for name, (inclusive, exclusive, calls) in sorted(self.by_function().items(), key=lambda item: -item[1][0]):
+            lines.append("{:>10} {:>10} {:>7}  {}".format(inclusive, exclusive, calls, name))
+
+        lines += ["", "instructions:", "{:>10} {:>7} {:>5}  {}".format("ticks", "count", "pc", "instruction")]
+        hot = sorted(range(len(self.program)), key=lambda pc: -self.ticks_by_pc[pc])[:top]
+        for pc in hot:
+            if self.executions[pc]:
+                opcode = Opcode(self.program.opcodes[pc]).name.lower()
+                lines.append(
+                    "{:>10} {:>7} {:>5}  {} {} ({})".format(
+                        self.ticks_by_pc[pc], self.executions[pc], pc, opcode, self.program.args[pc], self.location(pc)
+                    )
+                )
+        return "\n".join(lines)
+
+
+def profile(
+    code,
+    data,
+    input_tokens: Iterable[str] | Port,
+    labels=None,
+    devices=None,
+    cache: Cache | None = None,
+    geometry: Geometry | None = None,
+) -> (str, int, Profiler):
+    profiler = Profiler(code, labels)
+    geometry = geometry or Geometry()
+    machine = InstructionMachine(
+        profiler.program,
+        data,
+        input_tokens,
+        geometry.stack_capacity,
+        geometry.call_stack_capacity,
+        devices,
+        cache,
+        geometry,
+    )
+    try:
+        machine.run_profiled(profiler)
+    except EOFError:
+        logging.warning("Input buffer is empty!")
+    except StopIteration:
+        pass
+
+    flush_ports(machine.io_ports)
+    return machine.io_ports[1].text(), machine.current_tick(), profiler
+
+
+def main(code_file, data_file, input_file, symbols_file=None, folded_file=None, top=10, geometry=None):
+    code, data, labels = load_program(code_file, data_file, symbols_file)
+    with open(input_file, encoding="utf-8") as file:
+        output, ticks, profiler = profile(code, data, list(file.read()), labels, geometry=geometry)
+
+    print(output)
+    print("ticks:", ticks)
+    print(profiler.report(top))
+    if folded_file is not None:
+        with open(folded_file, "w", encoding="utf-8") as file:
+            for line in profiler.folded():
+                file.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Program profiler")
+    parser.add_argument(
+        "files", nargs="+", metavar="file", help="image_file input_file or data_file code_file input_file"
+    )
+    parser.add_argument("--symbols", help="symbol table written by translator.py (overrides the image symbols)")
+    parser.add_argument("--folded", help="write folded stacks for flamegraph tools to this file")
+    parser.add_argument("--top", type=int, default=10, help="number of hottest instructions to report")
+    add_geometry_arguments(parser)
+    args = parser.parse_args()
+    code_file, data_file, (input_file,) = program_arguments(args.files)
+    main(code_file, data_file, input_file, args.symbols, args.folded, args.top, geometry_from_arguments(args))
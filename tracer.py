@@ -0,0 +1,478 @@
+"""Компактная бинарная трасса исполнения потактовой модели.
+
+Формат файла (все числа -- varint, знаковые числа -- в zigzag-кодировании):
+
+- заголовок: `TRACE_MAGIC`, версия, ёмкость стека, ёмкость стека вызовов, память данных,
+  начальные значения регистров;
+- по одной записи на такт: байт маски изменившихся регистров, байт событий, [опкод],
+  новые значения изменившихся регистров, данные событий.
+
+Такты простоя (промахи кэша, выгрузка стеков) записываются событием такта, после которого счётчик
+тактов продвинулся больше чем на 1. Выгрузка и загрузка стеков (`geometry.Geometry` со `spill`) сдвигает
+регистры стека целиком, поэтому такой такт записывает стек и стек вызовов полностью.
+
+Запись такта содержит только изменившиеся регистры и ячейки, поэтому её размер и время записи
+не зависят от размера памяти данных.
+"""
+
+from __future__ import annotations
+
+import sys
+from bisect import bisect_left
+from collections.abc import Iterator
+from typing import BinaryIO
+
+from geometry import CALL_SPILL_BASE, STACK_SPILL_BASE
+from isa import Opcode, read_code, read_data
+from machine import ControlUnit, DataPath, Signal, m_program, simulation
+from memory import PagedMemory
+from ports import PORTS_COUNT
+
+TRACE_MAGIC = b"MTRC"
+TRACE_VERSION = 3
+
+# Регистры в порядке битов маски
+registers = ("pc", "mpc", "tos", "sp", "alu", "swr", "arg", "scp")
+
+# События такта
+EVENT_INSTRUCTION = 1  # такт -- выборка новой инструкции, далее следует её опкод
+EVENT_STACK = 1 << 1  # изменились ячейки стека: количество, затем пары (индекс, значение)
+EVENT_DATA = 1 << 2  # запись в память данных: адрес, значение
+EVENT_CALL_STACK = 1 << 3  # запись в стек вызовов: индекс, значение
+EVENT_PORT_WRITE = 1 << 4  # вывод в порт: порт, код символа
+EVENT_PORT_READ = 1 << 5  # ввод из порта: порт, код прочитанного символа
+EVENT_STALL = 1 << 6  # такты простоя сверх одного: их число
+EVENT_SPILL = 1 << 7  # выгрузка или загрузка стеков: записи в память (число, пары адрес-значение), стек, стек вызовов
+
+
+def write_varint(buf: bytearray, value: int):
+    value = value << 1 if value >= 0 else (-value << 1) - 1
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(data: bytes | memoryview, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (result >> 1) ^ -(result & 1), pos
+        shift += 7
+
+
+def microprogram_events(mprogram: int) -> int:
+    """События, которые может породить микрокоманда, -- определяются по её сигналам один раз."""
+    events = 0
+    if mprogram & (Signal.LATCH_SP | Signal.LATCH_SREG):
+        events |= EVENT_STACK
+    if mprogram & Signal.WRITE_DM:
+        events |= EVENT_DATA
+    if mprogram & Signal.LATCH_CALLST:
+        events |= EVENT_CALL_STACK
+    if mprogram & Signal.WRITE_IO:
+        events |= EVENT_PORT_WRITE
+    if mprogram & Signal.LATCH_TOS and mprogram & Signal.SEL_TOS_INPUT:
+        events |= EVENT_PORT_READ
+    return events
+
+
+def spilled_counts(control_unit: ControlUnit) -> tuple[int, int]:
+    return control_unit.data_path.spilled, control_unit.call_spilled
+
+
+def changed_registers(old: tuple[int, ...], new: tuple[int, ...]) -> int:
+    mask = 0
+    for bit, (old_value, new_value) in enumerate(zip(old, new)):
+        if old_value != new_value:
+            mask |= 1 << bit
+    return mask
+
+
+def register_values(control_unit: ControlUnit) -> tuple[int, ...]:
+    data_path = control_unit.data_path
+    return (
+        control_unit.pc,
+        control_unit.mpc,
+        data_path.tos,
+        data_path.stack_pointer,
+        data_path.result_alu,
+        data_path.swap_register,
+        data_path.cu_arg,
+        control_unit.scp,
+    )
+
+
+class TraceRecorder:
+    """Записывает трассу; передаётся в `simulation(..., recorder=...)`."""
+
+    file: BinaryIO = None
+    buffer: bytearray = None
+    events: list[int] = None
+    last: tuple[int, ...] = None
+    # Счётчик тактов и число выгруженных элементов стека и стека вызовов после предыдущего такта
+    last_tick: int = 0
+    last_spilled: tuple[int, int] = (0, 0)
+
+    def __init__(self, file: BinaryIO, flush_size: int = 1 << 16):
+        self.file = file
+        self.flush_size = flush_size
+        self.buffer = bytearray()
+        self.events = [microprogram_events(mprogram) for mprogram in m_program]
+
+    def start(self, control_unit: ControlUnit):
+        data_path = control_unit.data_path
+        buf = self.buffer
+        buf += TRACE_MAGIC
+        for value in (
+            TRACE_VERSION,
+            len(data_path.stack_registers),
+            len(control_unit.call_stack),
+            len(data_path.data_memory),
+            *data_path.data_memory,
+        ):
+            write_varint(buf, value)
+        self.last = register_values(control_unit)
+        for value in self.last:
+            write_varint(buf, value)
+        self.last_tick = control_unit.current_tick()
+        self.last_spilled = spilled_counts(control_unit)
+
+    def record(self, control_unit: ControlUnit):
+        data_path = control_unit.data_path
+        values = register_values(control_unit)
+        # Выполненная за такт микрокоманда -- та, на которую указывал mPC до такта
+        executed_mpc = self.last[1]
+        events = self.tick_events(control_unit, executed_mpc)
+        mask = changed_registers(self.last, values)
+
+        buf = self.buffer
+        buf.append(mask)
+        buf.append(events)
+        if events & EVENT_INSTRUCTION:
+            buf.append(control_unit.program.opcodes[control_unit.pc])
+        for bit, value in enumerate(values):
+            if mask & (1 << bit):
+                write_varint(buf, value)
+        if events & ~EVENT_INSTRUCTION:
+            self.record_events(control_unit, data_path, events)
+        self.last = values
+        self.last_tick = control_unit.current_tick()
+        self.last_spilled = spilled_counts(control_unit)
+        if len(buf) >= self.flush_size:
+            self.flush()
+
+    def tick_events(self, control_unit: ControlUnit, executed_mpc: int) -> int:
+        """События такта: по сигналам микрокоманды, выборка инструкции, такты простоя и выгрузка стеков."""
+        events = self.events[executed_mpc]
+        if executed_mpc == 0:
+            events |= EVENT_INSTRUCTION
+        if control_unit.current_tick() - self.last_tick > 1:
+            events |= EVENT_STALL
+        if spilled_counts(control_unit) != self.last_spilled:
+            events |= EVENT_SPILL
+        return events
+
+    def record_events(self, control_unit: ControlUnit, data_path: DataPath, events: int):
+        buf = self.buffer
+        if events & EVENT_STACK:
+            cells = sorted({self.last[3], data_path.stack_pointer} - {-1})
+            write_varint(buf, len(cells))
+            for index in cells:
+                write_varint(buf, index)
+                write_varint(buf, data_path.stack_registers[index])
+        if events & EVENT_DATA:
+            address = data_path.top_stack_regs()
+            write_varint(buf, address)
+            write_varint(buf, data_path.data_memory[address])
+        if events & EVENT_CALL_STACK:
+            write_varint(buf, control_unit.scp)
+            write_varint(buf, control_unit.call_stack[control_unit.scp])
+        if events & (EVENT_PORT_WRITE | EVENT_PORT_READ):
+            self.record_port_events(data_path, events)
+        if events & (EVENT_STALL | EVENT_SPILL):
+            self.record_stall(control_unit, events)
+
+    def record_stall(self, control_unit: ControlUnit, events: int):
+        buf = self.buffer
+        if events & EVENT_STALL:
+            write_varint(buf, control_unit.current_tick() - self.last_tick - 1)
+        if events & EVENT_SPILL:
+            # Выгрузка пишет в память данных элемент с номером spilled - 1, загрузка память не меняет
+            data_path = control_unit.data_path
+            writes = [
+                base + count - 1
+                for base, count, last in zip(
+                    (STACK_SPILL_BASE, CALL_SPILL_BASE), spilled_counts(control_unit), self.last_spilled
+                )
+                if count > last
+            ]
+            write_varint(buf, len(writes))
+            for address in writes:
+                write_varint(buf, address)
+                write_varint(buf, data_path.data_memory[address])
+            for value in (*data_path.stack_registers, *control_unit.call_stack):
+                write_varint(buf, value)
+
+    def record_port_events(self, data_path: DataPath, events: int):
+        buf = self.buffer
+        if events & EVENT_PORT_WRITE:
+            # Порт записывает TOS на начало такта: в том же такте TOS может измениться (цикл outs)
+            write_varint(buf, data_path.cu_arg)
+            write_varint(buf, self.last[2])
+        if events & EVENT_PORT_READ:
+            write_varint(buf, data_path.cu_arg)
+            write_varint(buf, data_path.tos)
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+
+# Записей трассы между ключевыми кадрами -- копиями состояния, с которых `TraceReader` продолжает чтение
+KEYFRAME_INTERVAL = 4096
+
+
+class TraceState:
+    """Полное состояние процессора, восстановленное из трассы."""
+
+    def __init__(self, stack_capacity, call_stack_capacity, data: list[int]):
+        self.tick = 0
+        self.instruction: Opcode | None = None
+        self.registers = dict.fromkeys(registers, 0)
+        self.stack = [0] * stack_capacity
+        self.call_stack = [0] * call_stack_capacity
+        self.data = PagedMemory(data)
+        # Содержимое буферов портов (записанные и ещё не прочитанные символы) и прочитанные из портов символы
+        self.ports: dict[int, list[str]] = {port: [] for port in range(PORTS_COUNT)}
+        self.consumed: dict[int, list[str]] = {port: [] for port in range(PORTS_COUNT)}
+        self._control_unit: ControlUnit | None = None
+
+    def control_unit(self) -> ControlUnit:
+        """Состояние в виде объектов модели -- для вывода в формате журнала `simulation()`.
+
+        Объекты создаются один раз и разделяют со состоянием стек, стек вызовов, память и порты.
+        """
+        if self._control_unit is None:
+            data_path = DataPath(self.data, len(self.stack), self.ports[0])
+            data_path.stack_registers = self.stack
+            data_path.io_ports = self.ports
+            self._control_unit = ControlUnit([], data_path, len(self.call_stack))
+            self._control_unit.call_stack = self.call_stack
+        control_unit = self._control_unit
+        data_path = control_unit.data_path
+        data_path.tos = self.registers["tos"]
+        data_path.stack_pointer = self.registers["sp"]
+        data_path.result_alu = self.registers["alu"]
+        data_path.swap_register = self.registers["swr"]
+        data_path.cu_arg = self.registers["arg"]
+        control_unit.pc = self.registers["pc"]
+        control_unit.mpc = self.registers["mpc"]
+        control_unit.scp = self.registers["scp"]
+        control_unit._tick = self.tick
+        return control_unit
+
+    def copy(self) -> TraceState:
+        state = TraceState(0, 0, [])
+        state.tick = self.tick
+        state.instruction = self.instruction
+        state.registers = dict(self.registers)
+        state.stack = list(self.stack)
+        state.call_stack = list(self.call_stack)
+        state.data = self.data.copy()
+        state.ports = {port: list(chars) for port, chars in self.ports.items()}
+        state.consumed = {port: list(chars) for port, chars in self.consumed.items()}
+        return state
+
+
+class TraceCursor:
+    """Позиция чтения трассы: состояние после `records` записей, смещение следующей записи и такт
+    предыдущего состояния (-1 для начального)."""
+
+    def __init__(self, state: TraceState, pos: int, records: int = 0, previous_tick: int = -1):
+        self.state = state
+        self.pos = pos
+        self.records = records
+        self.previous_tick = previous_tick
+
+    def copy(self) -> TraceCursor:
+        return TraceCursor(self.state.copy(), self.pos, self.records, self.previous_tick)
+
+
+class TraceReader:
+    """Читает трассу и восстанавливает состояние процессора на любом такте.
+
+    По мере чтения через каждые `KEYFRAME_INTERVAL` записей сохраняются ключевые кадры; `state_at` продолжает
+    с прошлого запроса или с ближайшего ключевого кадра перед нужным тактом, а не с начала трассы.
+    """
+
+    def __init__(self, data: bytes):
+        assert data[: len(TRACE_MAGIC)] == TRACE_MAGIC, "Not a trace file"
+        self.data = memoryview(data)
+        self.pos = len(TRACE_MAGIC)
+        trace_version = self.read()
+        assert trace_version == TRACE_VERSION, "Unsupported trace version: {}".format(trace_version)
+        self.stack_capacity = self.read()
+        self.call_stack_capacity = self.read()
+        self.initial_data = [self.read() for _ in range(self.read())]
+        self.initial_registers = [self.read() for _ in registers]
+        self.records_pos = self.pos
+
+        initial = TraceState(self.stack_capacity, self.call_stack_capacity, self.initial_data)
+        initial.registers.update(zip(registers, self.initial_registers))
+        self.keyframes = [TraceCursor(initial, self.records_pos)]
+        self.keyframe_ticks = [initial.tick]
+        self.cursor = self.keyframes[0].copy()
+
+    @classmethod
+    def from_file(cls, filename) -> TraceReader:
+        with open(filename, "rb") as file:
+            return cls(file.read())
+
+    def read(self) -> int:
+        value, self.pos = read_varint(self.data, self.pos)
+        return value
+
+    def states(self, first_tick: int = 0) -> Iterator[TraceState]:
+        """Состояние, покрывающее такт `first_tick` (по умолчанию -- до первого такта), затем после каждого
+        такта (один и тот же изменяемый объект, независимый от `state_at`)."""
+        cursor = self.seek(first_tick)
+        yield cursor.state
+        while self.advance(cursor):
+            yield cursor.state
+
+    def state_at(self, tick: int) -> TraceState:
+        """Первое состояние с `state.tick >= tick`: такт простоя покрывает состояние после него.
+
+        Возвращает изменяемое состояние курсора, которое следующий вызов перезапишет.
+        """
+        self.cursor = self.seek(tick, self.cursor)
+        return self.cursor.state
+
+    def seek(self, tick: int, cursor: TraceCursor | None = None) -> TraceCursor:
+        """Курсор на первом состоянии с `state.tick >= tick`: `cursor`, если он не дальше нужного такта
+        и ближе ключевого кадра, иначе копия ключевого кадра."""
+        index = max(bisect_left(self.keyframe_ticks, tick) - 1, 0)
+        if cursor is None or tick <= cursor.previous_tick or self.keyframe_ticks[index] > cursor.state.tick:
+            cursor = self.keyframes[index].copy()
+        while cursor.state.tick < tick:
+            if not self.advance(cursor):
+                raise IndexError("Trace has no tick {}".format(tick))
+        return cursor
+
+    def advance(self, cursor: TraceCursor) -> bool:
+        """Применяет к курсору следующую запись; False -- трасса кончилась."""
+        if cursor.pos >= len(self.data):
+            return False
+        cursor.previous_tick = cursor.state.tick
+        self.pos = cursor.pos
+        self.apply(cursor.state)
+        cursor.pos = self.pos
+        cursor.records += 1
+        if cursor.records % KEYFRAME_INTERVAL == 0 and cursor.records > self.keyframes[-1].records:
+            self.keyframes.append(cursor.copy())
+            self.keyframe_ticks.append(cursor.state.tick)
+        return True
+
+    def apply(self, state: TraceState):
+        mask, events = self.data[self.pos], self.data[self.pos + 1]
+        self.pos += 2
+        state.tick += 1
+        state.instruction = None
+        if events & EVENT_INSTRUCTION:
+            state.instruction = Opcode(self.data[self.pos])
+            self.pos += 1
+        for bit, name in enumerate(registers):
+            if mask & (1 << bit):
+                state.registers[name] = self.read()
+        if events & ~EVENT_INSTRUCTION:
+            self.apply_events(state, events)
+
+    def apply_events(self, state: TraceState, events: int):
+        if events & EVENT_STACK:
+            for _ in range(self.read()):
+                index = self.read()
+                state.stack[index] = self.read()
+        if events & EVENT_DATA:
+            address = self.read()
+            state.data[address] = self.read()
+        if events & EVENT_CALL_STACK:
+            index = self.read()
+            state.call_stack[index] = self.read()
+        if events & (EVENT_PORT_WRITE | EVENT_PORT_READ):
+            self.apply_port_events(state, events)
+        if events & (EVENT_STALL | EVENT_SPILL):
+            self.apply_stall(state, events)
+
+    def apply_stall(self, state: TraceState, events: int):
+        if events & EVENT_STALL:
+            state.tick += self.read()
+        if events & EVENT_SPILL:
+            for _ in range(self.read()):
+                address = self.read()
+                state.data[address] = self.read()
+            state.stack[:] = [self.read() for _ in state.stack]
+            state.call_stack[:] = [self.read() for _ in state.call_stack]
+
+    def apply_port_events(self, state: TraceState, events: int):
+        if events & EVENT_PORT_WRITE:
+            port = self.read()
+            state.ports[port].append(chr(self.read()))
+        if events & EVENT_PORT_READ:
+            port = self.read()
+            state.consumed[port].append(chr(self.read()))
+            # Порт 0 получает ввод извне, остальные порты отдают ранее записанные в них символы
+            if port != 0 and state.ports[port]:
+                state.ports[port].pop(0)
+
+
+def render(reader: TraceReader, first_tick: int, last_tick: int) -> Iterator[str]:
+    """Сообщения журнала `simulation()` (уровни INFO и DEBUG) для тактов из отрезка [first_tick; last_tick]."""
+    for state in reader.states(first_tick):
+        if state.tick > last_tick:
+            break
+        if state.instruction is not None:
+            yield "INSTRUCTION: {}, PC: {}".format(state.instruction.name, state.registers["pc"])
+        yield repr(state.control_unit())
+
+
+def record(code_file, data_file, input_file, trace_file):
+    code = read_code(code_file)
+    data = read_data(data_file)
+    with open(input_file, encoding="utf-8") as file:
+        input_token = list(file.read())
+
+    with open(trace_file, "wb") as file:
+        recorder = TraceRecorder(file)
+        output, ticks = simulation(code, data, input_token, recorder=recorder)
+        recorder.flush()
+
+    print("".join(output))
+    print("ticks:", ticks)
+
+
+def main(trace_file, first_tick, last_tick):
+    reader = TraceReader.from_file(trace_file)
+    for message in render(reader, int(first_tick), int(last_tick)):
+        print(message)
+
+
+if __name__ == "__main__":
+    usage = (
+        "Wrong arguments: tracer.py record <data_file> <code_file> <input_file> <trace_file>"
+        " | tracer.py render <trace_file> <first_tick> <last_tick>"
+    )
+    assert len(sys.argv) >= 2, usage
+    assert sys.argv[1] in {"record", "render"}, usage
+    if sys.argv[1] == "record":
+        assert len(sys.argv) == 6, usage
+        _, _, data_file, code_file, input_file, trace_file = sys.argv
+        record(code_file, data_file, input_file, trace_file)
+    else:
+        assert len(sys.argv) == 5, usage
+        _, _, trace_file, first_tick, last_tick = sys.argv
+        main(trace_file, first_tick, last_tick)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-import sys
-from itertools import chain
+import argparse
+import re
 
-from isa import Opcode, write_code, write_data
+from image import source_lines, write_image
+from isa import Opcode, write_code, write_data, write_symbols
 
 
 def find_substring_row(text: list[str], substr) -> int:
@@ -17,91 +18,56 @@ def find_substring_row(text: list[str], substr) -> int:
     return num_str_decl_section
 
 
-def remove(s: str, indexes: list[int]) -> str:
-    new_s: str = ""
-    for ind, x in enumerate(s):
-        if ind not in indexes:
-            new_s += x
-    return new_s
-
-
-def remove_double_comma(s: str) -> str:
-    new_s = ""
-    last_is_comma: bool = False
-    for x in s:
-        if x == "," and not last_is_comma:
-            new_s += x
-            last_is_comma = True
-        elif x != ",":
-            new_s += x
-            last_is_comma = False
-    return new_s
-
-
-def make_reservation(data) -> str:
-    for i in range(len(data)):
-        if "res" in data[i]:
-            cnt = int(data[i].replace("res", ""))
-            data[i] = [0] * cnt
-    return data
-
-
-def get_integers(data: str, ind_chars_in_quotes: list[int]) -> list[list[int] | int]:
-    int_data = remove(data, ind_chars_in_quotes)
-    # Могут появиться после удаления две запятые подряд - их надо почистить
-    int_data = remove_double_comma(int_data)
-    # Удаление комментариев
-    int_data = int_data.split(";")[0].strip()
-    # все res x заменить на x нулей
-    int_data = make_reservation(int_data.split(","))
-    int_data = list(filter(lambda s: s != " " and s != "", int_data))
-    int_data = [x if isinstance(x, list) else int(x) for x in int_data]
-    for x in int_data:
-        if not isinstance(x, list):
-            assert -(1 << 31) <= x <= (1 << 31) - 1, "Integer must take values in the segment [-2^31; 2^31 - 1]"
-    return int_data
-
-
-def str2list_int(data: str) -> (list[list[int]], list[int]):
-    in_quotes: bool = False
-    # Массив, в котором хранятся индексы элементов, взятых в кавычки (включая кавычки)
-    # Нужен, чтобы после первого прохода по данным в метке, очистить данные от строк
-    ind_chars_in_quotes: list[int] = []
-    # Массив, в котором на i-ой позиции пустой массив, если на i-ой позиции в data
-    # был одиночный байт или резервация, иначе там была строка и этот массив
-    # -- последовательность байт строки
-    list_codes: list[list[int]] = [[]]
-    for index, x in enumerate(data):
-        if x == '"':
-            in_quotes = not in_quotes
-            ind_chars_in_quotes.append(index)
-        elif in_quotes:
-            list_codes[-1].append(ord(x))
-            ind_chars_in_quotes.append(index)
-        elif x == ",":
-            list_codes.append([])
-
-    return list_codes, ind_chars_in_quotes
+# Лексемы объявления данных: строка в кавычках (закрывающая кавычка может отсутствовать), начало комментария,
+# элемент между запятыми (число или `res n`) и запятая
+data_tokens = re.compile(r'"(?P<string>[^"]*)"?|(?P<comment>;)|(?P<item>[^,;"]+)|,')
 
 
 def get_codes_from_data(data: str) -> list[int]:
-    list_codes, ind_chars_in_quotes = str2list_int(data)
+    """Разбор объявления данных за один линейный проход: строки, числа, `res n` и комментарий."""
+    codes: list[int] = []
+    for token in data_tokens.finditer(data):
+        kind = token.lastgroup
+        if kind == "string":
+            codes.extend(map(ord, token["string"]))
+        elif kind == "comment":
+            break
+        elif kind == "item":
+            item = token["item"].strip()
+            if not item:
+                continue
+            # res x -- x нулей
+            if "res" in item:
+                codes.extend([0] * int(item.replace("res", "")))
+                continue
+            value = int(item)
+            assert -(1 << 31) <= value <= (1 << 31) - 1, "Integer must take values in the segment [-2^31; 2^31 - 1]"
+            codes.append(value)
+    return codes
+
+
+# Директивы раздельной трансляции: `global name[, name...]` и `extern name[, name...]` (см. `linker.py`)
+directive_keywords = {"global", "extern"}
 
-    int_data = get_integers(data, ind_chars_in_quotes)
-    ind_list_codes = 0
-    for x in int_data:
-        cur_list = list_codes[ind_list_codes]
-        while cur_list:
-            ind_list_codes += 1
-            cur_list = list_codes[ind_list_codes]
 
-        if isinstance(x, list):
-            for el in x:
-                cur_list.append(el)
-        else:
-            cur_list.append(x)
-    # Выпрямление list_codes в один лист
-    return list(chain.from_iterable(list_codes))
+def parse_directive(token: str) -> tuple[str, list[str]] | None:
+    keyword, _, names = token.partition(" ")
+    if keyword not in directive_keywords:
+        return None
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    assert names, "{} must name at least one label".format(keyword)
+    return keyword, names
+
+
+def get_directives(text: list[str]) -> (set[str], set[str]):
+    """Имена, объявленные в `global` и `extern`."""
+    declared: dict[str, set[str]] = {keyword: set() for keyword in directive_keywords}
+    for line in text:
+        directive = parse_directive(get_meaningful_token(line))
+        if directive is not None:
+            keyword, names = directive
+            declared[keyword].update(names)
+    return declared["global"], declared["extern"]
 
 
 def get_data(text: list[str]) -> dict[str, list[int]]:
@@ -111,7 +77,7 @@ def get_data(text: list[str]) -> dict[str, list[int]]:
         line: str = text[i].strip()
         if ".text" in line:
             break
-        if not line:
+        if not line or parse_directive(get_meaningful_token(line)) is not None:
             continue
 
         label, data = line.split(":", 1)
@@ -146,6 +112,17 @@ def name2opcode() -> dict[str, Opcode]:
         "store": Opcode.STORE,
         "swap": Opcode.SWAP,
         "hlt": Opcode.HLT,
+        "dup": Opcode.DUP,
+        "over": Opcode.OVER,
+        "rot": Opcode.ROT,
+        "drop2": Opcode.DROP2,
+        "mod": Opcode.MOD,
+        "cmp": Opcode.CMP,
+        "addp": Opcode.ADDP,
+        "subp": Opcode.SUBP,
+        "divp": Opcode.DIVP,
+        "outs": Opcode.OUTS,
+        "ins": Opcode.INS,
     }
 
 
@@ -160,6 +137,8 @@ def cmd_with_args():
         Opcode.CALL,
         Opcode.INPUT,
         Opcode.OUTPUT,
+        Opcode.OUTS,
+        Opcode.INS,
     }
 
 
@@ -167,17 +146,22 @@ def get_meaningful_token(line: str) -> str:
     return line.split(";", 1)[0].strip()
 
 
-def translate_stage_1(text: list[str]) -> (dict[str, int], list[dict[str, Opcode | str | int]]):
+def translate_stage_1(text: list[str], entry: bool = True) -> (dict[str, int], list[dict[str, Opcode | str | int]]):
     # аргументом может быть или лейбл, или число
     # Opcode - в параметре опкода
+    # entry -- начинать код с перехода на _main (объектные модули `linker.py` транслируются без него)
+    # line -- номер строки исходного текста (для таблицы строк образа, см. `image.py`)
     code: list[dict[str, Opcode | str | int]] = []
     labels: dict[str, int] = {}
-    code.append({"index": 0, "opcode": Opcode.JMP, "arg": "_main"})
+    if entry:
+        code.append({"index": 0, "opcode": Opcode.JMP, "arg": "_main"})
+    opcodes = name2opcode()
+    opcodes_with_arg = cmd_with_args()
     num_str_decl_section: int = find_substring_row(text, ".text")
     for ind in range(num_str_decl_section + 1, len(text)):
         raw_line = text[ind]
         token = get_meaningful_token(raw_line)
-        if token == "" or ".data" in token:
+        if token == "" or ".data" in token or parse_directive(token) is not None:
             continue
 
         pc = len(code)
@@ -189,24 +173,127 @@ def translate_stage_1(text: list[str]) -> (dict[str, int], list[dict[str, Opcode
             sub_tokens = token.split(" ")
             assert len(sub_tokens) == 2, "Invalid instruction: {}".format(token)
             mnemonic, arg = sub_tokens
-            opcode = name2opcode().get(mnemonic)
-            assert opcode in cmd_with_args(), "{} must have zero argument".format(Opcode(opcode).name)
-            code.append({"index": pc, "opcode": opcode, "arg": arg})
+            opcode = opcodes.get(mnemonic)
+            assert opcode in opcodes_with_arg, "{} must have zero argument".format(Opcode(opcode).name)
+            code.append({"index": pc, "opcode": opcode, "arg": arg, "line": ind + 1})
         else:  # токен содержит инструкцию без операндов
-            opcode = name2opcode().get(token)
-            assert opcode not in cmd_with_args(), "{} must have one argument".format(Opcode(opcode).name)
-            code.append({"index": pc, "opcode": opcode})
+            opcode = opcodes.get(token)
+            assert opcode not in opcodes_with_arg, "{} must have one argument".format(Opcode(opcode).name)
+            code.append({"index": pc, "opcode": opcode, "line": ind + 1})
 
     return labels, code
 
 
+# Пары соседних инструкций, которые вместе не меняют состояние процессора: вторая инструкция
+# отменяет первую (push/АЛУ кладут прежний TOS в стек, pop возвращает его в TOS; swap обратен сам себе)
+redundant_pairs: set[tuple[Opcode, Opcode]] = {
+    (Opcode.PUSH, Opcode.POP),
+    (Opcode.SWAP, Opcode.SWAP),
+    (Opcode.INC, Opcode.POP),
+    (Opcode.DEC, Opcode.POP),
+    (Opcode.ADD, Opcode.POP),
+    (Opcode.SUB, Opcode.POP),
+    (Opcode.MUL, Opcode.POP),
+    (Opcode.DUP, Opcode.POP),
+    (Opcode.OVER, Opcode.POP),
+}
+
+# Инструкции, аргумент которых -- метка памяти команд
+jump_opcodes = {Opcode.JMP, Opcode.JZ, Opcode.JNZ, Opcode.JS, Opcode.JNS, Opcode.CALL}
+
+
+class PeepholeOptimizer:
+    """Оптимизирующий проход между `translate_stage_1` и `translate_stage_2`.
+
+    Работает с символическими метками, поэтому после удаления инструкций адреса меток просто пересчитываются.
+    Правила (применяются, пока что-то меняется):
+    - переходы на безусловный `jmp` перенаправляются сразу на его цель;
+    - удаляются пары из `redundant_pairs`, если на вторую инструкцию пары нет метки;
+    - удаляются переходы на следующую инструкцию (условные переходы не меняют стек);
+    - удаляется недостижимый код после `jmp`, `ret` и `hlt` до ближайшей метки.
+
+    Правила сохраняют вывод и состояние памяти любой программы, которая без оптимизации не завершается
+    ошибкой (переполнением стека и т.п.). `removed` -- число удалённых инструкций по правилам.
+    """
+
+    def __init__(self):
+        self.removed: dict[str, int] = {"pairs": 0, "jumps to next": 0, "unreachable": 0}
+        self.threaded = 0
+
+    def total_removed(self) -> int:
+        return sum(self.removed.values())
+
+    def optimize(
+        self, labels: dict[str, int], code: list[dict[str, Opcode | str | int]]
+    ) -> (dict[str, int], list[dict[str, Opcode | str | int]]):
+        while True:
+            self.thread_jumps(labels, code)
+            removed = self.redundant(labels, code)
+            if not removed:
+                return labels, code
+            labels, code = self.compact(labels, code, removed)
+
+    def thread_jumps(self, labels: dict[str, int], code: list[dict[str, Opcode | str | int]]):
+        for instruction in code:
+            if instruction["opcode"] not in jump_opcodes:
+                continue
+            label = instruction["arg"]
+            seen: set[str] = set()
+            while label in labels and label not in seen and labels[label] < len(code):
+                seen.add(label)
+                target = code[labels[label]]
+                if target["opcode"] is not Opcode.JMP:
+                    break
+                label = target["arg"]
+            if label != instruction["arg"]:
+                instruction["arg"] = label
+                self.threaded += 1
+
+    def redundant(self, labels: dict[str, int], code: list[dict[str, Opcode | str | int]]) -> set[int]:
+        targets = set(labels.values())
+        removed: set[int] = set()
+        pc = 0
+        while pc < len(code):
+            opcode = code[pc]["opcode"]
+            if pc + 1 < len(code) and pc + 1 not in targets and (opcode, code[pc + 1]["opcode"]) in redundant_pairs:
+                removed |= {pc, pc + 1}
+                self.removed["pairs"] += 2
+                pc += 2
+                continue
+            if opcode in jump_opcodes - {Opcode.CALL} and labels.get(code[pc]["arg"]) == pc + 1:
+                removed.add(pc)
+                self.removed["jumps to next"] += 1
+            elif opcode in {Opcode.JMP, Opcode.RET, Opcode.HLT}:
+                while pc + 1 < len(code) and pc + 1 not in targets:
+                    pc += 1
+                    removed.add(pc)
+                    self.removed["unreachable"] += 1
+            pc += 1
+        return removed
+
+    @staticmethod
+    def compact(
+        labels: dict[str, int], code: list[dict[str, Opcode | str | int]], removed: set[int]
+    ) -> (dict[str, int], list[dict[str, Opcode | str | int]]):
+        # new_index[pc] -- адрес, который получит инструкция pc (или следующая за ней оставшаяся)
+        new_index: list[int] = []
+        kept: list[dict[str, Opcode | str | int]] = []
+        for pc, instruction in enumerate(code):
+            new_index.append(len(kept))
+            if pc not in removed:
+                instruction["index"] = len(kept)
+                kept.append(instruction)
+        new_index.append(len(kept))
+        return {label: new_index[pc] for label, pc in labels.items()}, kept
+
+
 def translate_stage_2(
     labels: dict[str, int], code: list[dict[str, Opcode | str | int]], labels2data: dict[str, list[int]]
 ):
     labels2num: dict[str, int] = get_labels_to_num(labels2data)
     for instruction in code:
         if "arg" in instruction:
-            if instruction["opcode"] in {Opcode.INPUT, Opcode.OUTPUT}:
+            if instruction["opcode"] in {Opcode.INPUT, Opcode.OUTPUT, Opcode.OUTS, Opcode.INS}:
                 assert 0 <= int(instruction["arg"]) <= 15, "Number of port must take values in the segment [0; 15]"
                 continue
 
@@ -227,8 +314,16 @@ def translate_stage_2(
 
 
 def translate_code(text: list[str], labels2data: dict[str, list[int]]) -> list[dict[str, Opcode | str | int]]:
+    return translate_code_with_labels(text, labels2data)[1]
+
+
+def translate_code_with_labels(
+    text: list[str], labels2data: dict[str, list[int]], optimizer: PeepholeOptimizer | None = None
+) -> (dict[str, int], list[dict[str, Opcode | str | int]]):
     labels, code = translate_stage_1(text)
-    return translate_stage_2(labels, code, labels2data)
+    if optimizer is not None:
+        labels, code = optimizer.optimize(labels, code)
+    return labels, translate_stage_2(labels, code, labels2data)
 
 
 def get_labels_to_num(labels2data: dict[str, list[int]]) -> dict[str, int]:
@@ -247,23 +342,50 @@ def is_number(s: str) -> bool:
 
 
 def translate(text: str) -> (dict[str, list[int]], list[dict[str, Opcode | int]]):
+    labels2data, code, _ = translate_with_labels(text)
+    return labels2data, code
+
+
+def translate_with_labels(
+    text: str, optimizer: PeepholeOptimizer | None = None
+) -> (dict[str, list[int]], list[dict[str, Opcode | int]], dict[str, int]):
+    """Трансляция, дополнительно возвращающая адреса меток секции `.text`; `optimizer` -- см. `PeepholeOptimizer`."""
     text = text.splitlines()
     labels2data = get_data(text)
-    code = translate_code(text, labels2data)
-    return labels2data, code
+    labels, code = translate_code_with_labels(text, labels2data, optimizer)
+    return labels2data, code, labels
 
 
-def main(source_file, target_data_file, target_program_file):
+def main(source_file, target_data_file, target_program_file=None, target_symbols_file=None, optimize=False):
+    """Без `target_program_file` программа пишется одним образом (см. `image.py`) в `target_data_file`."""
     with open(source_file, encoding="utf-8") as f:
         source = f.read()
 
-    data, code = translate(source)
-    write_data(target_data_file, data)
-    write_code(target_program_file, code)
+    optimizer = PeepholeOptimizer() if optimize else None
+    data, code, labels = translate_with_labels(source, optimizer)
+    if target_program_file is None:
+        write_image(target_data_file, code, data, labels, source_lines(code))
+    else:
+        write_data(target_data_file, data)
+        write_code(target_program_file, code)
+    if target_symbols_file is not None:
+        write_symbols(target_symbols_file, labels)
     print("source LoC:", len(source.split("\n")), "code instr:", len(code))
+    if optimizer is not None:
+        details = ", ".join("{}: {}".format(rule, count) for rule, count in optimizer.removed.items())
+        print(
+            "optimizer removed:",
+            optimizer.total_removed(),
+            "({}, threaded jumps: {})".format(details, optimizer.threaded),
+        )
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 4, "Wrong arguments: translator.py <input_file> <target_data_file> " "<target_program_file>"
-    _, source_file, target_data_file, target_program_file = sys.argv
-    main(source_file, target_data_file, target_program_file)
+    parser = argparse.ArgumentParser(description="Assembler translator")
+    parser.add_argument("source_file")
+    parser.add_argument("target_data_file", help="data file, or the program image if no code file is given")
+    parser.add_argument("target_program_file", nargs="?")
+    parser.add_argument("target_symbols_file", nargs="?", help="write code label addresses to this file")
+    parser.add_argument("-O", "--optimize", action="store_true", help="run the peephole optimizer")
+    args = parser.parse_args()
+    main(args.source_file, args.target_data_file, args.target_program_file, args.target_symbols_file, args.optimize)